@@ -0,0 +1,236 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import urllib.request
+
+from channels.layers import get_channel_layer
+from django.core.exceptions import ImproperlyConfigured
+
+from .metrics import ALERTS
+
+
+logger = logging.getLogger(__name__)
+
+
+# Channel layer group the video stream sockets join for alert notifications
+ALERTS_GROUP = 'ppe_alerts'
+
+DEFAULT_RULES = [
+    {'name': 'missing-ppe', 'class_ids': [1, 2], 'dwell': 3.0, 'cooldown': 30.0},
+]
+
+
+class AlertRule:
+    # Fires once a track of one of class_ids (inside one of zones, if set)
+    # has been in view for dwell seconds, then at most once per cooldown
+    # seconds for the same track
+
+    def __init__(self, name, class_ids=(), zones=(), dwell=3.0, cooldown=30.0):
+        self.name = name
+        self.class_ids = set(class_ids)
+        self.zones = set(zones)
+        self.dwell = dwell
+        self.cooldown = cooldown
+
+    def matches(self, detection):
+        if self.class_ids and detection['class_id'] not in self.class_ids:
+            return False
+        return not self.zones or detection.get('zone') in self.zones
+
+
+class AlertEngine:
+    # Per-camera rule evaluation on the tracked detections of each frame.
+    # Runs in the pipeline thread and only queues alerts, so sinks can
+    # never hold up inference.
+
+    def __init__(self, camera_id, rules, dispatch, forget_after=1.0):
+        self.camera_id = camera_id
+        self.rules = rules
+        self.dispatch = dispatch
+        self.forget_after = forget_after  # Tolerates short detection gaps
+        self.first_seen = {}  # (rule name, track_id) -> time the track started matching
+        self.last_seen = {}
+        self.last_alert = {}
+
+    def update(self, detections, now, timestamp):
+        # Returns the alerts fired by this frame
+        fired = []
+        for detection in detections:
+            for rule in self.rules:
+                if not rule.matches(detection):
+                    continue
+                key = (rule.name, detection['track_id'])
+                self.first_seen.setdefault(key, now)
+                self.last_seen[key] = now
+
+                duration = now - self.first_seen[key]
+                if duration >= rule.dwell and now - self.last_alert.get(key, float('-inf')) >= rule.cooldown:
+                    self.last_alert[key] = now
+                    ALERTS.inc(rule=rule.name, camera=self.camera_id)
+                    alert = {
+                        'rule': rule.name,
+                        'camera_id': self.camera_id,
+                        'track_id': detection['track_id'],
+                        'class_id': detection['class_id'],
+                        'class_name': detection['class_name'],
+                        'zone': detection.get('zone'),
+                        'confidence': detection['confidence'],
+                        'duration': round(duration, 2),
+                        'timestamp': timestamp,
+                    }
+                    fired.append(alert)
+                    self.dispatch(alert)
+
+        for key, seen in list(self.last_seen.items()):
+            if now - seen > self.forget_after:
+                del self.first_seen[key], self.last_seen[key]
+        for key, alerted in list(self.last_alert.items()):
+            if key not in self.last_seen and now - alerted > self.forget_after:
+                del self.last_alert[key]
+        return fired
+
+
+class SoundSink:
+    # Plays the alert sound; disables itself if there is no audio device
+
+    def __init__(self, sound):
+        self.sound = sound  # LazyResource, the mixer is only opened on the first alert
+        self.enabled = True
+
+    def __call__(self, alert):
+        if not self.enabled:
+            return
+        try:
+            self.sound.get().play()
+        except Exception as exc:
+            self.enabled = False
+            logger.warning("Sound alerts disabled: %s", exc)
+
+
+class WebhookSink:
+    # POSTs each alert as JSON
+
+    def __init__(self, url, timeout=2.0):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, alert):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(alert).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class WebSocketSink:
+    # Sends each alert to the video stream sockets through the channel layer
+
+    def __init__(self, group=ALERTS_GROUP):
+        self.group = group
+        self.loop = None
+
+    def bind(self, loop):
+        self.loop = loop
+
+    def __call__(self, alert):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        message = {'type': 'alert.message', 'alert': alert}
+        future = asyncio.run_coroutine_threadsafe(get_channel_layer().group_send(self.group, message), loop)
+        # The send runs on the event loop, after the dispatcher moved on
+        future.add_done_callback(self.sent)
+
+    def sent(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Error sending alert to the video stream sockets", exc_info=future.exception())
+
+
+class LogSink:
+    def __call__(self, alert):
+        logger.warning("Alert %s! Object ID %s with Class ID %s detected for %.2f seconds on camera %s!",
+                       alert['rule'], alert['track_id'], alert['class_id'], alert['duration'], alert['camera_id'])
+
+
+class NullSink:
+    def __call__(self, alert):
+        pass
+
+
+class AlertDispatcher(threading.Thread):
+    # Delivers queued alerts to every sink from its own thread. A full queue
+    # drops alerts instead of blocking the caller, and a failing sink does
+    # not keep the others from getting the alert.
+
+    def __init__(self, sinks, max_queue=1000):
+        super().__init__(name='ppe-alerts', daemon=True)
+        self.sinks = sinks
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(max_queue)
+        self._stop_event = threading.Event()
+
+    def dispatch(self, alert):
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.dropped += 1
+
+    def bind(self, loop):
+        for sink in self.sinks:
+            if hasattr(sink, 'bind'):
+                sink.bind(loop)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                alert = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            for sink in self.sinks:
+                try:
+                    sink(alert)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Error in alert sink %s", type(sink).__name__)
+            self.sent += 1
+
+    def stop(self, timeout=2):
+        self._stop_event.set()
+        self.join(timeout)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+def make_rules(configs):
+    return [AlertRule(**config) for config in configs]
+
+
+def make_sink(name, settings, sound=None):
+    # 'sound', 'webhook', 'websocket', 'log' or 'null'
+    if name == 'sound':
+        return SoundSink(sound)
+    if name == 'webhook':
+        url = getattr(settings, 'PPE_ALERT_WEBHOOK_URL', None)
+        if not url:
+            raise ImproperlyConfigured("The 'webhook' alert sink needs PPE_ALERT_WEBHOOK_URL")
+        return WebhookSink(url, getattr(settings, 'PPE_ALERT_WEBHOOK_TIMEOUT', 2.0))
+    if name == 'websocket':
+        return WebSocketSink()
+    if name == 'log':
+        return LogSink()
+    if name == 'null':
+        return NullSink()
+    raise ValueError(f"Unknown alert sink {name!r}")
@@ -0,0 +1,159 @@
+from collections import Counter
+
+from .retention import DETECTION_COLUMNS, raw_partitions
+
+
+EVENT_COLUMNS = ('id', 'class_id', 'class_name', 'confidence', 'track_id', 'bbox',
+                 'timestamp', 'last_seen', 'frame_count', 'camera_id', 'status', 'clip_path')
+
+# bbox is formatted from the numeric columns as it used to be stored
+EVENT_SELECT = '''SELECT id, class_id, class_name, confidence, track_id,
+                         '(' || x1 || ', ' || y1 || ', ' || x2 || ', ' || y2 || ')',
+                         first_seen, last_seen, frame_count, camera_id, status, clip_path
+                  FROM track_events'''
+
+# Detections by time of day, keyed by hour // 6
+TIME_BUCKETS = {
+    1: '6 AM - 12 PM',
+    2: '12 PM - 6 PM',
+    3: '6 PM - 12 AM',
+    0: '12 AM - 6 AM',
+}
+
+MAX_PAGE_SIZE = 1000
+
+# Columns of an event export; the box stays numeric instead of the bbox text
+EXPORT_EVENT_COLUMNS = ('id', 'camera_id', 'track_id', 'class_id', 'class_name', 'confidence',
+                        'x1', 'y1', 'x2', 'y2', 'first_seen', 'last_seen', 'frame_count', 'status', 'clip_path')
+
+
+def time_bucket(timestamp):
+    # Time-of-day label of a 'YYYY-MM-DD HH:MM:SS' timestamp
+    return TIME_BUCKETS[int(timestamp[11:13]) // 6]
+
+
+def fetch_events(conn, since_id=None, before_id=None, limit=100):
+    # Cursor-based paging on the primary key, newest first.
+    # since_id returns only events added after that id (incremental polling),
+    # before_id returns the page of older events below that id.
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    conditions, params = [], []
+    if since_id is not None:
+        conditions.append('id > ?')
+        params.append(since_id)
+    if before_id is not None:
+        conditions.append('id < ?')
+        params.append(before_id)
+
+    query = EVENT_SELECT
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    # When catching up, take the oldest new events first so a backlog larger
+    # than one page is picked up over the next polls instead of skipped
+    query += ' ORDER BY id ASC LIMIT ?' if since_id is not None else ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+    rows = conn.execute(query, params).fetchall()
+    return rows[::-1] if since_id is not None else rows
+
+
+def export_filters(time_column, start=None, end=None, class_ids=(), camera_id=None, track_id=None):
+    # WHERE conditions and parameters of an export; start and end are
+    # inclusive 'YYYY-MM-DD HH:MM:SS' bounds
+    conditions, params = [], []
+    if start is not None:
+        conditions.append(f'{time_column} >= ?')
+        params.append(start)
+    if end is not None:
+        conditions.append(f'{time_column} <= ?')
+        params.append(end)
+    if class_ids:
+        conditions.append(f"class_id IN ({', '.join('?' * len(class_ids))})")
+        params.extend(class_ids)
+    if camera_id is not None:
+        conditions.append('camera_id = ?')
+        params.append(camera_id)
+    if track_id is not None:
+        conditions.append('track_id = ?')
+        params.append(track_id)
+    return conditions, params
+
+
+def iter_chunks(conn, table, columns, conditions, params, chunk_size, first_id=0):
+    # Keyset paging on the primary key: every query reads at most chunk_size
+    # rows after the last id seen, so memory does not grow with the range
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE id > ?"
+    query += ''.join(f' AND {condition}' for condition in conditions)
+    query += ' ORDER BY id LIMIT ?'
+    last_id = first_id
+    while True:
+        rows = conn.execute(query, [last_id, *params, chunk_size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def iter_events(conn, chunk_size=1000, **filters):
+    # Track events matching the filters in id order, chunk_size rows at a time
+    conditions, params = export_filters('first_seen', **filters)
+    first_id = 0
+    if filters.get('start') is not None:
+        # Ids grow with first_seen, so the scan can start at the first event
+        # of the range (found on the first_seen index) instead of the oldest
+        first_id = conn.execute('SELECT MIN(id) FROM track_events WHERE first_seen >= ?',
+                                (filters['start'],)).fetchone()[0]
+        if first_id is None:
+            return
+        first_id -= 1
+    yield from iter_chunks(conn, 'track_events', EXPORT_EVENT_COLUMNS, conditions, params, chunk_size, first_id)
+
+
+def iter_detections(conn, chunk_size=1000, **filters):
+    # Raw detections matching the filters, oldest day first. Only the daily
+    # partitions of the time range are read; archived days are not included.
+    conditions, params = export_filters('timestamp', **filters)
+    first_day = (filters.get('start') or '')[:10].replace('-', '')
+    last_day = (filters.get('end') or '~')[:10].replace('-', '')
+    for day, table in raw_partitions(conn):
+        if first_day <= day <= last_day:
+            yield from iter_chunks(conn, table, DETECTION_COLUMNS, conditions, params, chunk_size)
+
+
+def event_to_dict(row):
+    return dict(zip(EVENT_COLUMNS, row))
+
+
+def summarize_events(conn):
+    # Totals, top classes and time-of-day counts, read from the hourly
+    # rollup so the cost does not grow with the number of events
+    total_detections, total_class_ids, total_class_names = conn.execute(
+        '''SELECT COALESCE(SUM(event_count), 0), COUNT(DISTINCT class_id), COUNT(DISTINCT class_name)
+           FROM event_rollups_hour'''
+    ).fetchone()
+
+    class_counts = conn.execute(
+        '''SELECT class_id, class_name, SUM(event_count) AS count FROM event_rollups_hour
+           GROUP BY class_id, class_name ORDER BY count DESC'''
+    ).fetchall()
+
+    most_frequent_classes = Counter()
+    for _, class_name, count in class_counts:
+        most_frequent_classes[class_name] += count
+
+    time_based_counts = {label: 0 for label in TIME_BUCKETS.values()}
+    for bucket, count in conn.execute(
+            '''SELECT CAST(substr(bucket, 12, 2) AS INTEGER) / 6 AS time_bucket, SUM(event_count)
+               FROM event_rollups_hour GROUP BY time_bucket'''):
+        if bucket in TIME_BUCKETS:
+            time_based_counts[TIME_BUCKETS[bucket]] += count
+
+    return {
+        'total_detections': total_detections,
+        'total_class_ids': total_class_ids,
+        'total_class_names': total_class_names,
+        'most_frequent_classes': most_frequent_classes.most_common(5),
+        'class_counts': [list(row) for row in class_counts],
+        'time_based_counts': time_based_counts,
+    }
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from .pipeline import StageStats
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    # One client of a camera stream. Holds only the latest frame; if the
+    # client is still busy with the previous send, the older frame is dropped
+    # instead of making the producer wait. With max_fps set, frames beyond
+    # that rate are not offered at all.
+    #
+    # A send only hands the frame to the server's transport, which returns
+    # at once however slow the client is. Clients that acknowledge frames
+    # (frame_ack with the number of frames received) get at most
+    # max_in_flight unacknowledged frames, and their latency is the ack
+    # round trip; clients that never ack are timed by their sends.
+
+    def __init__(self, connection, render_key, max_fps=0, on_sent=None, max_in_flight=2):
+        self.connection = connection
+        self.render_key = render_key
+        self.max_fps = max_fps
+        self.on_sent = on_sent  # Called with the latency of every sent frame
+        self.max_in_flight = max_in_flight
+        self.acks = False  # Set by the first frame_ack
+        self.in_flight = deque()  # (sequence, sent at) of unacknowledged frames
+        self.next_frame_at = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.latency = 0.0  # Moving average of publish -> sent, in seconds
+        self.send_stats = StageStats('send')
+        self.sending_since = None
+        self._slot = None
+        self._ready = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def offer(self, messages, published_at):
+        if self.max_fps:
+            if published_at < self.next_frame_at:
+                self.throttled += 1
+                return
+            # Keeps the cadence without saving up more than one frame
+            interval = 1.0 / self.max_fps
+            self.next_frame_at = max(self.next_frame_at, published_at - interval) + interval
+        if self._slot is not None:
+            self.dropped += 1
+        self._slot = (messages, published_at)
+        self._ready.set()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if self._slot is None or (self.acks and len(self.in_flight) >= self.max_in_flight):
+                continue  # ack() wakes the task up again
+            (messages, published_at), self._slot = self._slot, None
+
+            message = messages.get(self.render_key)
+            if message is None:
+                continue  # Subscribed after this frame was encoded
+
+            sent_at = self.sending_since = time.monotonic()
+            try:
+                if isinstance(message, bytes):
+                    await self.connection.send(bytes_data=message)
+                else:
+                    await self.connection.send(text_data=message)
+            except Exception:
+                return  # Connection is gone; disconnect() unsubscribes it
+            finally:
+                self.sending_since = None
+
+            self.sent += 1
+            if self.acks:
+                self.in_flight.append((self.sent, sent_at))
+            else:
+                self.record_latency(time.monotonic() - published_at)
+
+    def ack(self, sequence, now):
+        # The client has received the frames up to this one; frames are
+        # numbered from 1 in the order they were sent
+        self.acks = True
+        sent_at = None
+        while self.in_flight and self.in_flight[0][0] <= sequence:
+            _, sent_at = self.in_flight.popleft()
+        if sent_at is not None:
+            self.record_latency(now - sent_at)
+        if self._slot is not None:
+            self._ready.set()
+
+    def record_latency(self, latency):
+        self.latency = latency if not self.latency else 0.9 * self.latency + 0.1 * latency
+        self.send_stats.record(latency)
+        if self.on_sent is not None:
+            self.on_sent(latency)
+
+    def stalled_for(self, now):
+        # How long the client has been holding frames up: its oldest
+        # unacknowledged frame, or a send that has not returned
+        started = [since for since in (self.sending_since, self.in_flight[0][1] if self.in_flight else None)
+                   if since is not None]
+        return now - min(started) if started else 0.0
+
+    def stats(self):
+        stats = {
+            'render_key': self.render_key,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'max_fps': self.max_fps,
+            'throttled': self.throttled,
+            'latency_ms': round(self.latency * 1000, 2),
+            'acks': self.acks,
+            'in_flight': len(self.in_flight),
+        }
+        send = self.send_stats.snapshot()
+        stats.update({key: value for key, value in send.items() if key.startswith('p')})
+        return stats
+
+
+class Broadcaster:
+    # Fans the frames of one camera out to its subscribers. Each frame is
+    # encoded once per render key (see render_keys) and every subscriber
+    # sends from its own task, so one slow browser cannot hold up the others.
+    # Runs on the event loop.
+
+    def __init__(self, stall_timeout=10.0, max_in_flight=2):
+        self.stall_timeout = stall_timeout
+        self.max_in_flight = max_in_flight
+        self.subscribers = {}
+        self.disconnected = 0
+        self.streaming = False  # Whether a stream_video task feeds this camera
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self, connection, render_key, max_fps=0, on_sent=None):
+        self.subscribers[connection] = Subscriber(connection, render_key, max_fps, on_sent, self.max_in_flight)
+
+    def set_render_key(self, connection, render_key, max_fps=0):
+        subscriber = self.subscribers.get(connection)
+        if subscriber is not None:
+            subscriber.render_key = render_key
+            subscriber.max_fps = max_fps
+
+    def ack(self, connection, sequence):
+        subscriber = self.subscribers.get(connection)
+        if subscriber is not None:
+            subscriber.ack(sequence, time.monotonic())
+
+    def unsubscribe(self, connection):
+        subscriber = self.subscribers.pop(connection, None)
+        if subscriber is not None:
+            subscriber.task.cancel()
+
+    def render_keys(self):
+        # Called from the encode thread to find out which variants to encode
+        return {subscriber.render_key for subscriber in list(self.subscribers.values())}
+
+    def publish(self, messages):
+        now = time.monotonic()
+        for connection, subscriber in list(self.subscribers.items()):
+            if subscriber.stalled_for(now) > self.stall_timeout:
+                logger.warning("Disconnecting client stalled for %.1f seconds", subscriber.stalled_for(now))
+                self.unsubscribe(connection)
+                self.disconnected += 1
+                asyncio.create_task(connection.close())
+                continue
+            subscriber.offer(messages, now)
+
+    def stats(self):
+        return {
+            'subscribers': {
+                str(getattr(connection, 'channel_name', id(connection))): subscriber.stats()
+                for connection, subscriber in list(self.subscribers.items())
+            },
+            'stalled_disconnects': self.disconnected,
+        }
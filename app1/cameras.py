@@ -0,0 +1,118 @@
+import os
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+
+DEFAULT_CAMERA = 'default'
+
+
+def get_camera_configs():
+    # Camera registry: camera id -> config dict with a 'source' that is a
+    # device index, a video file path or an RTSP/HTTP URL
+    return getattr(settings, 'PPE_CAMERAS', {DEFAULT_CAMERA: {'source': 0}})
+
+
+def parse_source(source):
+    # "0" from an environment variable or URL means device 0, not a file
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+class ReplayCapture:
+    # Recorded clip as a camera. With realtime set, read() is paced to the
+    # clip's frame rate; otherwise frames come as fast as they are asked
+    # for. With loop set the clip restarts at the end instead of failing.
+
+    live = False  # Frames wait to be read, so capture paces by sleeping
+
+    def __init__(self, path, realtime=True, loop=True):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.capture = cv2.VideoCapture(path)
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30
+        self.next_frame = time.monotonic()
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+
+        if ret and self.realtime:
+            self.next_frame = max(self.next_frame + 1 / self.fps, time.monotonic() - 1)
+            delay = self.next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return ret, frame
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+class JpegFrame(np.ndarray):
+    # Decoded frame that keeps the JPEG the camera sent, so clean frames can
+    # be forwarded without encoding them again. Copies and crops of it do
+    # not inherit the JPEG.
+    jpeg = None
+
+
+class MjpegCapture:
+    # Reads the camera's MJPEG frames undecoded (OpenCV raw mode) and
+    # decodes each one once for inference. Backends without raw mode
+    # return decoded frames, which are passed on as they are.
+
+    def __init__(self, source, config):
+        self.capture = cv2.VideoCapture(source)
+        self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, config.get('width', 640))
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, config.get('height', 480))
+        self.capture.set(cv2.CAP_PROP_FPS, config.get('fps', 30))
+        self.capture.set(cv2.CAP_PROP_FORMAT, -1)
+
+    def grab(self):
+        return self.capture.grab()
+
+    def retrieve(self):
+        ret, data = self.capture.retrieve()
+        if not ret or data.ndim == 3:
+            return ret, data
+
+        frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if frame is None:
+            return False, None
+        frame = frame.view(JpegFrame)
+        frame.jpeg = data.tobytes()
+        return True, frame
+
+    def read(self):
+        return self.retrieve() if self.grab() else (False, None)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+def open_capture(config):
+    source = parse_source(config['source'])
+    if isinstance(source, str) and os.path.isfile(source):
+        # Video files replay at their own frame rate unless realtime=False
+        return ReplayCapture(source, config.get('realtime', True), config.get('loop', True))
+
+    if config.get('mjpeg'):
+        return MjpegCapture(source, config)
+
+    capture = cv2.VideoCapture(source)
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, config.get('width', 640))
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, config.get('height', 480))
+    capture.set(cv2.CAP_PROP_FPS, config.get('fps', 30))
+    return capture
@@ -0,0 +1,266 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from .rendering import draw_detections, encode_jpeg
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBuffer:
+    # The last `seconds` of one camera as (timestamp, jpeg), never more than
+    # max_bytes of JPEG data
+
+    def __init__(self, seconds, max_bytes):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.frames = deque()
+        self.size = 0
+
+    def append(self, timestamp, jpeg):
+        self.frames.append((timestamp, jpeg))
+        self.size += len(jpeg)
+        while self.frames and (self.size > self.max_bytes or timestamp - self.frames[0][0] > self.seconds):
+            self.size -= len(self.frames.popleft()[1])
+
+    def since(self, timestamp):
+        return [frame for frame in self.frames if frame[0] >= timestamp]
+
+
+class Recording:
+    # A clip being collected: the buffered frames from before the violation,
+    # then the frames up to `end`
+
+    def __init__(self, path, end, frames, event_keys):
+        self.path = path
+        self.end = end
+        self.frames = frames
+        self.event_keys = event_keys
+
+    def size(self):
+        return sum(len(jpeg) for _, jpeg in self.frames)
+
+
+def write_clip(path, frames, codec='mp4v', max_fps=10):
+    # frames are (timestamp, jpeg). The clip gets the rate the frames were
+    # sampled at, so it plays in real time; it is written next to its final
+    # name and renamed once complete.
+    duration = frames[-1][0] - frames[0][0]
+    fps = min(max_fps, (len(frames) - 1) / duration) if duration > 0 else max_fps
+    first = cv2.imdecode(np.frombuffer(frames[0][1], np.uint8), cv2.IMREAD_COLOR)
+    height, width = first.shape[:2]
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    base, extension = os.path.splitext(path)
+    partial = f'{base}.part{extension}'
+    writer = cv2.VideoWriter(partial, cv2.VideoWriter_fourcc(*codec), max(fps, 1.0), (width, height))
+    if not writer.isOpened():
+        raise OSError(f"Cannot write {codec} video to {partial}")
+    try:
+        for _, jpeg in frames:
+            frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+            if frame.shape[:2] != (height, width):
+                frame = cv2.resize(frame, (width, height))
+            writer.write(frame)
+    finally:
+        writer.release()
+    os.replace(partial, path)
+
+
+class ClipRecorder(threading.Thread):
+    # Evidence clips of violations. The pipeline threads hand over one frame
+    # every 1 / fps seconds with add() and call trigger() when an alert
+    # fires; both only queue, and frames are dropped when this thread falls
+    # behind. This thread draws and encodes the frames into a FrameBuffer
+    # per camera, and on a trigger collects the last pre_seconds plus the
+    # next post_seconds into a clip. Finished clips queue for a writer thread
+    # until max_pending_bytes of JPEG data waits (one clip is always taken),
+    # and on_saved(event_keys, path) is called once a clip is on disk. Memory
+    # is bounded by max_queue raw frames, max_bytes of JPEG per camera and
+    # max_pending_bytes of clips waiting to be written. stop()
+    # handles everything queued before it and writes the clips being
+    # collected with the frames they have.
+
+    def __init__(self, directory='clips', pre_seconds=5.0, post_seconds=5.0, fps=10, quality=80,
+                 max_bytes=32 * 1024 * 1024, codec='mp4v', extension='.mp4', max_queue=8,
+                 max_pending_bytes=64 * 1024 * 1024, on_saved=None):
+        super().__init__(name='ppe-clips', daemon=True)
+        self.directory = directory
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.fps = fps
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self.extension = extension
+        self.max_queue = max_queue
+        self.max_pending_bytes = max_pending_bytes
+        self.on_saved = on_saved
+        self.buffers = {}  # camera_id -> FrameBuffer
+        self.recordings = {}  # camera_id -> Recording being collected
+        self.last_added = {}  # camera_id -> timestamp of the last frame taken
+        self.frames = 0
+        self.dropped = 0
+        self.clips = 0
+        self.skipped = 0  # Clips not written because the writer was too far behind
+        self.failed = 0
+        self.pending = 0
+        self.pending_bytes = 0
+        self._pending_lock = threading.Lock()
+        # A plain thread rather than an executor: stop() runs from atexit,
+        # when concurrent.futures no longer accepts work
+        self._writer = threading.Thread(target=self.write_clips, name='ppe-clip-writer', daemon=True)
+        self._writes = queue.Queue()
+        # Unbounded for triggers; add() checks max_queue for frames
+        self._queue = queue.Queue()
+
+    def add(self, camera_id, frame, detections, now):
+        # Called from the pipeline thread of the camera for every frame. The
+        # frame is copied because the encode thread draws on it.
+        if frame is None or now - self.last_added.get(camera_id, float('-inf')) < 1 / self.fps:
+            return
+        self.last_added[camera_id] = now
+        if self._queue.qsize() >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.put(('frame', camera_id, now, frame.copy(), detections))
+
+    def trigger(self, camera_id, alert, event_key, now):
+        self._queue.put(('trigger', camera_id, now, alert, event_key))
+
+    def close(self, camera_id):
+        # The camera stopped: its clip is written with the frames it has
+        self.last_added.pop(camera_id, None)
+        self._queue.put(('close', camera_id))
+
+    def run(self):
+        self._writer.start()
+        while True:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                self.finish_stale(time.time())
+                continue
+            if item is None:
+                break  # stop(), after everything queued before it
+            kind, camera_id = item[:2]
+            if kind == 'frame':
+                self.buffer_frame(camera_id, *item[2:])
+            elif kind == 'trigger':
+                self.start_recording(camera_id, *item[2:])
+            else:
+                self.finish(camera_id)
+                self.buffers.pop(camera_id, None)
+
+        self._writes.put(None)
+        self._writer.join()
+        # Whatever is still being collected is written here, even past
+        # max_pending_bytes
+        for camera_id in list(self.recordings):
+            recording = self.recordings.pop(camera_id)
+            if recording.frames:
+                self.save(recording)
+
+    def buffer_frame(self, camera_id, timestamp, frame, detections):
+        draw_detections(frame, detections)
+        jpeg = encode_jpeg(frame, self.quality)
+        self.frames += 1
+        buffer = self.buffers.get(camera_id)
+        if buffer is None:
+            buffer = self.buffers[camera_id] = FrameBuffer(self.pre_seconds, self.max_bytes)
+        buffer.append(timestamp, jpeg)
+
+        recording = self.recordings.get(camera_id)
+        if recording is not None:
+            recording.frames.append((timestamp, jpeg))
+            if timestamp >= recording.end:
+                self.finish(camera_id)
+
+    def start_recording(self, camera_id, timestamp, alert, event_key):
+        recording = self.recordings.get(camera_id)
+        if recording is not None:
+            # Violations while a clip is being collected share it
+            if event_key is not None:
+                recording.event_keys.append(event_key)
+            return
+
+        buffer = self.buffers.get(camera_id)
+        name = f"{datetime.fromtimestamp(timestamp):%Y%m%d-%H%M%S}-{alert['rule']}-{alert['track_id']}"
+        path = os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]', '_', str(camera_id)), name + self.extension)
+        self.recordings[camera_id] = Recording(
+            path,
+            timestamp + self.post_seconds,
+            buffer.since(timestamp - self.pre_seconds) if buffer is not None else [],
+            [event_key] if event_key is not None else [],
+        )
+
+    def finish_stale(self, now):
+        # Cameras that stopped sending frames without being closed
+        for camera_id, recording in list(self.recordings.items()):
+            if now > recording.end + 1.0:
+                self.finish(camera_id)
+
+    def finish(self, camera_id):
+        recording = self.recordings.pop(camera_id, None)
+        if recording is None or not recording.frames:
+            return
+        size = recording.size()
+        with self._pending_lock:
+            if self.pending and self.pending_bytes + size > self.max_pending_bytes:
+                self.skipped += 1
+                logger.warning("Clip %s skipped, %d clips (%d bytes) are still waiting to be written",
+                               recording.path, self.pending, self.pending_bytes)
+                return
+            self.pending += 1
+            self.pending_bytes += size
+        self._writes.put(recording)
+
+    def write_clips(self):
+        # The writer thread
+        while True:
+            recording = self._writes.get()
+            if recording is None:
+                return
+            self.save(recording)
+            with self._pending_lock:
+                self.pending -= 1
+                self.pending_bytes -= recording.size()
+
+    def save(self, recording):
+        try:
+            write_clip(recording.path, recording.frames, self.codec, self.fps)
+        except Exception:
+            self.failed += 1
+            logger.exception("Error writing clip %s", recording.path)
+            return
+        self.clips += 1
+        logger.info("Saved clip %s (%d frames)", recording.path, len(recording.frames))
+        if self.on_saved is not None and recording.event_keys:
+            self.on_saved(recording.event_keys, recording.path)
+
+    def stop(self, timeout=5):
+        self._queue.put(None)
+        self.join(timeout)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'buffered_bytes': sum(buffer.size for buffer in list(self.buffers.values())),
+            'recording': sorted(self.recordings),
+            'pending': self.pending,
+            'pending_bytes': self.pending_bytes,
+            'clips': self.clips,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
@@ -1,223 +1,396 @@
-import base64
 import json
-import cv2
-import torch
-import pygame
 import asyncio
+import logging
 import time
-import pytz
-import sqlite3
-from collections import deque
 from channels.generic.websocket import AsyncWebsocketConsumer
-from ultralytics import YOLO
-from datetime import datetime
-
-
-CONFIDENCE_THRESHOLD = 0.3  # Minimum confidence to consider a detection
-
-# Initialize the model
-model = YOLO('app1/best.pt')
-
-# Set up video capture (webcam)
-video_capture = cv2.VideoCapture(0)
-video_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-video_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-video_capture.set(cv2.CAP_PROP_FPS, 30)
-
-# Pygame setup for sound alert
-pygame.mixer.init()
-alert_sound = pygame.mixer.Sound("app1/alert.mp3")
-
-# Database setup
-def setup_database():
-    conn = sqlite3.connect('detections.db')  # Connect to SQLite database
-    cursor = conn.cursor()
-
-    # Create table to store detection data
-    cursor.execute('''CREATE TABLE IF NOT EXISTS detections (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        class_id INTEGER,
-                        class_name TEXT,
-                        confidence REAL,
-                        track_id INTEGER,
-                        bbox TEXT,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )''')
-    
-    conn.commit()
-    return conn, cursor
-
-# Create database connection
-conn, cursor = setup_database()
+from django.conf import settings
+from . import resources
+from .alerts import ALERTS_GROUP, DEFAULT_RULES, AlertEngine, make_rules
+from .cameras import DEFAULT_CAMERA, get_camera_configs
+from .broadcast import Broadcaster
+from .framebus import FrameBusPipeline
+from .live import DETECTION_EVENTS_GROUP, EventPublisher
+from .metrics import Counter, Gauge, registry
+from .pipeline import VideoPipeline
+from .processing import CONFIDENCE_THRESHOLD, CameraProcessor
+from .profiles import make_adapter, make_profile
+from .protocol import negotiate
+from .rendering import CLIENT_OVERLAY, SERVER_OVERLAY, make_view, render_views
+from .resources import LazyResource, start_clip_recorder, start_detection_writer
+from .workers import InferencePool
+from .zones import Zones
+
+
+logger = logging.getLogger(__name__)
+
+# The model, the sound mixer, the writer and the alert threads are created on first use
+# (see resources.py), so importing this module for routing costs nothing
+
+# Written track events are pushed to the logs dashboard
+event_publisher = EventPublisher()
+
+# Detections are written in batches by a background thread
+detection_writer = LazyResource('detection writer', lambda: start_detection_writer(event_publisher.publish))
+
+def infer_batch(frames):
+    # One model call for the latest frame of several cameras
+    return resources.model.get()(frames)
+
+# Alerts are evaluated in the pipeline and delivered by their own thread
+alert_dispatcher = LazyResource('alert dispatcher', resources.start_alert_dispatcher)
+alert_rules = make_rules(getattr(settings, 'PPE_ALERT_RULES', DEFAULT_RULES))
+
+# Alerts are recorded as clips from a per-camera buffer of recent frames,
+# linked to the track event once written
+RECORD_CLIPS = getattr(settings, 'PPE_CLIPS', True)
+clip_recorder = LazyResource('clip recorder', lambda: start_clip_recorder(detection_writer.get().link_clip))
+
+# With PPE_FRAME_BUS, capture and inference run in the inference_service
+# command and every web worker reads frames and detections from shared memory
+FRAME_BUS = getattr(settings, 'PPE_FRAME_BUS', False)
+
+# With PPE_INFERENCE_WORKERS, frames are sent over the channel layer to the
+# inference_worker processes instead of running the model in this process
+inference_pool = None
+if getattr(settings, 'PPE_INFERENCE_WORKERS', False):
+    inference_pool = InferencePool(
+        worker_timeout=getattr(settings, 'PPE_WORKER_TIMEOUT', 3.0),
+        quality=getattr(settings, 'PPE_WORKER_JPEG_QUALITY', 90),
+    )
+
+
+def make_pipeline():
+    # One capture thread per camera, a shared batched inference thread (or
+    # the worker pool) and an encode thread per camera
+    return VideoPipeline(
+        get_camera_configs(),
+        infer_batch,
+        batch_size=getattr(settings, 'PPE_BATCH_SIZE', 8),
+        max_wait=getattr(settings, 'PPE_BATCH_MAX_WAIT', 0.01),
+        remote=inference_pool,
+        max_in_flight=getattr(settings, 'PPE_WORKER_MAX_IN_FLIGHT', 2),
+        job_timeout=getattr(settings, 'PPE_WORKER_JOB_TIMEOUT', 2.0),
+    )
+
+
+async def load_class_names(loop):
+    # Class names of the model, from the workers' heartbeats when they run it
+    if inference_pool is not None:
+        await inference_pool.start()
+        return inference_pool.names
+    model = await loop.run_in_executor(None, resources.model.get)
+    return model.names
+
+
+if FRAME_BUS:
+    pipeline = FrameBusPipeline(get_camera_configs(), getattr(settings, 'PPE_FRAME_BUS_PREFIX', 'ppe'))
+else:
+    pipeline = make_pipeline()
+
+
+def make_processor(camera_id, config, class_names, writer, dispatcher, zones, clips=None):
+    # Tracking, track events, alerts and alert clips of one camera
+    return CameraProcessor(
+        camera_id,
+        class_names,
+        writer,
+        AlertEngine(camera_id, alert_rules, dispatcher.dispatch),
+        frame_rate=config.get('fps', 30),
+        zones=zones,
+        clips=clips,
+    )
+
+
+async def load_clip_recorder(loop):
+    return await loop.run_in_executor(None, clip_recorder.get) if RECORD_CLIPS else None
+
 
 class VideoStreamConsumer(AsyncWebsocketConsumer):
-    active_connections = set()
-    current_class_ids = []
-    tracked_objects = {}
-    object_entry_time = {}
-    object_counter = 0  
-    ALERT_TIME_THRESHOLD = 3  # Time threshold to trigger alert (in seconds)
+    broadcasters = {}  # camera_id -> Broadcaster of its subscribers
 
     async def connect(self):
-        print("WebSocket connection established")
-        self.active_connections.add(self)
-        await self.accept()
+        self.camera_id = self.scope['url_route']['kwargs'].get('camera_id', DEFAULT_CAMERA)
+        if self.camera_id not in pipeline.cameras:
+            logger.warning("Unknown camera %s", self.camera_id)
+            await self.close()
+            return
+
+        # Clients offering the binary subprotocol get raw JPEG frames
+        self.protocol, subprotocol = negotiate(self.scope.get('subprotocols'))
+
+        # Filters of this connection only; inference is shared
+        self.class_ids = []
+        self.confidence_threshold = CONFIDENCE_THRESHOLD
+        self.overlay = SERVER_OVERLAY
+        # Resolution, JPEG quality and max FPS of this client's frames
+        self.stream_profile = make_adapter()
+
+        logger.info("WebSocket connection established (camera %s, %s frames)", self.camera_id, self.protocol)
+        await self.accept(subprotocol)
+        await self.channel_layer.group_add(ALERTS_GROUP, self.channel_name)
+
+        broadcaster = self.broadcasters.get(self.camera_id)
+        if broadcaster is None:
+            broadcaster = Broadcaster(getattr(settings, 'PPE_STALL_TIMEOUT', 10.0),
+                                      getattr(settings, 'PPE_MAX_FRAMES_IN_FLIGHT', 2))
+            self.broadcasters[self.camera_id] = broadcaster
+        broadcaster.subscribe(self, self.view(), self.stream_profile.profile.max_fps, self.frame_sent)
         self.streaming = True
 
-        if len(self.active_connections) == 1:
+        if not broadcaster.streaming:
+            broadcaster.streaming = True
             asyncio.create_task(self.stream_video())
 
     async def disconnect(self, close_code):
-        print("WebSocket connection closed")
-        self.active_connections.discard(self)
+        logger.info("WebSocket connection closed")
+        broadcaster = self.broadcasters.get(getattr(self, 'camera_id', None))
+        if broadcaster is not None:
+            broadcaster.unsubscribe(self)
         self.streaming = False
+        await self.channel_layer.group_discard(ALERTS_GROUP, self.channel_name)
+
+    async def alert_message(self, event):
+        # Alerts of every camera, as JSON text even on binary connections
+        await self.send(text_data=json.dumps({'alert': event['alert']}))
 
     async def receive(self, text_data):
         data = json.loads(text_data)
-        if data.get('action') == 'set_class_ids':
-            self.current_class_ids = data.get('class_ids', [])
-            print(f"Class IDs set to {self.current_class_ids}")
+        if data.get('action') == 'frame_ack':
+            # Number of frames the client has received so far
+            if isinstance(data.get('seq'), int):
+                broadcaster = self.broadcasters.get(self.camera_id)
+                if broadcaster is not None:
+                    broadcaster.ack(self, data['seq'])
+
+        elif data.get('action') == 'get_pipeline_stats':
+            stats = pipeline.stats()
+            for camera_id, camera_stats in stats['cameras'].items():
+                if camera_id in self.broadcasters:
+                    camera_stats.update(self.broadcasters[camera_id].stats())
+            stats['stream_profile'] = self.stream_profile.stats()
+            if detection_writer.loaded:
+                stats['db_writer'] = detection_writer.get().stats()
+            stats['resources'] = resources.stats()
+            if alert_dispatcher.loaded:
+                stats['alerts'] = alert_dispatcher.get().stats()
+            if clip_recorder.loaded:
+                stats['clips'] = clip_recorder.get().stats()
+            await self.send(text_data=json.dumps({'pipeline_stats': stats}))
+
+        elif data.get('action') == 'set_class_ids':
+            class_ids = data.get('class_ids', [])
+            try:
+                if not isinstance(class_ids, list):
+                    raise TypeError(class_ids)
+                self.class_ids = [int(class_id) for class_id in class_ids]
+            except (TypeError, ValueError):
+                await self.send_error(f"Invalid class_ids {class_ids!r}, expected a list of class IDs")
+                return
+            self.update_view()
+            logger.debug("Class IDs set to %s", self.class_ids)
 
         elif data.get('action') == 'set_confidence_threshold':
             new_threshold = data.get('confidence_threshold')
             if isinstance(new_threshold, (int, float)) and 0 <= new_threshold <= 1:
-                global CONFIDENCE_THRESHOLD
-                CONFIDENCE_THRESHOLD = new_threshold
-                print(f"Confidence threshold set to {CONFIDENCE_THRESHOLD}")
-
-    def calculate_iou(self, box1, box2):
-        # Calculate Intersection over Union (IoU) to compare bounding boxes
-        x1, y1, x2, y2 = box1
-        x1_b, y1_b, x2_b, y2_b = box2
-        
-        inter_x1 = max(x1, x1_b)
-        inter_y1 = max(y1, y1_b)
-        inter_x2 = min(x2, x2_b)
-        inter_y2 = min(y2, y2_b)
-        
-        inter_area = max(0, inter_x2 - inter_x1) * max(0, inter_y2 - inter_y1)
-        area1 = (x2 - x1) * (y2 - y1)
-        area2 = (x2_b - x1_b) * (y2_b - y1_b)
-        
-        union_area = area1 + area2 - inter_area
-        return inter_area / union_area if union_area != 0 else 0
-
-    def assign_tracking_ids(self, results, frame_id):
-        detections = []
-        current_time = time.time()
-
-        for result in results[0].boxes:
-            x1, y1, x2, y2 = map(int, result.xyxy[0])
-            confidence = result.conf[0].item()
-            class_id = int(result.cls[0].item())
-
-            if confidence > CONFIDENCE_THRESHOLD and (not self.current_class_ids or class_id in self.current_class_ids):
-                detection = {
-                    'bbox': (x1, y1, x2, y2),
-                    'confidence': confidence,
-                    'class_id': class_id,
-                    'class_name': model.names[class_id]
-                }
-
-                assigned = False
-                for track_id, tracked_data in list(self.tracked_objects.items()):
-                    tracked_bbox = tracked_data[-1][1]  
-                    iou = self.calculate_iou(detection['bbox'], tracked_bbox)
-                    
-                    if iou > 0.3:
-                        self.tracked_objects[track_id].append((frame_id, detection['bbox']))
-                        detection['track_id'] = track_id
-                        assigned = True
-                        break
-                
-                if not assigned:
-                    self.object_counter += 1
-                    track_id = self.object_counter
-                    self.tracked_objects[track_id] = deque([(frame_id, detection['bbox'])])
-                    detection['track_id'] = track_id
-
-                # Save detection to the database
-                self.save_detection_to_db(detection)
-
-                if class_id in [1, 2]:
-                    if track_id not in self.object_entry_time:
-                        self.object_entry_time[track_id] = current_time
-                    else:
-                        duration = current_time - self.object_entry_time[track_id]
-                        if duration > self.ALERT_TIME_THRESHOLD:
-                            print(f"Alert! Object ID {track_id} with Class ID {class_id} detected for {duration:.2f} seconds!")
-                            pygame.mixer.Sound.play(alert_sound)
-                            del self.object_entry_time[track_id]
-
-                detections.append(detection)
-
-        return detections
-    
-    def save_detection_to_db(self, detection):
-        class_id = detection["class_id"]
-        class_name = detection["class_name"]
-        confidence = detection["confidence"]
-        track_id = detection["track_id"]
-        bbox = str(detection["bbox"])  # Convert tuple to string for storage
-
-        # Get current time in Asia/Riyadh time zone
-        riyadh_tz = pytz.timezone("Asia/Riyadh") #For india Timezone Replace Riyadh To Kolkata
-        timestamp = datetime.now(riyadh_tz).strftime("%Y-%m-%d %H:%M:%S")  # Convert to formatted string
-
-    # Insert the detection into the database with the converted timestamp
-        cursor.execute('''INSERT INTO detections (class_id, class_name, confidence, track_id, bbox, timestamp)
-                      VALUES (?, ?, ?, ?, ?, ?)''',
-                   (class_id, class_name, confidence, track_id, bbox, timestamp))
-        conn.commit()
-
-        print(f"Detection saved: {class_name} (ID: {track_id}, Conf: {confidence:.2f}, Time: {timestamp})")
+                self.confidence_threshold = new_threshold
+                self.update_view()
+                logger.debug("Confidence threshold set to %s", self.confidence_threshold)
+            else:
+                await self.send_error(f"Invalid confidence_threshold {new_threshold!r}, expected a number from 0 to 1")
+
+        elif data.get('action') == 'set_overlay':
+            # 'client': clean frames, the browser draws detected_objects
+            if data.get('overlay') in (CLIENT_OVERLAY, SERVER_OVERLAY):
+                self.overlay = data['overlay']
+                self.update_view()
+                logger.debug("Overlay set to %s", self.overlay)
+
+        elif data.get('action') == 'set_stream_profile':
+            # {'profile': 'low'} picks a step of PPE_STREAM_PROFILES; scale,
+            # quality and max_fps set a fixed custom profile instead
+            profile = self.stream_profile
+            if 'adaptive' in data:
+                profile.adaptive = bool(data['adaptive'])
+            if 'profile' in data:
+                profile.select(data['profile'])
+            elif any(key in data for key in ('scale', 'quality', 'max_fps')):
+                current = profile.profile
+                try:
+                    profile.set_custom(make_profile(
+                        data.get('scale', current.scale),
+                        data.get('quality', current.quality),
+                        data.get('max_fps', current.max_fps),
+                    ))
+                except (TypeError, ValueError):
+                    logger.debug("Invalid stream profile %s", data)
+            self.update_view()
+            logger.debug("Stream profile set to %s %s", profile.name, profile.profile)
+
+    def view(self):
+        profile = self.stream_profile.profile
+        return make_view(self.protocol, self.class_ids, self.confidence_threshold, self.overlay,
+                         profile.scale, profile.quality)
+
+    def update_view(self):
+        broadcaster = self.broadcasters.get(self.camera_id)
+        if broadcaster is not None:
+            broadcaster.set_render_key(self, self.view(), self.stream_profile.profile.max_fps)
+
+    def frame_sent(self, latency):
+        # Runs in this client's sender task after every frame
+        if self.stream_profile.observe(latency, time.monotonic()):
+            logger.info("Camera %s client switched to the %s stream profile (latency %.0f ms)",
+                        self.camera_id, self.stream_profile.name, latency * 1000)
+            self.update_view()
 
     async def stream_video(self):
-        frame_id = 0
-        while self.active_connections:
-            ret, frame = video_capture.read()
-            if not ret:
-                print("Error: Failed to capture frame")
-                break
-
-            results = model(frame, verbose=False)
-            detections = self.assign_tracking_ids(results, frame_id)
-
-            # Draw bounding boxes on the frame
-            for detection in detections:
-                x1, y1, x2, y2 = detection['bbox']
-                class_name = detection['class_name']
-                confidence = detection['confidence']
-                track_id = detection['track_id']
-
-                # Set color based on class_id
-                if detection['class_id'] in [1, 2]:  # For class 1 and 2, use red
-                    color = (0, 0, 255)  # Red
-                else:
-                    color = (0, 255, 0)  # Green
-
-                # Draw rectangle on the frame (using OpenCV)
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 4)
+        # Shared by every subscriber of the camera, whoever started the stream.
+        # The first stream may have to wait for the model to load.
+        loop = asyncio.get_running_loop()
+        config = pipeline.cameras[self.camera_id]
+        zones = Zones(config.get('zones', ()))
+        broadcaster = self.broadcasters[self.camera_id]
+
+        def render(frame, detections):
+            # Runs in the encode thread, once per view some subscriber uses
+            return render_views(frame, detections, broadcaster.render_keys(), zones, self.camera_id)
+
+        processor = None
+        failed = False
+        try:
+            if FRAME_BUS:
+                pipeline.start(self.camera_id, loop, render)
+            else:
+                class_names = await load_class_names(loop)
+                writer = await loop.run_in_executor(None, detection_writer.get)
+                dispatcher = await loop.run_in_executor(None, alert_dispatcher.get)
+                dispatcher.bind(loop)
+                clips = await load_clip_recorder(loop)
+                processor = make_processor(self.camera_id, config, class_names, writer, dispatcher, zones, clips)
+                event_publisher.bind(loop)
+                if inference_pool is not None:
+                    await inference_pool.follow(self.camera_id)
+                pipeline.start(self.camera_id, loop, processor.process, render, processor.crops)
+            broadcast_stats = pipeline.broadcast_stats(self.camera_id)
+
+            while broadcaster:
+                try:
+                    messages = await pipeline.get(self.camera_id, timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+
+                # Hands the frame to every subscriber's own sender task
+                started = time.perf_counter()
+                broadcaster.publish(messages)
+                broadcast_stats.record(time.perf_counter() - started)
+        except Exception as exc:
+            # The model, the database or the clip directory could not be
+            # loaded, or the pipeline broke: the subscribers are told and
+            # dropped, and the next client to connect tries again
+            failed = True
+            logger.exception("Video stream of camera %s failed", self.camera_id)
+            await self.fail_subscribers(broadcaster, f"Video stream of camera {self.camera_id} failed: {exc}")
+        finally:
+            await loop.run_in_executor(None, pipeline.stop, self.camera_id)
+            if processor is not None:
+                processor.close()
+            if inference_pool is not None and processor is not None:
+                await inference_pool.unfollow(self.camera_id)
+            broadcaster.streaming = False
+
+        logger.info("Video stream of camera %s ended", self.camera_id)
+        if failed:
+            return
+
+        # Someone subscribed while the pipeline was shutting down
+        if broadcaster:
+            broadcaster.streaming = True
+            asyncio.create_task(next(iter(broadcaster.subscribers)).stream_video())
+
+    async def send_error(self, error):
+        # Invalid client messages are answered instead of closing the socket
+        await self.send(text_data=json.dumps({'error': error}))
+
+    async def fail_subscribers(self, broadcaster, error):
+        for connection in list(broadcaster.subscribers):
+            broadcaster.unsubscribe(connection)
+            try:
+                await connection.send(text_data=json.dumps({'error': error}))
+                await connection.close(code=1011)
+            except Exception:
+                pass  # Already gone
 
-                # Add label with confidence score
-                label = f"{class_name} ({confidence:.2f})"
-                cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-            # Convert the frame to base64 for WebSocket transmission
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame_data = base64.b64encode(buffer).decode('utf-8')
+    def close_database(self):
+        if detection_writer.loaded:
+            detection_writer.get().stop()
+        logger.info("Database connection closed")
 
-            message = json.dumps({'frame': frame_data, 'detected_objects': detections})
 
-            tasks = [connection.send(text_data=message) for connection in self.active_connections]
-            await asyncio.gather(*tasks, return_exceptions=True)
+class DetectionEventsConsumer(AsyncWebsocketConsumer):
+    # Pushes new and updated track events, plus counter deltas, to the logs
+    # dashboard as soon as the writer has stored them
 
-            await asyncio.sleep(0.02)  # To control frame rate
-            frame_id += 1
+    connections = 0
 
-        print("Video stream ended")
+    async def connect(self):
+        await self.channel_layer.group_add(DETECTION_EVENTS_GROUP, self.channel_name)
+        await self.accept()
+        DetectionEventsConsumer.connections += 1
 
-    def close_database(self):
-        cursor.close()
-        conn.close()
-        print("Database connection closed")
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(DETECTION_EVENTS_GROUP, self.channel_name)
+        DetectionEventsConsumer.connections -= 1
+
+    async def detection_events(self, event):
+        await self.send(text_data=json.dumps({'events': event['events'], 'deltas': event['deltas']}))
+
+
+def collect_metrics():
+    # Scrape-time values of this process: connections, FPS, drops and queues
+    connections = Gauge('ppe_active_connections', 'Open WebSocket connections')
+    fps = Gauge('ppe_stage_fps', 'Frames per second of each pipeline stage')
+    dropped = Counter('ppe_dropped_frames_total', 'Frames dropped between stages or for slow clients')
+    skipped = Counter('ppe_inference_skipped_total', 'Frames the scheduler did not run inference on')
+    queue_depth = Gauge('ppe_queue_depth', 'Items waiting in pipeline and writer queues')
+    db_rows = Counter('ppe_db_rows_written_total', 'Rows written by the detection writer')
+    db_dropped = Counter('ppe_db_rows_dropped_total', 'Rows dropped because the writer queue was full')
+    clips = Counter('ppe_clips_total', 'Alert clips saved, skipped because the writer fell behind, or failed')
+
+    connections.set(DetectionEventsConsumer.connections, endpoint='detections')
+    for camera_id, broadcaster in list(VideoStreamConsumer.broadcasters.items()):
+        connections.set(len(broadcaster), endpoint='video_stream', camera=camera_id)
+
+    stats = pipeline.stats()
+    if stats['inference']:
+        fps.set(stats['inference']['fps'], stage='inference')
+        queue_depth.set(stats['inference']['queue_depth'], queue='inference')
+    for camera_id, camera in stats['cameras'].items():
+        for stage in ('capture', 'tracking', 'encode', 'broadcast'):
+            if stage in camera:
+                fps.set(camera[stage]['fps'], stage=stage, camera=camera_id)
+        if 'capture' in camera:
+            dropped.inc(camera['capture']['dropped'], stage='inference', camera=camera_id)
+            skipped.inc(camera['capture']['skipped'], camera=camera_id)
+            dropped.inc(camera['encode']['dropped'], stage='encode', camera=camera_id)
+            dropped.inc(camera['output']['dropped'], stage='broadcast', camera=camera_id)
+            queue_depth.set(camera['encode']['queue_depth'], queue='encode', camera=camera_id)
+        broadcaster = VideoStreamConsumer.broadcasters.get(camera_id)
+        if broadcaster is not None:
+            subscribers = broadcaster.stats()['subscribers'].values()
+            dropped.inc(sum(subscriber['dropped'] for subscriber in subscribers), stage='send', camera=camera_id)
+
+    if detection_writer.loaded:
+        writer = detection_writer.get().stats()
+        queue_depth.set(writer['queue_depth'], queue='db_writer')
+        db_rows.inc(writer['rows_written'])
+        db_dropped.inc(writer['dropped'])
+
+    if clip_recorder.loaded:
+        recorder = clip_recorder.get().stats()
+        queue_depth.set(recorder['pending'], queue='clip_writer')
+        for outcome, key in (('saved', 'clips'), ('skipped', 'skipped'), ('failed', 'failed')):
+            clips.inc(recorder[key], outcome=outcome)
+    return [connections, fps, dropped, skipped, queue_depth, db_rows, db_dropped, clips]
+
+
+registry.add_collector(collect_metrics)
@@ -0,0 +1,94 @@
+import json
+import uuid
+
+
+class TrackEventRecorder:
+    # Turns the per-frame detections of one camera into one event row per
+    # track and class. The row is opened when a track appears, refreshed every
+    # update_interval seconds while it stays in view and closed once the
+    # track has not been seen for expire_after seconds. frame_count only
+    # counts frames the track was detected on, not predicted ones.
+
+    def __init__(self, writer, camera_id, expire_after=2.0, update_interval=1.0,
+                 trajectory_interval=1.0, max_trajectory=300):
+        self.writer = writer
+        self.camera_id = camera_id
+        self.expire_after = expire_after
+        self.update_interval = update_interval
+        self.trajectory_interval = trajectory_interval
+        self.max_trajectory = max_trajectory
+        self.open_events = {}  # track_id -> event dict
+
+    def update(self, detections, now, timestamp, detected=True):
+        for detection in detections:
+            track_id = detection['track_id']
+            event = self.open_events.get(track_id)
+
+            if event is not None and event['class_id'] != detection['class_id']:
+                # An event has a single class so counts never need to be
+                # revised; a track that changes class starts a new event
+                self._write(event, 'closed', now)
+                event = None
+
+            if event is None:
+                event = {
+                    'event_key': uuid.uuid4().hex,
+                    'track_id': track_id,
+                    'class_id': detection['class_id'],
+                    'class_name': detection['class_name'],
+                    'confidence': detection['confidence'],
+                    'bbox': detection['bbox'],
+                    'first_seen': timestamp,
+                    'first_time': now,
+                    'frame_count': 0,
+                    'trajectory': [],
+                    'written_at': None,
+                }
+                self.open_events[track_id] = event
+
+            event['last_seen'] = timestamp
+            event['last_time'] = now
+            if detected:
+                event['frame_count'] += 1
+            event['bbox'] = detection['bbox']
+            event['confidence'] = max(event['confidence'], detection['confidence'])
+
+            # Downsampled trajectory: [seconds since first seen, x1, y1, x2, y2]
+            trajectory = event['trajectory']
+            offset = now - event['first_time']
+            if len(trajectory) < self.max_trajectory and (
+                    not trajectory or offset - trajectory[-1][0] >= self.trajectory_interval):
+                trajectory.append([round(offset, 2), *detection['bbox']])
+
+            if event['written_at'] is None or now - event['written_at'] >= self.update_interval:
+                self._write(event, 'open', now)
+
+        self.expire(now)
+
+    def expire(self, now):
+        for track_id, event in list(self.open_events.items()):
+            if now - event['last_time'] > self.expire_after:
+                self._write(event, 'closed', now)
+                del self.open_events[track_id]
+
+    def close_all(self):
+        for event in self.open_events.values():
+            self._write(event, 'closed', event['last_time'])
+        self.open_events.clear()
+
+    def _write(self, event, status, now):
+        event['written_at'] = now
+        self.writer.write_event((
+            event['event_key'],
+            self.camera_id,
+            event['track_id'],
+            event['class_id'],
+            event['class_name'],
+            event['confidence'],
+            *event['bbox'],
+            event['first_seen'],
+            event['last_seen'],
+            event['frame_count'],
+            json.dumps(event['trajectory']),
+            status,
+        ))
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from .pipeline import LoopQueue, PipelineStage, StageStats
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x50504531  # 'PPE1'
+
+# Segment layout: header, one index entry per slot, the detections (JSON) of
+# every slot, then the frames of every slot. Everything is allocated when the
+# segment is created and written in place.
+HEADER = np.dtype([
+    ('magic', '<u4'), ('slots', '<u4'), ('height', '<u4'), ('width', '<u4'),
+    ('channels', '<u4'), ('meta_size', '<u4'), ('latest', '<u8'),
+])
+INDEX = np.dtype([
+    ('stamp', '<u8'), ('sequence', '<u8'), ('timestamp', '<f8'), ('meta_length', '<u4'), ('pad', '<u4'),
+])
+
+
+def segment_name(camera_id, prefix='ppe'):
+    return f"{prefix}_{re.sub(r'[^A-Za-z0-9_]', '_', str(camera_id))}"
+
+
+def segment_size(slots, shape, meta_size):
+    return HEADER.itemsize + slots * (INDEX.itemsize + meta_size + int(np.prod(shape)))
+
+
+class FrameRing:
+    # numpy views of the header, index, detection and frame areas of a segment
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray((), HEADER, shm.buf, 0)
+        slots, meta_size = int(self.header['slots']), int(self.header['meta_size'])
+        shape = (int(self.header['height']), int(self.header['width']), int(self.header['channels']))
+        offset = HEADER.itemsize
+        self.index = np.ndarray((slots,), INDEX, shm.buf, offset)
+        offset += slots * INDEX.itemsize
+        self.meta = np.ndarray((slots, meta_size), np.uint8, shm.buf, offset)
+        offset += slots * meta_size
+        self.frames = np.ndarray((slots,) + shape, np.uint8, shm.buf, offset)
+        self.slots = slots
+        self.shape = shape
+
+    def release(self):
+        # The views must go before the segment can be closed
+        self.header = self.index = self.meta = self.frames = None
+        self.shm.close()
+
+
+class FrameBusWriter:
+    # Publishes the frames and detections of one camera into a shared-memory
+    # ring of `slots` entries. Each slot has a stamp that is odd while the
+    # slot is being written and 2 * sequence once it is complete (a seqlock),
+    # so readers in other processes never need a lock or a copy from us.
+
+    def __init__(self, name, shape, slots=8, meta_size=65536):
+        self.name = name
+        size = segment_size(slots, shape, meta_size)
+        try:
+            # Left over from a service that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((), HEADER, self.shm.buf, 0)
+        header[()] = (MAGIC, slots, shape[0], shape[1], shape[2], meta_size, 0)
+        del header
+        self.ring = FrameRing(self.shm)
+        self.sequence = 0
+        self.oversized = 0
+
+    def publish(self, frame, detections, timestamp=None):
+        ring = self.ring
+        if frame.shape != ring.shape:
+            frame = cv2.resize(frame, (ring.shape[1], ring.shape[0]))
+        meta = json.dumps(detections).encode()
+        if len(meta) > ring.meta.shape[1]:
+            self.oversized += 1
+            meta = b'[]'
+
+        self.sequence += 1
+        slot = self.sequence % ring.slots
+        entry = ring.index[slot:slot + 1]
+        entry['stamp'] = 2 * self.sequence - 1
+        ring.frames[slot] = frame
+        ring.meta[slot, :len(meta)] = np.frombuffer(meta, np.uint8)
+        entry['sequence'] = self.sequence
+        entry['timestamp'] = time.time() if timestamp is None else timestamp
+        entry['meta_length'] = len(meta)
+        entry['stamp'] = 2 * self.sequence
+        ring.header['latest'] = self.sequence
+
+    def close(self):
+        self.ring.release()
+        self.shm.unlink()
+
+
+def attach_segment(name):
+    shm = shared_memory.SharedMemory(name)
+    # Readers must not unlink the writer's segment when they exit
+    # (Python < 3.13 registers attached segments with the resource tracker)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class FrameBusReader:
+    # Reads the newest frame of one camera from a FrameBusWriter segment.
+    # get() has the contract of DropOldestQueue.get, so the reader can feed
+    # a PipelineStage; frames published in between are skipped. A segment
+    # that stops advancing is re-attached, which picks up a restarted service.
+    # While the segment is missing or stalled, attach attempts back off up
+    # to max_retry_delay, and each change of state is logged once.
+
+    def __init__(self, name, poll_interval=0.005, reattach_after=2.0, max_retry_delay=5.0):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.reattach_after = reattach_after
+        self.max_retry_delay = max_retry_delay
+        self.retry_delay = poll_interval
+        self.retry_at = 0.0
+        self.state = None  # 'reading', 'missing', 'invalid' or 'stalled'
+        self.ring = None
+        self.last = 0
+        self.latest = 0  # Newest sequence seen in the segment
+        self.last_progress = time.monotonic()
+        self.dropped = 0  # Frames published but never read
+        self.torn = 0  # Slots overwritten while being copied
+
+    def set_state(self, state, message, *args):
+        if state != self.state:
+            self.state = state
+            logger.log(logging.INFO if state == 'reading' else logging.WARNING, message, *args)
+
+    def attach(self):
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+        self.retry_at = now + self.retry_delay
+        self.retry_delay = min(self.retry_delay * 2, self.max_retry_delay)
+        try:
+            shm = attach_segment(self.name)
+        except FileNotFoundError:
+            self.set_state('missing', "Frame bus %s does not exist, waiting for the inference service", self.name)
+            return False
+        ring = FrameRing(shm)
+        if int(ring.header['magic']) != MAGIC:
+            ring.release()
+            self.set_state('invalid', "Shared memory segment %s is not a frame bus", self.name)
+            return False
+        self.ring = ring
+        # The frame already read from a stalled segment is not read again;
+        # a restarted service counts from 0
+        self.latest = int(ring.header['latest'])
+        if self.latest < self.last:
+            self.last = 0
+        self.last_progress = now
+        return True
+
+    def detach(self):
+        if self.ring is not None:
+            self.ring.release()
+            self.ring = None
+
+    def read(self):
+        # (frame, detections) of the newest complete slot, None if there is
+        # no new one
+        ring = self.ring
+        latest = self.latest = int(ring.header['latest'])
+        if latest == self.last:
+            return None
+
+        slot = latest % ring.slots
+        stamp = int(ring.index['stamp'][slot])
+        if stamp != 2 * latest:
+            return None  # Already being overwritten; the next poll gets a newer one
+        frame = ring.frames[slot].copy()
+        meta = ring.meta[slot, :int(ring.index['meta_length'][slot])].tobytes()
+        if int(ring.index['stamp'][slot]) != stamp:
+            self.torn += 1
+            return None
+
+        if 0 < self.last < latest:
+            self.dropped += latest - self.last - 1
+        self.last = latest
+        return frame, json.loads(meta)
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if self.ring is not None and now - self.last_progress > self.reattach_after:
+                self.detach()
+                self.set_state('stalled', "Frame bus %s stopped advancing, re-attaching", self.name)
+            if self.ring is not None or self.attach():
+                item = self.read()
+                if item is not None:
+                    self.last_progress = now
+                    self.retry_delay = self.poll_interval
+                    self.set_state('reading', "Reading frame bus %s", self.name)
+                    return item
+            if deadline is not None and now >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def qsize(self):
+        return int(self.latest != self.last)
+
+
+class FrameBusStream:
+    # Web-worker side of a camera served by the inference service: an
+    # encode thread renders the frames read from the bus and hands them to
+    # the event loop, like CameraStream does for local inference
+
+    def __init__(self, camera_id, name, queue_size):
+        self.camera_id = camera_id
+        self.reader = FrameBusReader(name)
+        self.queue_size = queue_size
+        self.broadcast_stats = StageStats('broadcast', camera_id)
+        self.stage = None
+        self.output_queue = None
+
+    def start(self, loop, render):
+        self.output_queue = LoopQueue(loop, self.queue_size)
+        self.stage = PipelineStage('encode', lambda item: render(*item), self.reader, self.output_queue, self.camera_id)
+        self.stage.start()
+
+    def stop(self):
+        self.stage.stop()
+        self.stage.join(timeout=2)
+        self.reader.detach()
+
+    def stats(self):
+        stats = {'broadcast': self.broadcast_stats.snapshot(), 'encode': self.stage.stats.snapshot(self.reader)}
+        stats['encode']['torn'] = self.reader.torn
+        stats['encode']['attached'] = self.reader.ring is not None
+        stats['output'] = {'queue_depth': self.output_queue.qsize(), 'dropped': self.output_queue.dropped}
+        return stats
+
+
+class FrameBusPipeline:
+    # Stand-in for VideoPipeline in web workers when PPE_FRAME_BUS is on:
+    # capture, inference and tracking run in the inference_service command
+    # and every worker only renders and broadcasts what it publishes
+
+    def __init__(self, cameras, prefix='ppe', queue_size=2):
+        self.cameras = cameras
+        self.prefix = prefix
+        self.queue_size = queue_size
+        self.streams = {}
+        self._lock = threading.Lock()
+
+    def is_running(self, camera_id):
+        return camera_id in self.streams
+
+    def start(self, camera_id, loop, render):
+        with self._lock:
+            if camera_id in self.streams:
+                return
+            stream = FrameBusStream(camera_id, segment_name(camera_id, self.prefix), self.queue_size)
+            stream.start(loop, render)
+            self.streams[camera_id] = stream
+
+    def stop(self, camera_id):
+        with self._lock:
+            stream = self.streams.pop(camera_id, None)
+        if stream is not None:
+            stream.stop()
+
+    async def get(self, camera_id, timeout=None):
+        return await asyncio.wait_for(self.streams[camera_id].output_queue.get(), timeout)
+
+    def broadcast_stats(self, camera_id):
+        return self.streams[camera_id].broadcast_stats
+
+    def stats(self):
+        return {
+            'inference': {},
+            'cameras': {camera_id: stream.stats() for camera_id, stream in list(self.streams.items())},
+        }
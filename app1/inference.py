@@ -0,0 +1,113 @@
+import glob
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+# Exported formats ultralytics can load back, and the suffix its exporter
+# gives them next to the .pt weights (best.pt -> best.onnx, ...)
+EXPORTS = {
+    'torchscript': '.torchscript',
+    'onnx': '.onnx',
+    'openvino': '_openvino_model',
+}
+BACKENDS = ('pytorch',) + tuple(EXPORTS)
+
+
+def exported_path(weights, backend):
+    return os.path.splitext(weights)[0] + EXPORTS[backend]
+
+
+def export_model(weights, backend, imgsz=640):
+    # ONNX and OpenVINO are exported with dynamic shapes so several cameras
+    # can share one call; the TorchScript trace is fixed to one image
+    from ultralytics import YOLO
+    return YOLO(weights).export(format=backend, imgsz=imgsz, dynamic=backend in ('onnx', 'openvino'))
+
+
+class InferenceBackend:
+    # A YOLO model run eagerly in PyTorch or from an exported file. Called
+    # with a list of frames, returns one ultralytics Results per frame.
+
+    def __init__(self, backend='pytorch', weights='app1/best.pt', imgsz=640, threads=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        self.backend = backend
+        self.imgsz = imgsz
+
+        if threads and backend in ('pytorch', 'torchscript'):
+            import torch
+            torch.set_num_threads(threads)
+
+        path = weights
+        if backend != 'pytorch':
+            path = exported_path(weights, backend)
+            if not os.path.exists(path):
+                logger.info("Exporting %s to %s", weights, backend)
+                path = export_model(weights, backend, imgsz)
+
+        from ultralytics import YOLO
+        self.model = YOLO(path, task='detect')
+        # For exported models this also opens them (the predictor's AutoBackend)
+        self.names = self.model.names
+        self.batched = backend != 'torchscript'
+        if threads and backend == 'onnx':
+            set_onnx_threads(self.model.predictor.model, path, threads)
+        elif threads and backend == 'openvino':
+            set_openvino_threads(self.model.predictor.model, path, threads)
+
+    def __call__(self, frames):
+        if self.batched:
+            return self.model(frames, imgsz=self.imgsz, verbose=False)
+        return [self.model(frame, imgsz=self.imgsz, verbose=False)[0] for frame in frames]
+
+    def threads(self):
+        # CPU threads the runtime runs the model on, None for its automatic
+        # default
+        if self.backend in ('pytorch', 'torchscript'):
+            import torch
+            return torch.get_num_threads()
+        if self.backend == 'onnx':
+            threads = self.model.predictor.model.session.get_session_options().intra_op_num_threads
+        else:
+            threads = self.model.predictor.model.ov_compiled_model.get_property('INFERENCE_NUM_THREADS')
+        return threads or None
+
+
+# ultralytics opens ONNX Runtime and OpenVINO models with the runtime's
+# default thread pool and takes no options for it, so with a thread count
+# set its session or compiled model is replaced by one opened here
+
+def set_onnx_threads(autobackend, path, threads):
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    autobackend.session = onnxruntime.InferenceSession(path, options,
+                                                       providers=autobackend.session.get_providers())
+
+
+def set_openvino_threads(autobackend, path, threads):
+    import openvino as ov
+    core = ov.Core()
+    xml = path if os.path.isfile(path) else next(glob.iglob(os.path.join(path, '*.xml')))
+    model = core.read_model(xml)
+    if model.get_parameters()[0].get_layout().empty:
+        model.get_parameters()[0].set_layout(ov.Layout('NCHW'))
+    autobackend.ov_compiled_model = core.compile_model(model, 'CPU', {
+        'PERFORMANCE_HINT': autobackend.inference_mode,
+        'INFERENCE_NUM_THREADS': threads,
+    })
+
+
+def make_backend(settings, **overrides):
+    # Backend configured by the PPE_INFERENCE_* settings
+    options = {
+        'backend': getattr(settings, 'PPE_INFERENCE_BACKEND', 'pytorch'),
+        'weights': getattr(settings, 'PPE_MODEL_PATH', 'app1/best.pt'),
+        'imgsz': getattr(settings, 'PPE_INFERENCE_IMGSZ', 640),
+        'threads': getattr(settings, 'PPE_INFERENCE_THREADS', None),
+    }
+    options.update(overrides)
+    return InferenceBackend(**options)
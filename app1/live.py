@@ -0,0 +1,47 @@
+import asyncio
+from collections import Counter
+
+from channels.layers import get_channel_layer
+
+from .analytics import time_bucket
+
+
+# Channel layer group of the dashboard sockets (ws/detections/)
+DETECTION_EVENTS_GROUP = 'detection_events'
+
+
+def event_deltas(events):
+    # Counter increments caused by the events a flush created
+    new_events = [event for event in events if event['new']]
+    classes = Counter((event['class_id'], event['class_name']) for event in new_events)
+    return {
+        'total_detections': len(new_events),
+        'class_counts': [[class_id, class_name, count] for (class_id, class_name), count in classes.items()],
+        'time_based_counts': dict(Counter(time_bucket(event['timestamp']) for event in new_events)),
+    }
+
+
+class EventPublisher:
+    # Forwards flushed track events from the writer thread to the dashboard
+    # group. group_send is scheduled on the event loop the consumers run on,
+    # which also works with the in-memory channel layer; with the Redis layer
+    # dashboards in other processes receive the events too.
+
+    def __init__(self, group=DETECTION_EVENTS_GROUP):
+        self.group = group
+        self.loop = None
+
+    def bind(self, loop):
+        self.loop = loop
+
+    def publish(self, events):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+
+        message = {
+            'type': 'detection.events',
+            'events': events,
+            'deltas': event_deltas(events),
+        }
+        asyncio.run_coroutine_threadsafe(get_channel_layer().group_send(self.group, message), loop)
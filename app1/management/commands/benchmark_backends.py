@@ -0,0 +1,84 @@
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app1.inference import BACKENDS, make_backend
+from app1.tracking import hungarian_match, iou_matrix
+
+
+class Command(BaseCommand):
+    help = 'Compare FPS and detection drift of inference backends on a recorded clip'
+
+    def add_arguments(self, parser):
+        parser.add_argument('clip', help='Video file to run every backend on')
+        parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS,
+                            help='Backends to compare; the first one is the reference for drift')
+        parser.add_argument('--imgsz', type=int, default=getattr(settings, 'PPE_INFERENCE_IMGSZ', 640))
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'PPE_INFERENCE_THREADS', None))
+        parser.add_argument('--frames', type=int, default=300, help='Frames read from the clip')
+        parser.add_argument('--batch-size', type=int, default=1)
+        parser.add_argument('--iou', type=float, default=0.5, help='IoU for a box to count as the same detection')
+
+    def handle(self, *args, **options):
+        frames = read_clip(options['clip'], options['frames'])
+        if not frames:
+            raise CommandError(f"No frames could be read from {options['clip']}")
+        self.stdout.write(f"{len(frames)} frames, imgsz {options['imgsz']}, batch size {options['batch_size']}")
+        self.stdout.write(f"{'backend':<12}{'threads':>8}{'load s':>8}{'fps':>9}{'recall':>9}{'mean iou':>10}"
+                          f"{'conf diff':>11}")
+
+        reference = None
+        for backend in options['backends']:
+            started = time.perf_counter()
+            infer = make_backend(settings, backend=backend, imgsz=options['imgsz'], threads=options['threads'])
+            load_time = time.perf_counter() - started
+            infer(frames[:1])  # Warm-up, not timed
+
+            detections = []
+            started = time.perf_counter()
+            for start in range(0, len(frames), options['batch_size']):
+                for result in infer(frames[start:start + options['batch_size']]):
+                    boxes = result.boxes.cpu().numpy()
+                    detections.append((boxes.xyxy, boxes.conf, boxes.cls.astype(int)))
+            fps = len(frames) / (time.perf_counter() - started)
+
+            if reference is None:
+                reference = detections
+                drift = (1.0, 1.0, 0.0)
+            else:
+                drift = compare(reference, detections, options['iou'])
+            threads = infer.threads() or 'auto'
+            self.stdout.write(f"{backend:<12}{threads:>8}{load_time:8.2f}{fps:9.1f}{drift[0]:9.3f}{drift[1]:10.3f}"
+                              f"{drift[2]:11.4f}")
+
+
+def read_clip(path, max_frames):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+def compare(reference, detections, threshold):
+    # Share of reference boxes found again with the same class, their mean
+    # IoU and the mean absolute confidence difference of the matched boxes
+    total, ious, conf_diffs = 0, [], []
+    for (ref_boxes, ref_conf, ref_cls), (boxes, conf, cls) in zip(reference, detections):
+        total += len(ref_boxes)
+        if not len(ref_boxes) or not len(boxes):
+            continue
+        iou = iou_matrix(ref_boxes, boxes)
+        iou[ref_cls[:, None] != cls[None, :]] = 0
+        for row, col in hungarian_match(iou, threshold):
+            ious.append(iou[row, col])
+            conf_diffs.append(abs(ref_conf[row] - conf[col]))
+    recall = len(ious) / total if total else 1.0
+    return recall, float(np.mean(ious)) if ious else 0.0, float(np.mean(conf_diffs)) if conf_diffs else 0.0
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from app1.alerts import NullSink
+from app1.protocol import BINARY_SUBPROTOCOL, unpack_binary
+from app1.retention import count_raw_detections
+
+
+CAMERA = 'benchmark'
+STAGES = ('capture', 'inference', 'tracking', 'encode', 'broadcast')
+
+
+def rss_bytes():
+    # Current resident memory; peak RSS where /proc is not available
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Command(BaseCommand):
+    help = ('Replay a clip through the full stream pipeline with mock WebSocket clients and report '
+            'throughput, stage latencies, memory growth and database rows')
+
+    def add_arguments(self, parser):
+        parser.add_argument('clip', help='Video file to replay')
+        parser.add_argument('--frames', type=int, default=300, help='Frames every client must receive')
+        parser.add_argument('--clients', type=int, default=1)
+        parser.add_argument('--json-clients', action='store_true', help='Use base64 JSON instead of binary frames')
+        parser.add_argument('--realtime', action='store_true', help="Replay at the clip's frame rate")
+        parser.add_argument('--lossy', action='store_true',
+                            help='Let capture replace frames inference has not taken yet (default: every frame is inferred)')
+        parser.add_argument('--detect-every', type=int, default=1)
+        parser.add_argument('--motion-gate', action='store_true', help='Skip inference on static frames')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for any single frame')
+        parser.add_argument('--output', help='Also write the raw results as JSON to this file')
+
+    def handle(self, *args, **options):
+        if not os.path.isfile(options['clip']):
+            raise CommandError(f"No such clip: {options['clip']}")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # Offline and headless: a scratch database, no alert sinks and no
+            # alert clips. app1.consumers reads its settings on import, so it
+            # is only imported under the override.
+            db = os.path.join(tmp, 'benchmark.db')
+            with override_settings(PPE_DETECTIONS_DB=db, PPE_ALERT_SINKS=['null'], PPE_CLIPS=False):
+                results = self.benchmark(db, options)
+
+        self.report(results, options)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    def benchmark(self, db, options):
+        from app1 import consumers
+        self.check_setup(consumers, db)
+
+        config = {
+            'source': options['clip'],
+            'realtime': options['realtime'],
+            'loop': True,
+            'lossless': not options['lossy'],
+            'detect_every': options['detect_every'],
+        }
+        if not options['realtime']:
+            config['target_fps'] = 0  # Unpaced
+        if not options['motion_gate']:
+            config['motion_threshold'] = 0  # Every scheduled frame is inferred
+        consumers.pipeline.cameras[CAMERA] = config
+
+        results = asyncio.run(self.run(consumers, options))
+
+        writer = consumers.detection_writer.get()
+        writer.stop()
+        results['db_writer'] = writer.stats()
+        conn = sqlite3.connect(db)
+        results['db_rows'] = {
+            'track_events': conn.execute('SELECT COUNT(*) FROM track_events').fetchone()[0],
+            'detections': count_raw_detections(conn),
+        }
+        conn.close()
+        return results
+
+    def check_setup(self, consumers, db):
+        # Fails if the stream components were set up before the override
+        writer = consumers.detection_writer.get()
+        sinks = consumers.alert_dispatcher.get().sinks
+        if consumers.RECORD_CLIPS or writer.path != db or not all(isinstance(sink, NullSink) for sink in sinks):
+            raise CommandError('app1.consumers was set up before the benchmark settings took effect')
+
+    async def run(self, consumers, options):
+        from app1.routing import websocket_urlpatterns
+        application = URLRouter(websocket_urlpatterns)
+        subprotocols = [] if options['json_clients'] else [BINARY_SUBPROTOCOL]
+
+        clients = []
+        for _ in range(options['clients']):
+            client = WebsocketCommunicator(application, f'/ws/video_stream/{CAMERA}/', subprotocols=subprotocols)
+            connected, _ = await client.connect(timeout=options['timeout'])
+            if not connected:
+                raise CommandError('Mock client could not connect')
+            clients.append(client)
+
+        # Memory is measured from the first frame on, after model loading
+        await self.receive_frame(clients[0], options['timeout'])
+        rss_start = rss_bytes()
+        timings = await asyncio.gather(*(self.consume(client, options) for client in clients))
+        rss_end = rss_bytes()
+
+        await clients[0].send_json_to({'action': 'get_pipeline_stats'})
+        stats = await self.receive_stats(clients[0], options['timeout'])
+
+        for client in clients:
+            await client.disconnect()
+        # The pipeline stops before stream_video closes the track events;
+        # the broadcaster is released once all of that is done
+        broadcaster = consumers.VideoStreamConsumer.broadcasters[CAMERA]
+        deadline = time.monotonic() + 10
+        while broadcaster.streaming and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        camera = stats['cameras'][CAMERA]
+        stages = {stage: stats['inference'] if stage == 'inference' else camera.get(stage, {}) for stage in STAGES}
+        return {
+            'clients': [{'frames': frames, 'fps': round(frames / elapsed, 2) if elapsed else None}
+                        for frames, elapsed in timings],
+            'stages': stages,
+            'send': list(camera.get('subscribers', {}).values()),
+            'skipped_inference': camera.get('capture', {}).get('skipped'),
+            'memory': {
+                'rss_start_mb': round(rss_start / 2 ** 20, 1),
+                'rss_end_mb': round(rss_end / 2 ** 20, 1),
+                'growth_mb': round((rss_end - rss_start) / 2 ** 20, 1),
+            },
+        }
+
+    async def consume(self, client, options):
+        started = time.perf_counter()
+        for _ in range(options['frames']):
+            await self.receive_frame(client, options['timeout'])
+        return options['frames'], time.perf_counter() - started
+
+    async def receive_frame(self, client, timeout):
+        # Skips alert notifications and other text messages
+        while True:
+            message = await client.receive_output(timeout)
+            if message.get('bytes') is not None:
+                unpack_binary(message['bytes'])
+                return
+            if 'frame' in json.loads(message['text']):
+                return
+
+    async def receive_stats(self, client, timeout):
+        while True:
+            message = await client.receive_output(timeout)
+            if message.get('text') is not None:
+                data = json.loads(message['text'])
+                if 'pipeline_stats' in data:
+                    return data['pipeline_stats']
+
+    def report(self, results, options):
+        mode = 'real time' if options['realtime'] else 'as fast as possible'
+        self.stdout.write(f"{options['clip']}: {options['frames']} frames x {options['clients']} client(s), {mode}")
+        for i, client in enumerate(results['clients']):
+            self.stdout.write(f"client {i}: {client['fps']} fps end to end")
+
+        self.stdout.write(f"{'stage':<12}{'fps':>9}{'frames':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        rows = list(results['stages'].items())
+        rows += [(f'send {i}', send) for i, send in enumerate(results['send'])]
+        rows.append(('db write', results['db_writer']['flush']))
+        for name, stats in rows:
+            self.stdout.write(f"{name:<12}{stats.get('fps', ''):>9}{stats.get('frames', stats.get('sent', '')):>9}"
+                              f"{stats.get('p50_ms', ''):>9}{stats.get('p95_ms', ''):>9}{stats.get('p99_ms', ''):>9}")
+
+        memory = results['memory']
+        self.stdout.write(f"memory: {memory['rss_start_mb']} MB -> {memory['rss_end_mb']} MB "
+                          f"({memory['growth_mb']:+} MB)")
+        self.stdout.write(f"inference skipped on {results['skipped_inference']} frames")
+        self.stdout.write(f"db: {results['db_writer']['rows_written']} rows written, "
+                          f"{results['db_rows']['track_events']} track events, "
+                          f"{results['db_rows']['detections']} raw detections, "
+                          f"{results['db_writer']['dropped']} dropped")
@@ -0,0 +1,47 @@
+import importlib
+import sys
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app1 import resources
+
+
+class Command(BaseCommand):
+    help = 'Measure cold-start costs: importing the routing, loading the model, warm-up and first inferences'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=10, help='Timed inferences after the warm-up')
+        parser.add_argument('--skip-model', action='store_true', help='Only time what an HTTP-only worker pays')
+
+    def handle(self, *args, **options):
+        # What every manage.py command and HTTP worker pays: the consumers
+        # are imported through the websocket routing
+        was_imported = 'app1.routing' in sys.modules
+        started = time.perf_counter()
+        importlib.import_module('app1.routing')
+        self.report('import routing', time.perf_counter() - started, ' (already imported)' if was_imported else '')
+        if options['skip_model']:
+            return
+
+        resources.model.get()
+        self.report('load model', resources.model.load_time)
+
+        resources.warm_up()
+        self.report('warm-up inference', resources.warmup_time)
+
+        size = getattr(settings, 'PPE_WARMUP_SIZE', 640)
+        frame = np.zeros((size, size, 3), dtype=np.uint8)
+        timings = []
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            resources.model.get()([frame])
+            timings.append(time.perf_counter() - started)
+        if timings:
+            self.report(f'inference (mean of {len(timings)})', float(np.mean(timings)))
+            self.report('inference (p95)', float(np.percentile(timings, 95)))
+
+    def report(self, label, seconds, note=''):
+        self.stdout.write(f'{label:<28}{seconds * 1000:10.1f} ms{note}')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from app1.retention import compact
+from app1.storage import DETECTIONS_DB, setup_database
+
+
+class Command(BaseCommand):
+    help = ('Archive raw detection partitions and track events past their retention to compressed .npz files '
+            'and VACUUM the detections database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db', default=DETECTIONS_DB, help='Path of the detections database')
+        parser.add_argument('--archive-dir', help='Where archives go (default: PPE_ARCHIVE_DIR)')
+        parser.add_argument('--raw-days', type=int, help='Days of raw detections to keep (default: PPE_RAW_RETENTION_DAYS)')
+        parser.add_argument('--event-days', type=int,
+                            help='Days of track events to keep (default: PPE_EVENT_RETENTION_DAYS)')
+        parser.add_argument('--no-vacuum', action='store_true', help='Skip the VACUUM, which waits for and then blocks the detection writer')
+
+    def handle(self, *args, **options):
+        conn = setup_database(options['db'])
+        summary = compact(
+            conn,
+            archive_dir=options['archive_dir'],
+            raw_days=options['raw_days'],
+            event_days=options['event_days'],
+            vacuum=not options['no_vacuum'],
+        )
+        conn.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {summary['raw_rows']} raw detections from {summary['raw_partitions']} partitions and "
+            f"{summary['events']} track events in {summary['seconds']:.2f}s"
+        ))
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app1.cameras import get_camera_configs
+from app1.consumers import (alert_dispatcher, detection_writer, event_publisher, inference_pool,
+                            load_class_names, load_clip_recorder, make_pipeline, make_processor)
+from app1.framebus import FrameBusWriter, segment_name
+from app1.zones import Zones
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Run capture, inference, tracking and alerts for the cameras and publish frames and '
+            'detections to shared memory, where web workers with PPE_FRAME_BUS read them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('cameras', nargs='*', help='Camera ids to serve (default: all of PPE_CAMERAS)')
+        parser.add_argument('--slots', type=int, default=getattr(settings, 'PPE_FRAME_BUS_SLOTS', 8),
+                            help='Frames kept per camera')
+        parser.add_argument('--stats-interval', type=float, default=30.0,
+                            help='Seconds between stats log lines (0 disables them)')
+
+    def handle(self, *args, **options):
+        configs = get_camera_configs()
+        camera_ids = options['cameras'] or list(configs)
+        unknown = [camera_id for camera_id in camera_ids if camera_id not in configs]
+        if unknown:
+            raise CommandError(f"Unknown cameras: {', '.join(unknown)}")
+        asyncio.run(self.serve(configs, camera_ids, options))
+
+    async def serve(self, configs, camera_ids, options):
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, task.cancel)
+
+        class_names = await load_class_names(loop)
+        writer = await loop.run_in_executor(None, detection_writer.get)
+        dispatcher = await loop.run_in_executor(None, alert_dispatcher.get)
+        clips = await load_clip_recorder(loop)
+        # Alerts and dashboard events reach browsers of the web workers
+        # through the channel layer, so this needs the Redis layer
+        dispatcher.bind(loop)
+        event_publisher.bind(loop)
+
+        # Runs the model here, or sends the frames to the inference workers
+        pipeline = make_pipeline()
+        prefix = getattr(settings, 'PPE_FRAME_BUS_PREFIX', 'ppe')
+        buses = {}
+        processors = {}
+
+        def publisher(camera_id):
+            def publish(frame, detections):
+                # Runs in the encode thread. The segment is sized by the
+                # first frame; nothing goes back to the event loop.
+                bus = buses.get(camera_id)
+                if bus is None:
+                    bus = buses[camera_id] = FrameBusWriter(
+                        segment_name(camera_id, prefix), frame.shape, options['slots'])
+                    logger.info("Publishing camera %s to frame bus %s", camera_id, bus.name)
+                bus.publish(frame, detections)
+            return publish
+
+        for camera_id in camera_ids:
+            config = configs[camera_id]
+            processor = make_processor(camera_id, config, class_names, writer, dispatcher,
+                                       Zones(config.get('zones', ())), clips)
+            processors[camera_id] = processor
+            if inference_pool is not None:
+                await inference_pool.follow(camera_id)
+            pipeline.start(camera_id, loop, processor.process, publisher(camera_id), processor.crops)
+        logger.info("Inference service running for cameras %s", ', '.join(camera_ids))
+
+        try:
+            while True:
+                await asyncio.sleep(options['stats_interval'] or 3600)
+                if options['stats_interval']:
+                    self.log_stats(pipeline.stats(), buses)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for camera_id in camera_ids:
+                await loop.run_in_executor(None, pipeline.stop, camera_id)
+                processors[camera_id].close()
+            for bus in buses.values():
+                bus.close()
+            if clips is not None:
+                clips.stop()
+            writer.stop()
+            dispatcher.stop()
+            logger.info("Inference service stopped")
+
+    def log_stats(self, stats, buses):
+        logger.info("Inference: %.1f fps, batch %s", stats['inference'].get('fps', 0.0),
+                    stats['inference'].get('batch_size', 0))
+        for camera_id, camera in stats['cameras'].items():
+            bus = buses.get(camera_id)
+            logger.info("Camera %s: capture %.1f fps, published %s frames", camera_id,
+                        camera.get('capture', {}).get('fps', 0.0), bus.sequence if bus else 0)
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import signal
+import socket
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app1 import resources
+from app1.workers import run_worker
+
+
+class Command(BaseCommand):
+    help = ('Run the model for the cameras the pool assigns to this worker. Producers are web workers '
+            'or the inference service with PPE_INFERENCE_WORKERS set; start one worker per core or node.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default=f'{socket.gethostname()}-{os.getpid()}',
+                            help='Unique name of this worker (default: host and pid)')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.serve(options['worker_id']))
+
+    async def serve(self, worker_id):
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, task.cancel)
+
+        model = await loop.run_in_executor(None, resources.model.get)
+        await loop.run_in_executor(None, resources.warm_up)
+        try:
+            await run_worker(
+                worker_id,
+                model,
+                heartbeat_interval=getattr(settings, 'PPE_WORKER_HEARTBEAT', 1.0),
+                job_timeout=getattr(settings, 'PPE_WORKER_JOB_TIMEOUT', 2.0),
+            )
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app1.rollups import rebuild_rollups
+from app1.storage import DETECTIONS_DB, setup_database
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the hourly event rollups from track_events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db', default=DETECTIONS_DB, help='Path of the detections database')
+
+    def handle(self, *args, **options):
+        conn = setup_database(options['db'])
+        start = time.perf_counter()
+        last_id = rebuild_rollups(conn)
+        conn.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rollups up to event {last_id} in {time.perf_counter() - start:.2f}s'
+        ))
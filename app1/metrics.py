@@ -0,0 +1,142 @@
+import bisect
+import logging
+import threading
+import time
+
+
+# Minimal Prometheus text-format metrics. Instruments are updated from the
+# pipeline threads; collectors registered with add_collector add values that
+# are cheaper to read at scrape time (queue depths, drop counters, ...).
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stage latencies range from microseconds (broadcast) to seconds (CPU inference)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+    return '{' + pairs + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f'{self.name}{format_labels(dict(key))} {value}' for key, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(tuple(sorted(labels.items())), None)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = self.header()
+        for key, counts in values:
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self, log_interval=60.0):
+        self.metrics = []
+        self.collectors = []
+        # A failing collector is logged at most once per log_interval seconds,
+        # however often the metrics are scraped
+        self.log_interval = log_interval
+        self.logged_at = {}  # collector -> time its last error was logged
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        # collector() returns metrics built at scrape time
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collector in self.collectors:
+            try:
+                for metric in collector():
+                    lines += metric.render()
+            except Exception:
+                # A broken collector should not hide the other metrics
+                now = time.monotonic()
+                if now - self.logged_at.get(collector, float('-inf')) >= self.log_interval:
+                    self.logged_at[collector] = now
+                    logger.exception("Error in metrics collector %s", getattr(collector, '__qualname__', collector))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'ppe_stage_seconds', 'Time spent per frame in each pipeline stage'))
+TRACKED_OBJECTS = registry.register(Gauge(
+    'ppe_tracked_objects', 'Objects currently tracked per camera'))
+ALERTS = registry.register(Counter(
+    'ppe_alerts_total', 'Alerts raised per rule and camera'))
@@ -0,0 +1,577 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from .cameras import open_capture
+from .metrics import STAGE_SECONDS
+from .scheduling import make_scheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+class DropOldestQueue:
+    # Bounded queue between pipeline threads. When it is full the oldest item
+    # is discarded, so producers never block and consumers always get the
+    # freshest frame.
+
+    def __init__(self, maxsize=1):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def qsize(self):
+        return len(self._items)
+
+
+class LoopQueue:
+    # Same drop-oldest behaviour, but hands items from a pipeline thread over
+    # to the asyncio event loop. put() is thread-safe, get() is awaited.
+
+    def __init__(self, loop, maxsize=1):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize)
+
+    def put(self, item):
+        self._loop.call_soon_threadsafe(self._put_nowait, item)
+
+    def _put_nowait(self, item):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(item)
+
+    async def get(self):
+        return await self._queue.get()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+class FrameSlots:
+    # Latest-frame slot per camera, i.e. a drop-oldest queue of size one for
+    # every camera. Capture threads put frames in, the batch scheduler takes
+    # the waiting frames of several cameras at once.
+
+    def __init__(self):
+        self.dropped = {}
+        self._frames = {}
+        self._cond = threading.Condition()
+
+    def put(self, camera_id, item):
+        with self._cond:
+            if camera_id in self._frames:
+                # Keep the original arrival time so a busy camera cannot
+                # starve the others by constantly refreshing its slot
+                ready_at = self._frames[camera_id][0]
+                self.dropped[camera_id] = self.dropped.get(camera_id, 0) + 1
+            else:
+                ready_at = time.monotonic()
+            self._frames[camera_id] = (ready_at, item)
+            self._cond.notify()
+
+    def take(self, max_items, max_wait, timeout=None, exclude=()):
+        # Wait for a first frame, then up to max_wait for the batch to fill.
+        # Frames of the excluded cameras stay in their slots.
+        def ready():
+            return [camera_id for camera_id in self._frames if camera_id not in exclude]
+
+        with self._cond:
+            if not ready():
+                self._cond.wait(timeout)
+            if not ready():
+                return []
+
+            deadline = min(self._frames[camera_id][0] for camera_id in ready()) + max_wait
+            while len(ready()) < max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            camera_ids = sorted(ready(), key=lambda camera_id: self._frames[camera_id][0])
+            batch = [(camera_id, self._frames.pop(camera_id)[1]) for camera_id in camera_ids[:max_items]]
+            self._cond.notify_all()
+            return batch
+
+    def wake(self):
+        # Interrupts a waiting take(), e.g. when a remote result came in
+        with self._cond:
+            self._cond.notify_all()
+
+    def discard(self, camera_id):
+        with self._cond:
+            self._frames.pop(camera_id, None)
+            self._cond.notify_all()
+
+    def wait_taken(self, camera_id, timeout=None):
+        # Blocks while the camera's slot is still waiting for inference
+        with self._cond:
+            return self._cond.wait_for(lambda: camera_id not in self._frames, timeout)
+
+    def qsize(self, camera_id=None):
+        if camera_id is None:
+            return len(self._frames)
+        return int(camera_id in self._frames)
+
+
+class StageStats:
+    # Frame counter, windowed FPS, last processing time and latency
+    # percentiles over the last `samples` frames of a single stage. Every
+    # duration also goes to the ppe_stage_seconds histogram.
+
+    def __init__(self, name, camera_id=None, window=2.0, samples=1000):
+        self.name = name
+        self.labels = {'stage': name} if camera_id is None else {'stage': name, 'camera': camera_id}
+        self.window = window
+        self.frames = 0
+        self.fps = 0.0
+        self.last_duration = 0.0
+        self.durations = deque(maxlen=samples)
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+        self._lock = threading.Lock()
+
+    def record(self, duration):
+        now = time.monotonic()
+        with self._lock:
+            self.frames += 1
+            self.last_duration = duration
+            self.durations.append(duration)
+            self._window_frames += 1
+            elapsed = now - self._window_start
+            if elapsed >= self.window:
+                self.fps = self._window_frames / elapsed
+                self._window_start = now
+                self._window_frames = 0
+        STAGE_SECONDS.observe(duration, **self.labels)
+
+    def snapshot(self, queue=None):
+        stats = {
+            'fps': round(self.fps, 2),
+            'frames': self.frames,
+            'latency_ms': round(self.last_duration * 1000, 2),
+        }
+        with self._lock:
+            durations = list(self.durations)
+        if durations:
+            for percentile, value in zip((50, 95, 99), np.percentile(durations, (50, 95, 99))):
+                stats[f'p{percentile}_ms'] = round(float(value) * 1000, 2)
+        if queue is not None:
+            stats['queue_depth'] = queue.qsize()
+            stats['dropped'] = queue.dropped
+        return stats
+
+
+class PipelineStage(threading.Thread):
+    # Worker thread that takes items from input_queue, runs process() on them
+    # and pushes the result to output_queue
+
+    def __init__(self, name, process, input_queue, output_queue, camera_id=None):
+        thread_name = f'ppe-{name}-{camera_id}' if camera_id is not None else f'ppe-{name}'
+        super().__init__(name=thread_name, daemon=True)
+        self.stats = StageStats(name, camera_id)
+        self.process = process
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            item = self.input_queue.get(timeout=0.1)
+            if item is None:
+                continue
+
+            started = time.perf_counter()
+            try:
+                result = self.process(item)
+            except Exception:
+                logger.exception("Error in %s stage", self.stats.name)
+                continue
+            self.stats.record(time.perf_counter() - started)
+
+            if result is not None:
+                self.output_queue.put(result)
+
+
+class CaptureStage(PipelineStage):
+    # Opens a camera and reads frames from it at the rate the scheduler asks
+    # for (reads also block until the camera delivers, so a slower camera
+    # paces itself). Frames the scheduler picks go to inference, the others
+    # to skip(), which tracks them from the last detections and is told
+    # whether the frame moved past the motion gate.
+    #
+    # Live sources (devices, RTSP) deliver frames whether they are read or
+    # not: sleeping between reads would hand the next read a stale buffered
+    # frame and let RTSP decoders fall behind. Their frames are grabbed as
+    # they arrive and only retrieved (decoded) when one is due. Captures
+    # with live = False, like replayed files, are paced by sleeping.
+
+    def __init__(self, camera_id, open_capture, slots, scheduler, skip, retry_delay=0.5, lossless=False):
+        super().__init__('capture', None, None, None, camera_id)
+        self.camera_id = camera_id
+        self.open_capture = open_capture
+        self.slots = slots
+        self.scheduler = scheduler
+        self.skip = skip
+        self.retry_delay = retry_delay
+        self.lossless = lossless  # Wait for inference instead of replacing its pending frame
+        self.frame_id = 0
+
+    def run(self):
+        # Opening an RTSP stream can take seconds, so do it in this thread
+        capture = self.open_capture()
+        live = getattr(capture, 'live', True)
+        next_read = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                if live:
+                    if not capture.grab():
+                        logger.warning("Failed to capture frame from camera %s", self.camera_id)
+                        self._stop_event.wait(self.retry_delay)
+                        continue
+                    # Frames that arrive before the next one is due, or while
+                    # a lossless camera's last frame still waits for
+                    # inference, are dropped undecoded
+                    if time.monotonic() < next_read or (self.lossless and self.slots.qsize(self.camera_id)):
+                        continue
+                    started = time.perf_counter()
+                    ret, frame = capture.retrieve()
+                else:
+                    if self.lossless and not self.slots.wait_taken(self.camera_id, timeout=0.1):
+                        continue
+                    started = time.perf_counter()
+                    ret, frame = capture.read()
+                if not ret:
+                    logger.warning("Failed to capture frame from camera %s", self.camera_id)
+                    self._stop_event.wait(self.retry_delay)
+                    continue
+
+                self.stats.record(time.perf_counter() - started)
+                now = time.monotonic()
+                if self.scheduler.should_detect(frame, now):
+                    self.slots.put(self.camera_id, (self.frame_id, frame))
+                else:
+                    try:
+                        self.skip(self.frame_id, frame, self.scheduler.moving)
+                    except Exception:
+                        logger.exception("Error tracking skipped frame of camera %s", self.camera_id)
+                self.frame_id += 1
+
+                # Target FPS control: the next frame is due one interval
+                # later, without trying to catch up after a stall. Files
+                # sleep off the rest of the interval.
+                next_read = max(next_read + self.scheduler.interval(now), time.monotonic())
+                if not live:
+                    self._stop_event.wait(next_read - time.monotonic())
+        finally:
+            capture.release()
+
+
+class BatchInferenceStage(PipelineStage):
+    # Stacks the latest frame of up to batch_size cameras into a single
+    # infer() call and hands each result back to its camera stream
+
+    def __init__(self, infer, slots, streams, batch_size, max_wait):
+        super().__init__('inference', None, None, None)
+        self.infer = infer
+        self.slots = slots
+        self.streams = streams
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.last_batch_size = 0
+
+    def run(self):
+        while not self._stop_event.is_set():
+            # No point waiting for more frames than there are running cameras
+            max_items = max(1, min(self.batch_size, len(self.streams)))
+            batch = self.slots.take(max_items, self.max_wait, timeout=0.1)
+            if not batch:
+                continue
+
+            # A camera with detection zones contributes one crop per zone
+            images, counts = [], []
+            for camera_id, (_, frame) in batch:
+                stream = self.streams.get(camera_id)
+                crops = stream.crop(frame) if stream is not None else []
+                images.extend(crops)
+                counts.append(len(crops))
+
+            started = time.perf_counter()
+            try:
+                results = self.infer(images) if images else []
+            except Exception:
+                logger.exception("Error in inference stage")
+                continue
+            self.stats.record(time.perf_counter() - started)
+            self.last_batch_size = len(images)
+
+            start = 0
+            for (camera_id, (frame_id, frame)), count in zip(batch, counts):
+                stream = self.streams.get(camera_id)
+                if stream is not None:
+                    stream.handle_result(frame_id, frame, results[start:start + count])
+                start += count
+
+
+class RemoteInferenceStage(PipelineStage):
+    # Sends the frames of every camera to the inference worker pool (see
+    # workers.InferencePool) instead of running the model here. Up to
+    # max_in_flight frames per camera are out at a time; results are handed
+    # to the camera streams in frame order, and frames whose result does not
+    # come back within job_timeout (their worker died) are given up on.
+
+    def __init__(self, pool, slots, streams, max_in_flight=2, job_timeout=2.0):
+        super().__init__('inference', None, None, None)
+        self.pool = pool
+        self.slots = slots
+        self.streams = streams
+        self.max_in_flight = max_in_flight
+        self.job_timeout = job_timeout
+        self.pending = {}  # camera_id -> deque of (frame_id, frame, sent_at)
+        self.lost = 0
+        self.unassigned = 0
+        self.last_batch_size = 0
+        pool.on_result = slots.wake
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.handle_results()
+            self.expire(time.monotonic())
+
+            busy = {camera_id for camera_id, jobs in self.pending.items() if len(jobs) >= self.max_in_flight}
+            batch = self.slots.take(max(1, len(self.streams)), 0, timeout=0.1, exclude=busy)
+            for camera_id, (frame_id, frame) in batch:
+                stream = self.streams.get(camera_id)
+                if stream is None:
+                    continue
+                try:
+                    worker = self.pool.submit(camera_id, frame_id, stream.crop(frame))
+                except Exception:
+                    logger.exception("Error sending frame of camera %s to the worker pool", camera_id)
+                    continue
+                if worker is None:
+                    # No worker alive: keep the stream going on predicted boxes
+                    self.unassigned += 1
+                    stream.handle_result(frame_id, frame, None)
+                    continue
+                self.pending.setdefault(camera_id, deque()).append((frame_id, frame, time.monotonic()))
+            if batch:
+                self.last_batch_size = len(batch)
+
+    def handle_results(self):
+        for camera_id, frame_id, results in self.pool.take_results():
+            jobs = self.pending.get(camera_id)
+            stream = self.streams.get(camera_id)
+            # Frames sent before this one were lost on the way
+            while jobs and jobs[0][0] < frame_id:
+                jobs.popleft()
+                self.lost += 1
+            if not jobs or jobs[0][0] != frame_id or stream is None:
+                continue  # Given up on already, or another producer's frame
+            _, frame, sent_at = jobs.popleft()
+            self.stats.record(time.monotonic() - sent_at)
+            try:
+                stream.handle_result(frame_id, frame, results)
+            except Exception:
+                logger.exception("Error tracking frame of camera %s", camera_id)
+
+    def expire(self, now):
+        for jobs in self.pending.values():
+            while jobs and now - jobs[0][2] > self.job_timeout:
+                jobs.popleft()
+                self.lost += 1
+
+    def remote_stats(self):
+        stats = self.pool.stats()
+        stats.update({
+            'in_flight': sum(len(jobs) for jobs in self.pending.values()),
+            'lost': self.lost,
+            'unassigned': self.unassigned,
+        })
+        return stats
+
+
+class CameraStream:
+    # Per-camera part of the pipeline: capture thread -> (shared batch
+    # inference) -> encode thread -> event loop
+
+    def __init__(self, camera_id, config, slots, queue_size):
+        self.camera_id = camera_id
+        self.config = config
+        self.slots = slots
+        self.queue_size = queue_size
+        self.broadcast_stats = StageStats('broadcast', camera_id)
+        self.track_stats = StageStats('tracking', camera_id)
+        self.track = None
+        self.crop = None
+        self.scheduler = None
+        self.stages = []
+        self._track_lock = threading.Lock()  # Detected and skipped frames come from different threads
+        self.result_queue = None
+        self.output_queue = None
+
+    def start(self, loop, track, render, crop=None):
+        self.track = track
+        self.crop = crop or (lambda frame: [frame])
+        self.result_queue = DropOldestQueue(self.queue_size)
+        self.output_queue = LoopQueue(loop, self.queue_size)
+
+        def run_render(item):
+            frame, detections = item
+            return render(frame, detections)
+
+        self.scheduler = make_scheduler(self.config)
+        self.stages = [
+            CaptureStage(self.camera_id, lambda: open_capture(self.config), self.slots,
+                         self.scheduler, self.handle_skipped, lossless=self.config.get('lossless', False)),
+            PipelineStage('encode', run_render, self.result_queue, self.output_queue, self.camera_id),
+        ]
+        for stage in self.stages:
+            stage.start()
+
+    def handle_result(self, frame_id, frame, result, moving=True):
+        # Called from the inference thread
+        with self._track_lock:
+            started = time.perf_counter()
+            detections = self.track(frame_id, frame, result, moving)
+            self.track_stats.record(time.perf_counter() - started)
+        self.result_queue.put((frame, detections))
+
+    def handle_skipped(self, frame_id, frame, moving=True):
+        # Called from the capture thread; track() gets no result and follows
+        # the last detections
+        self.handle_result(frame_id, frame, None, moving)
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join(timeout=2)
+        self.stages = []
+        self.slots.discard(self.camera_id)
+
+    def stats(self):
+        stats = {'broadcast': self.broadcast_stats.snapshot(), 'tracking': self.track_stats.snapshot()}
+        if self.stages:
+            capture, encode = self.stages
+            stats['capture'] = capture.stats.snapshot()
+            stats['capture']['queue_depth'] = self.slots.qsize(self.camera_id)
+            stats['capture']['dropped'] = self.slots.dropped.get(self.camera_id, 0)
+            stats['capture'].update(self.scheduler.stats(time.monotonic()))
+            stats['encode'] = encode.stats.snapshot(self.result_queue)
+            stats['output'] = {
+                'queue_depth': self.output_queue.qsize(),
+                'dropped': self.output_queue.dropped,
+            }
+        return stats
+
+
+class VideoPipeline:
+    # Runs one CameraStream per camera that has subscribers and a single
+    # BatchInferenceStage shared by all of them.
+    #
+    # crop(frame) returns the images of a camera frame to run inference on (the
+    # whole frame by default), infer(images) returns one result per image,
+    # track(frame_id, frame, results, moving) returns the detections of one
+    # camera frame (results is None for frames the scheduler skipped inference
+    # on, moving is False if it skipped them for lack of motion) and
+    # render(frame, detections) returns the message to broadcast. They all run
+    # in pipeline threads, so the event loop only ever awaits finished messages.
+
+    def __init__(self, cameras, infer, batch_size=8, max_wait=0.01, queue_size=2, remote=None,
+                 max_in_flight=2, job_timeout=2.0):
+        self.cameras = cameras
+        self.infer = infer
+        self.remote = remote  # InferencePool to send frames to instead of calling infer
+        self.max_in_flight = max_in_flight
+        self.job_timeout = job_timeout
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue_size = queue_size
+        self.slots = FrameSlots()
+        self.streams = {}
+        self.scheduler = None
+        self._lock = threading.Lock()
+
+    def is_running(self, camera_id):
+        return camera_id in self.streams
+
+    def start(self, camera_id, loop, track, render, crop=None):
+        with self._lock:
+            if camera_id in self.streams:
+                return
+
+            stream = CameraStream(camera_id, self.cameras[camera_id], self.slots, self.queue_size)
+            stream.start(loop, track, render, crop)
+            self.streams[camera_id] = stream
+
+            if self.scheduler is None:
+                if self.remote is not None:
+                    self.scheduler = RemoteInferenceStage(
+                        self.remote, self.slots, self.streams, self.max_in_flight, self.job_timeout
+                    )
+                else:
+                    self.scheduler = BatchInferenceStage(
+                        self.infer, self.slots, self.streams, self.batch_size, self.max_wait
+                    )
+                self.scheduler.start()
+
+    def stop(self, camera_id):
+        # Blocks until the camera's threads exit; call it off the event loop
+        with self._lock:
+            stream = self.streams.pop(camera_id, None)
+            scheduler = None
+            if not self.streams:
+                scheduler, self.scheduler = self.scheduler, None
+
+        if stream is not None:
+            stream.stop()
+        if scheduler is not None:
+            scheduler.stop()
+            scheduler.join(timeout=2)
+
+    async def get(self, camera_id, timeout=None):
+        return await asyncio.wait_for(self.streams[camera_id].output_queue.get(), timeout)
+
+    def broadcast_stats(self, camera_id):
+        return self.streams[camera_id].broadcast_stats
+
+    def stats(self):
+        scheduler = self.scheduler
+        inference = scheduler.stats.snapshot() if scheduler else {}
+        if scheduler:
+            inference['batch_size'] = scheduler.last_batch_size
+            inference['queue_depth'] = self.slots.qsize()
+            if self.remote is not None:
+                inference.update(scheduler.remote_stats())
+        return {
+            'inference': inference,
+            'cameras': {camera_id: stream.stats() for camera_id, stream in list(self.streams.items())},
+        }
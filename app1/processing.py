@@ -0,0 +1,164 @@
+import time
+from datetime import datetime
+
+import numpy as np
+import pytz
+from django.conf import settings
+
+from .events import TrackEventRecorder
+from .metrics import TRACKED_OBJECTS
+from .tracking import make_tracker
+from .zones import Zones
+
+
+# Boxes below this confidence are ignored entirely. Clients can raise their
+# own threshold from here; storage and alerts use CONFIDENCE_THRESHOLD.
+MIN_CONFIDENCE = getattr(settings, 'PPE_MIN_CONFIDENCE', 0.1)
+CONFIDENCE_THRESHOLD = getattr(settings, 'PPE_CONFIDENCE_THRESHOLD', 0.3)
+
+# Detections are stored as one event per track. Raw per-frame rows are only
+# logged for every Nth frame when this is set (0 disables them).
+RAW_DETECTION_SAMPLING = getattr(settings, 'PPE_RAW_DETECTION_SAMPLING', 0)
+
+# Timestamps are stored in the project time zone (TIME_ZONE in settings)
+local_tz = pytz.timezone(settings.TIME_ZONE)
+
+
+class CameraProcessor:
+    # Detection state shared by everyone watching one camera: tracking, track
+    # events and alert rules. Runs once per frame on the full result set in
+    # the inference thread; each client's class filter and confidence
+    # threshold are applied afterwards, when frames are rendered.
+
+    def __init__(self, camera_id, class_names, writer, alerts, frame_rate=30, zones=None, clips=None):
+        self.camera_id = camera_id
+        self.zones = zones if zones is not None else Zones()
+        self.class_names = class_names
+        self.writer = writer
+        self.alerts = alerts  # AlertEngine of this camera
+        self.clips = clips  # ClipRecorder that records the alerts, if any
+        self.tracker = make_tracker(
+            getattr(settings, 'PPE_TRACKER', 'iou'),
+            frame_rate=frame_rate,
+            iou_threshold=getattr(settings, 'PPE_TRACK_IOU_THRESHOLD', 0.3),
+            max_age=getattr(settings, 'PPE_TRACK_MAX_AGE', 1.0),
+            history=getattr(settings, 'PPE_TRACK_HISTORY', 30),
+        )
+        self.event_recorder = TrackEventRecorder(
+            writer,
+            camera_id,
+            expire_after=getattr(settings, 'PPE_TRACK_EVENT_TIMEOUT', 2.0),
+        )
+        # Boxes of the last inferred frame and per-track velocities between
+        # the last two, followed on frames the scheduler skips
+        self.last_detection = None
+        self.velocities = {}
+
+    def crops(self, frame):
+        # What inference runs on: the zone crops, or the whole frame
+        return self.zones.crops(frame)
+
+    def process(self, frame_id, frame, results, moving=True):
+        # results holds one inference result per crop, None if the frame
+        # was not inferred. moving is False when the motion gate skipped it.
+        if results is None:
+            # No inference on this frame: track the predicted boxes
+            xyxy, confidences, class_ids = self.predict_boxes(frame_id, moving)
+            return self.track_boxes(xyxy, confidences, class_ids, frame_id, frame, detected=False)
+        return self.assign_tracking_ids(results, frame_id, frame)
+
+    def assign_tracking_ids(self, results, frame_id, frame=None):
+        # Boxes outside the zones are dropped before tracking and storage
+        xyxy, confidences, class_ids = self.zones.boxes(frame, results)
+        keep = confidences > MIN_CONFIDENCE
+        return self.track_boxes(xyxy[keep], confidences[keep], class_ids[keep], frame_id, frame)
+
+    def predict_boxes(self, frame_id, moving=True):
+        # Last detected boxes moved at constant velocity to frame_id. Nothing
+        # moved on frames the motion gate skipped, so they keep the boxes.
+        if self.last_detection is None:
+            return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+
+        detected_frame, xyxy, confidences, class_ids, track_ids = self.last_detection
+        if not moving:
+            return xyxy, confidences, class_ids
+        predicted = xyxy.copy()
+        for i, track_id in enumerate(track_ids.tolist()):
+            if track_id in self.velocities:
+                predicted[i] += self.velocities[track_id] * (frame_id - detected_frame)
+        return predicted, confidences, class_ids
+
+    def remember_detection(self, frame_id, xyxy, confidences, class_ids, track_ids):
+        velocities = {}
+        if self.last_detection is not None:
+            last_frame, last_xyxy, _, _, last_track_ids = self.last_detection
+            last_boxes = dict(zip(last_track_ids.tolist(), last_xyxy))
+            for track_id, box in zip(track_ids.tolist(), xyxy):
+                if track_id >= 0 and track_id in last_boxes and frame_id > last_frame:
+                    velocities[track_id] = (box - last_boxes[track_id]) / (frame_id - last_frame)
+        self.velocities = velocities
+        self.last_detection = (frame_id, xyxy, confidences, class_ids, track_ids)
+
+    def track_boxes(self, xyxy, confidences, class_ids, frame_id, frame=None, detected=True):
+        detections = []
+        current_time = time.time()
+        # One timestamp for every detection in the frame
+        timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
+
+        track_ids = self.tracker.update(xyxy, confidences, class_ids, frame_id, current_time, frame)
+        if detected:
+            self.remember_detection(frame_id, xyxy, confidences, class_ids, track_ids)
+        TRACKED_OBJECTS.set(len(self.tracker.active_ids()), camera=self.camera_id)
+        zone_names = self.zones.zone_names((xyxy[:, :2] + xyxy[:, 2:]) / 2) if self.zones else None
+
+        for i, (bbox, confidence, class_id, track_id) in enumerate(zip(
+                xyxy.astype(int).tolist(), confidences.tolist(), class_ids.tolist(), track_ids.tolist())):
+            if track_id < 0:
+                continue  # Not confirmed by the tracker yet
+
+            detection = {
+                'bbox': tuple(bbox),
+                'confidence': confidence,
+                'class_id': class_id,
+                'class_name': self.class_names[class_id],
+                'track_id': track_id,
+            }
+            if zone_names is not None:
+                detection['zone'] = zone_names[i]
+            detections.append(detection)
+
+            if confidence <= CONFIDENCE_THRESHOLD:
+                continue  # Shown to clients that ask for it, never stored
+
+            # Sampled raw logging; track events are recorded below
+            if detected and RAW_DETECTION_SAMPLING and frame_id % RAW_DETECTION_SAMPLING == 0:
+                self.save_detection_to_db(detection, timestamp)
+
+        stored = [detection for detection in detections if detection['confidence'] > CONFIDENCE_THRESHOLD]
+        self.event_recorder.update(stored, current_time, timestamp, detected)
+        alerts = self.alerts.update(stored, current_time, timestamp)
+        if self.clips is not None:
+            self.clips.add(self.camera_id, frame, stored, current_time)
+            for alert in alerts:
+                # The clip is linked to the event of the violating track
+                event = self.event_recorder.open_events.get(alert['track_id'])
+                self.clips.trigger(self.camera_id, alert, event and event['event_key'], current_time)
+        return detections
+
+    def save_detection_to_db(self, detection, timestamp):
+        # Queued for the writer thread, which commits in batches
+        self.writer.write((
+            detection["class_id"],
+            detection["class_name"],
+            detection["confidence"],
+            detection["track_id"],
+            *detection["bbox"],
+            timestamp,
+            self.camera_id,
+        ))
+
+    def close(self):
+        self.event_recorder.close_all()
+        if self.clips is not None:
+            self.clips.close(self.camera_id)
+        TRACKED_OBJECTS.remove(camera=self.camera_id)
@@ -0,0 +1,113 @@
+from collections import namedtuple
+from statistics import median
+
+from django.conf import settings
+
+
+# How a client's frames are encoded (resolution scale, JPEG quality) and how
+# often they are sent (max_fps, 0 for every frame)
+StreamProfile = namedtuple('StreamProfile', ['scale', 'quality', 'max_fps'])
+
+# Best first; adaptation moves one step at a time along this ladder
+DEFAULT_PROFILES = {
+    'high': (1.0, 95, 0),
+    'medium': (0.75, 80, 15),
+    'low': (0.5, 65, 10),
+    'minimal': (0.35, 50, 5),
+}
+
+
+def make_profile(scale=1.0, quality=95, max_fps=0):
+    # Clamped to values the encoder and the sender accept
+    return StreamProfile(
+        min(max(float(scale), 0.1), 1.0),
+        min(max(int(quality), 10), 100),
+        max(float(max_fps), 0.0),
+    )
+
+
+class ProfileAdapter:
+    # The stream profile of one client. With adaptive on, the send latency
+    # of its frames (publish -> sent, which grows as soon as the client can
+    # not keep up) is checked every `interval` seconds: a median above
+    # slow_latency moves the client a step down the ladder, a median below
+    # fast_latency moves it back up, at most once every upgrade_after
+    # seconds so it does not flap between two steps.
+
+    def __init__(self, profiles, start=None, adaptive=True, slow_latency=0.25, fast_latency=0.08,
+                 interval=2.0, upgrade_after=10.0):
+        self.names = list(profiles)
+        self.ladder = [make_profile(*profile) for profile in profiles.values()]
+        self.level = self.names.index(start) if start in self.names else 0
+        self.custom = None  # Explicit profile set by the client, never adapted
+        self.adaptive = adaptive
+        self.slow_latency = slow_latency
+        self.fast_latency = fast_latency
+        self.interval = interval
+        self.upgrade_after = upgrade_after
+        self.latencies = []
+        self.window_started = None
+        self.changed_at = None
+
+    @property
+    def name(self):
+        return 'custom' if self.custom is not None else self.names[self.level]
+
+    @property
+    def profile(self):
+        return self.custom if self.custom is not None else self.ladder[self.level]
+
+    def select(self, name):
+        if name not in self.names:
+            return False
+        self.level = self.names.index(name)
+        self.custom = None
+        self.restart()
+        return True
+
+    def set_custom(self, profile):
+        self.custom = profile
+        self.restart()
+
+    def restart(self, now=None):
+        # Latencies measured at the previous profile say nothing about this one
+        self.latencies = []
+        self.window_started = now
+        self.changed_at = now
+
+    def observe(self, latency, now):
+        # Returns True when the profile changed
+        if not self.adaptive or self.custom is not None:
+            return False
+        if self.window_started is None:
+            self.restart(now)
+        self.latencies.append(latency)
+        if now - self.window_started < self.interval:
+            return False
+
+        typical = median(self.latencies)
+        self.latencies = []
+        self.window_started = now
+        if typical > self.slow_latency and self.level < len(self.ladder) - 1:
+            self.level += 1
+        elif (typical < self.fast_latency and self.level > 0
+              and now - self.changed_at >= self.upgrade_after):
+            self.level -= 1
+        else:
+            return False
+        self.changed_at = now
+        return True
+
+    def stats(self):
+        return {'profile': self.name, 'adaptive': self.adaptive and self.custom is None}
+
+
+def make_adapter():
+    return ProfileAdapter(
+        getattr(settings, 'PPE_STREAM_PROFILES', DEFAULT_PROFILES),
+        start=getattr(settings, 'PPE_STREAM_PROFILE', 'high'),
+        adaptive=getattr(settings, 'PPE_ADAPTIVE_STREAMING', True),
+        slow_latency=getattr(settings, 'PPE_STREAM_SLOW_LATENCY', 0.25),
+        fast_latency=getattr(settings, 'PPE_STREAM_FAST_LATENCY', 0.08),
+        upgrade_after=getattr(settings, 'PPE_STREAM_UPGRADE_AFTER', 10.0),
+    )
@@ -0,0 +1,46 @@
+import base64
+import json
+import struct
+
+
+# Frame message formats. Clients that offer the 'ppe.binary' WebSocket
+# subprotocol get binary frames, everyone else the original JSON messages.
+JSON = 'json'
+BINARY = 'binary'
+BINARY_SUBPROTOCOL = 'ppe.binary'
+
+# Binary frame layout:
+#   4 bytes   big-endian length N of the metadata
+#   N bytes   UTF-8 JSON metadata, e.g. {"detected_objects": [...]}
+#   rest      raw JPEG bytes
+HEADER = struct.Struct('>I')
+
+
+def negotiate(subprotocols):
+    # Returns the frame format and the subprotocol to accept (None for JSON)
+    if BINARY_SUBPROTOCOL in (subprotocols or []):
+        return BINARY, BINARY_SUBPROTOCOL
+    return JSON, None
+
+
+def pack_binary(jpeg, metadata):
+    header = json.dumps(metadata, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(header)) + header + jpeg
+
+
+def unpack_binary(message):
+    (length,) = HEADER.unpack_from(message)
+    start = HEADER.size
+    metadata = json.loads(message[start:start + length].decode('utf-8'))
+    return message[start + length:], metadata
+
+
+def pack_json(jpeg, metadata):
+    frame_data = base64.b64encode(jpeg).decode('utf-8')
+    return json.dumps({'frame': frame_data, **metadata})
+
+
+def encode_message(protocol, jpeg, metadata):
+    if protocol == BINARY:
+        return pack_binary(jpeg, metadata)
+    return pack_json(jpeg, metadata)
@@ -0,0 +1,121 @@
+import time
+from collections import namedtuple
+
+import cv2
+
+from .metrics import STAGE_SECONDS
+from .protocol import encode_message
+
+
+# Where boxes are drawn: on the frame by the server, or by the browser from
+# the detected_objects list on a clean frame
+SERVER_OVERLAY = 'server'
+CLIENT_OVERLAY = 'client'
+
+# What a subscriber wants to see. Frames are rendered once per distinct view
+# among the current subscribers, so N viewers with the same filter and
+# stream profile (scale, quality) cost one encode, and all client-overlay
+# viewers of a profile share one clean frame.
+View = namedtuple('View', ['protocol', 'class_ids', 'confidence_threshold', 'overlay', 'scale', 'quality'])
+
+
+def make_view(protocol, class_ids=(), confidence_threshold=0.3, overlay=SERVER_OVERLAY, scale=1.0, quality=95):
+    return View(protocol, tuple(sorted(class_ids)), confidence_threshold, overlay, scale, quality)
+
+
+def filter_detections(detections, class_ids, confidence_threshold):
+    return [
+        detection for detection in detections
+        if detection['confidence'] > confidence_threshold
+        and (not class_ids or detection['class_id'] in class_ids)
+    ]
+
+
+def draw_detections(frame, detections, scale=1.0):
+    # Draw bounding boxes on the frame, resized by scale
+    for detection in detections:
+        x1, y1, x2, y2 = (int(value * scale) for value in detection['bbox'])
+        class_name = detection['class_name']
+        confidence = detection['confidence']
+
+        # Set color based on class_id
+        if detection['class_id'] in [1, 2]:  # For class 1 and 2, use red
+            color = (0, 0, 255)  # Red
+        else:
+            color = (0, 255, 0)  # Green
+
+        # Draw rectangle on the frame (using OpenCV)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 4)
+
+        # Add label with confidence score
+        label = f"{class_name} ({confidence:.2f})"
+        cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+
+
+def render_views(frame, detections, views, zones=None, camera_id=None):
+    # Returns {view: message}. The JPEG is encoded once per distinct filter
+    # and shared between the JSON and binary messages of that filter.
+    labels = {} if camera_id is None else {'camera': camera_id}
+    views = list(views)
+    resized = {1.0: frame}
+    jpegs = {}
+    messages = {}
+    clean = {}
+    for view in views:
+        visible = filter_detections(detections, view.class_ids, view.confidence_threshold)
+        if view.scale not in resized:
+            resized[view.scale] = resize_frame(frame, view.scale)
+        if view.overlay == CLIENT_OVERLAY:
+            key = (view.scale, view.quality)
+            if key not in clean:
+                clean[key] = clean_jpeg(resized[view.scale], view.quality, labels)
+            messages[view] = encode_message(view.protocol, clean[key], overlay_metadata(frame, visible, zones))
+            continue
+
+        key = (view.class_ids, view.confidence_threshold, view.scale, view.quality)
+        if key not in jpegs:
+            started = time.perf_counter()
+            # Only copy the frame when several views use it
+            canvas = resized[view.scale] if len(views) == 1 else resized[view.scale].copy()
+            if zones:
+                zones.draw(canvas, scale=view.scale)
+            draw_detections(canvas, visible, view.scale)
+            drawn = time.perf_counter()
+            jpegs[key] = encode_jpeg(canvas, view.quality)
+            STAGE_SECONDS.observe(drawn - started, stage='draw', **labels)
+            STAGE_SECONDS.observe(time.perf_counter() - drawn, stage='jpeg', **labels)
+        messages[view] = encode_message(view.protocol, jpegs[key], {'detected_objects': visible})
+    return messages
+
+
+def resize_frame(frame, scale):
+    height, width = frame.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_jpeg(frame, quality=95):
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+def clean_jpeg(frame, quality, labels):
+    # The camera's own JPEG when it delivered one (MJPEG passthrough, full
+    # resolution only), otherwise the undrawn frame encoded once
+    jpeg = getattr(frame, 'jpeg', None)
+    if jpeg is not None:
+        return jpeg
+    started = time.perf_counter()
+    jpeg = encode_jpeg(frame, quality)
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage='jpeg', **labels)
+    return jpeg
+
+
+def overlay_metadata(frame, detections, zones):
+    # Boxes stay in capture coordinates whatever the stream profile; the
+    # frame size lets the browser scale them to the displayed image
+    height, width = frame.shape[:2]
+    metadata = {'detected_objects': detections, 'width': width, 'height': height}
+    if zones:
+        metadata['zones'] = [polygon.tolist() for polygon in zones.polygons]
+    return metadata
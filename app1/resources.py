@@ -0,0 +1,135 @@
+import atexit
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .alerts import AlertDispatcher, make_sink
+from .clips import ClipRecorder
+from .inference import make_backend
+from .storage import DetectionWriter
+
+
+logger = logging.getLogger(__name__)
+
+
+class LazyResource:
+    # Created on first get() and shared afterwards. Loading happens in the
+    # calling thread, so callers on the event loop should use an executor.
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.load_time = None  # Seconds spent in the factory
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.load_time is not None
+
+    def get(self):
+        if self.load_time is None:
+            with self._lock:
+                if self.load_time is None:
+                    started = time.perf_counter()
+                    self.value = self.factory()
+                    self.load_time = time.perf_counter() - started
+                    logger.info("Loaded %s in %.2fs", self.name, self.load_time)
+        return self.value
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'load_time_ms': round(self.load_time * 1000, 2) if self.loaded else None,
+        }
+
+
+def load_model():
+    # torch and ultralytics are only imported once a model is needed
+    return make_backend(settings)
+
+
+def load_alert_sound():
+    import pygame
+    pygame.mixer.init()
+    return pygame.mixer.Sound(getattr(settings, 'PPE_ALERT_SOUND', 'app1/alert.mp3'))
+
+
+def start_detection_writer(on_events=None):
+    writer = DetectionWriter(
+        path=getattr(settings, 'PPE_DETECTIONS_DB', 'detections.db'),
+        batch_size=getattr(settings, 'PPE_DB_BATCH_SIZE', 500),
+        flush_interval=getattr(settings, 'PPE_DB_FLUSH_INTERVAL', 0.5),
+        on_events=on_events,
+        compact_interval=getattr(settings, 'PPE_COMPACT_INTERVAL', 24 * 3600),
+    )
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
+
+
+def start_alert_dispatcher():
+    # Sinks from PPE_ALERT_SINKS; ['null'] (or no sinks) runs headless
+    names = getattr(settings, 'PPE_ALERT_SINKS', ['sound', 'websocket'])
+    sinks = [make_sink(name, settings, alert_sound) for name in names]
+    dispatcher = AlertDispatcher(sinks)
+    dispatcher.start()
+    atexit.register(dispatcher.stop)
+    return dispatcher
+
+
+def start_clip_recorder(on_saved=None):
+    recorder = ClipRecorder(
+        directory=getattr(settings, 'PPE_CLIP_DIR', 'clips'),
+        pre_seconds=getattr(settings, 'PPE_CLIP_PRE_SECONDS', 5.0),
+        post_seconds=getattr(settings, 'PPE_CLIP_POST_SECONDS', 5.0),
+        fps=getattr(settings, 'PPE_CLIP_FPS', 10),
+        quality=getattr(settings, 'PPE_CLIP_QUALITY', 80),
+        max_bytes=getattr(settings, 'PPE_CLIP_BUFFER_MB', 32) * 1024 * 1024,
+        codec=getattr(settings, 'PPE_CLIP_CODEC', 'mp4v'),
+        extension=getattr(settings, 'PPE_CLIP_EXTENSION', '.mp4'),
+        max_pending_bytes=getattr(settings, 'PPE_CLIP_PENDING_MB', 64) * 1024 * 1024,
+        on_saved=on_saved,
+    )
+    recorder.start()
+    atexit.register(recorder.stop)
+    return recorder
+
+
+model = LazyResource('model', load_model)
+alert_sound = LazyResource('alert sound', load_alert_sound)
+
+warmup_time = None  # Seconds spent in the dummy inference pass
+
+
+def warm_up():
+    # Loads the model and runs one dummy inference pass, so the first
+    # client does not pay for weight loading and backend initialization
+    global warmup_time
+    infer = model.get()
+    size = getattr(settings, 'PPE_WARMUP_SIZE', 640)
+    started = time.perf_counter()
+    infer([np.zeros((size, size, 3), dtype=np.uint8)])
+    warmup_time = time.perf_counter() - started
+    logger.info("Model warm-up took %.2fs", warmup_time)
+
+
+def warm_up_in_background():
+    # Lets the server accept connections while the model loads
+    thread = threading.Thread(target=warm_up, name='ppe-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def stats():
+    return {
+        'model': dict(
+            model.stats(),
+            backend=model.value.backend if model.loaded else None,
+            warmup_ms=round(warmup_time * 1000, 2) if warmup_time is not None else None,
+        ),
+        'alert_sound': alert_sound.stats(),
+    }
@@ -0,0 +1,261 @@
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Raw detection rows live in one table per day, detections_YYYYMMDD, so
+# expiring a day is a DROP TABLE instead of a DELETE over the whole history
+PARTITION_PATTERN = re.compile(r'^detections_(\d{8})$')
+
+DETECTION_COLUMNS = ('id', 'class_id', 'class_name', 'confidence', 'track_id',
+                     'x1', 'y1', 'x2', 'y2', 'timestamp', 'camera_id')
+ARCHIVED_EVENT_COLUMNS = ('id', 'event_key', 'camera_id', 'track_id', 'class_id', 'class_name', 'confidence',
+                          'x1', 'y1', 'x2', 'y2', 'first_seen', 'last_seen', 'frame_count', 'trajectory', 'status',
+                          'clip_path')
+
+# Raw detections counted per hour, camera and class before their partition
+# is archived
+RAW_ROLLUP_TABLE = 'detection_rollups_hour'
+
+# Partitions are read for archiving this many rows at a time
+ARCHIVE_CHUNK_SIZE = 50000
+
+
+def partition_table(timestamp):
+    # Partition of a 'YYYY-MM-DD HH:MM:SS' timestamp
+    return f"detections_{timestamp[:10].replace('-', '')}"
+
+
+def create_partition(conn, table):
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        class_id INTEGER,
+                        class_name TEXT,
+                        confidence REAL,
+                        track_id INTEGER,
+                        x1 INTEGER,
+                        y1 INTEGER,
+                        x2 INTEGER,
+                        y2 INTEGER,
+                        timestamp TIMESTAMP,
+                        camera_id TEXT
+                    )''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_track ON {table} (camera_id, track_id)')
+
+
+def raw_partitions(conn):
+    # [(day, table)] of every raw detection partition, oldest first
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'detections_%'")
+    return sorted((match.group(1), match.group(0)) for match in
+                  (PARTITION_PATTERN.match(name) for name, in tables) if match)
+
+
+def count_raw_detections(conn):
+    return sum(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for _, table in raw_partitions(conn))
+
+
+def parse_bbox(text):
+    # (x1, y1, x2, y2) of a bbox stored as str(tuple), Nones if unreadable
+    try:
+        values = [int(float(value)) for value in text.strip('()[] ').split(',')]
+    except (AttributeError, ValueError):
+        return None, None, None, None
+    return tuple(values) if len(values) == 4 else (None, None, None, None)
+
+
+def migrate_bbox_columns(conn):
+    # Databases written before the numeric columns keep bbox as text: the
+    # coordinates are parsed once into x1..y2 and the text is cleared.
+    # Returns True if track_events had to be migrated.
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(track_events)')]
+    if 'x1' in columns:
+        return False
+    for column in ('x1', 'y1', 'x2', 'y2'):
+        conn.execute(f'ALTER TABLE track_events ADD COLUMN {column} INTEGER')
+    rows = conn.execute('SELECT id, bbox FROM track_events WHERE bbox IS NOT NULL').fetchall()
+    conn.executemany('UPDATE track_events SET x1 = ?, y1 = ?, x2 = ?, y2 = ?, bbox = NULL WHERE id = ?',
+                     [(*parse_bbox(bbox), event_id) for event_id, bbox in rows])
+    return True
+
+
+def migrate_detections_table(conn):
+    # Moves the rows of the single pre-partitioning detections table into
+    # the daily partitions
+    legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'detections'").fetchone()
+    if legacy is None:
+        return 0
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(detections)')]
+    camera = 'camera_id' if 'camera_id' in columns else "'default'"
+    rows = conn.execute(f'''SELECT class_id, class_name, confidence, track_id, bbox, timestamp, {camera}
+                            FROM detections ORDER BY id''').fetchall()
+    tables = set()
+    for class_id, class_name, confidence, track_id, bbox, timestamp, camera_id in rows:
+        table = partition_table(str(timestamp))
+        if table not in tables:
+            create_partition(conn, table)
+            tables.add(table)
+        conn.execute(f'''INSERT INTO {table} (class_id, class_name, confidence, track_id, x1, y1, x2, y2,
+                                              timestamp, camera_id)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (class_id, class_name, confidence, track_id, *parse_bbox(bbox), timestamp, camera_id))
+    conn.execute('DROP TABLE detections')
+    return len(rows)
+
+
+def create_raw_rollup_table(conn):
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {RAW_ROLLUP_TABLE} (
+                        bucket TEXT,
+                        camera_id TEXT,
+                        class_id INTEGER,
+                        class_name TEXT,
+                        detection_count INTEGER,
+                        confidence_sum REAL,
+                        PRIMARY KEY (bucket, camera_id, class_id, class_name)
+                    )''')
+
+
+def save_archive(path, columns, rows):
+    write_archive(path, column_arrays(columns, rows))
+
+
+def column_arrays(columns, rows):
+    # One array per column; text columns are unicode arrays so archives load
+    # without pickle. Missing numbers are NaN, so an integer column with
+    # NULLs is stored as float.
+    arrays = {}
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows]
+        kinds = {type(value) for value in values if value is not None}
+        if kinds <= {int} and None not in values:
+            arrays[column] = np.array(values, dtype=np.int64)
+        elif kinds <= {int, float}:
+            arrays[column] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        else:
+            arrays[column] = np.array(['' if value is None else str(value) for value in values], dtype=str)
+    return arrays
+
+
+def write_archive(path, arrays):
+    # One compressed array per column, replaced atomically
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as archive:
+        np.savez_compressed(archive, **arrays)
+    os.replace(path + '.tmp', path)
+
+
+def load_archive(path):
+    # {column: array} of an archived partition
+    with np.load(path) as archive:
+        return {column: archive[column] for column in archive.files}
+
+
+def archive_raw_partition(conn, day, table, archive_dir, chunk_size=ARCHIVE_CHUNK_SIZE):
+    # Counts the partition into the hourly raw rollup, adds it to
+    # detections_YYYYMMDD.npz and drops it, all or nothing. Rows are read in
+    # chunks by id and only kept as column arrays, so a busy day is never
+    # held in memory as Python rows.
+    path = os.path.join(archive_dir, f'{table}.npz')
+    # A day archived before (a run interrupted before the DROP, or rows that
+    # arrived late) is merged; rows already in it are matched on id and time
+    chunks = [load_archive(path)] if os.path.exists(path) else []
+    known = archive_keys(chunks[0]) if chunks else []
+    count, last_id = 0, 0
+    while True:
+        rows = conn.execute(f'SELECT {", ".join(DETECTION_COLUMNS)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                            (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        count += len(rows)
+        last_id = rows[-1][0]
+        arrays = column_arrays(DETECTION_COLUMNS, rows)
+        keep = ~np.isin(archive_keys(arrays), known)
+        chunks.append({column: values[keep] for column, values in arrays.items()})
+    if count:
+        write_archive(path, {column: np.concatenate([chunk[column] for chunk in chunks])
+                             for column in DETECTION_COLUMNS})
+    with conn:
+        conn.execute(f'''INSERT INTO {RAW_ROLLUP_TABLE}
+                             (bucket, camera_id, class_id, class_name, detection_count, confidence_sum)
+                         SELECT substr(timestamp, 1, 13), camera_id, class_id, class_name, COUNT(*), SUM(confidence)
+                         FROM {table} GROUP BY 1, 2, 3, 4
+                         ON CONFLICT (bucket, camera_id, class_id, class_name) DO UPDATE SET
+                             detection_count = detection_count + excluded.detection_count,
+                             confidence_sum = confidence_sum + excluded.confidence_sum''')
+        conn.execute(f'DROP TABLE {table}')
+    return count
+
+
+def archive_keys(arrays):
+    # Ids restart in a partition that is created again, so rows of a day are
+    # told apart by id and timestamp
+    return np.char.add(arrays['id'].astype(str), arrays['timestamp'].astype(str))
+
+
+def archive_events(conn, cutoff, archive_dir):
+    # Track events that ended before the cutoff day, archived per day of
+    # first_seen to track_events_YYYYMMDD.npz. Their counts are already in
+    # the rollups, which are kept.
+    days = [day for day, in conn.execute(
+        '''SELECT DISTINCT substr(first_seen, 1, 10) FROM track_events
+           WHERE first_seen < ? AND last_seen < ? ORDER BY 1''', (cutoff, cutoff))]
+    archived = 0
+    for day in days:
+        rows = conn.execute(
+            f'''SELECT {", ".join(ARCHIVED_EVENT_COLUMNS)} FROM track_events
+                WHERE first_seen >= ? AND first_seen < ? AND last_seen < ? ORDER BY id''',
+            (day, day + '~', cutoff)).fetchall()
+        path = os.path.join(archive_dir, f"track_events_{day.replace('-', '')}.npz")
+        if os.path.exists(path):
+            # A day can be archived in several runs when events end late.
+            # Archives written before clip_path existed get none.
+            previous = load_archive(path)
+            known = set(previous['id'].tolist())
+            rows = [tuple(previous[column][i].item() if column in previous else None
+                          for column in ARCHIVED_EVENT_COLUMNS)
+                    for i in range(len(previous['id']))] + [row for row in rows if row[0] not in known]
+        save_archive(path, ARCHIVED_EVENT_COLUMNS, rows)
+        with conn:
+            archived += conn.execute(
+                'DELETE FROM track_events WHERE first_seen >= ? AND first_seen < ? AND last_seen < ?',
+                (day, day + '~', cutoff)).rowcount
+    return archived
+
+
+def compact(conn, archive_dir=None, raw_days=None, event_days=None, vacuum=True, today=None):
+    # The retention job: archives raw partitions older than raw_days and
+    # track events older than event_days (the hourly rollups are kept for
+    # good), then VACUUMs so the file shrinks back. Returns what it did.
+    archive_dir = archive_dir or getattr(settings, 'PPE_ARCHIVE_DIR', 'archive')
+    raw_days = getattr(settings, 'PPE_RAW_RETENTION_DAYS', 7) if raw_days is None else raw_days
+    event_days = getattr(settings, 'PPE_EVENT_RETENTION_DAYS', 90) if event_days is None else event_days
+    today = today or datetime.now(pytz.timezone(settings.TIME_ZONE)).date()
+
+    def cutoff(days):
+        return (today - timedelta(days=days)).strftime('%Y-%m-%d')
+
+    started = time.perf_counter()
+    create_raw_rollup_table(conn)
+    summary = {'raw_partitions': 0, 'raw_rows': 0, 'events': 0}
+
+    raw_cutoff = cutoff(raw_days).replace('-', '')
+    for day, table in raw_partitions(conn):
+        if day < raw_cutoff:
+            summary['raw_rows'] += archive_raw_partition(conn, day, table, archive_dir)
+            summary['raw_partitions'] += 1
+
+    summary['events'] = archive_events(conn, cutoff(event_days), archive_dir)
+
+    if vacuum:
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+    logger.info("Compacted detections store: %s", summary)
+    return summary
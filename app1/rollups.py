@@ -0,0 +1,55 @@
+# Track events pre-aggregated per time bucket, camera and class. The writer
+# adds the events created by each flush in the same transaction, so the
+# statistics read a few rows per hour however large track_events grows.
+# An event's class and first_seen never change, so counts are only added.
+
+ROLLUPS = {
+    'hour': ('event_rollups_hour', 13),  # bucket is 'YYYY-MM-DD HH'
+}
+
+# Per-minute counts nothing read, dropped from existing databases
+DROPPED_ROLLUPS = ('event_rollups_minute',)
+
+
+def create_rollup_tables(cursor):
+    # Returns True if a table had to be created, i.e. it needs a backfill
+    for table in DROPPED_ROLLUPS:
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    created = False
+    for table, _ in ROLLUPS.values():
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        cursor.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                            bucket TEXT,
+                            camera_id TEXT,
+                            class_id INTEGER,
+                            class_name TEXT,
+                            event_count INTEGER,
+                            PRIMARY KEY (bucket, camera_id, class_id, class_name)
+                        )''')
+        created = created or exists is None
+    return created
+
+
+def add_to_rollups(conn, after_id):
+    # Counts the events with id > after_id; returns the highest id counted
+    for table, width in ROLLUPS.values():
+        conn.execute(f'''INSERT INTO {table} (bucket, camera_id, class_id, class_name, event_count)
+                         SELECT substr(first_seen, 1, {width}), camera_id, class_id, class_name, COUNT(*)
+                         FROM track_events WHERE id > ?
+                         GROUP BY 1, 2, 3, 4
+                         ON CONFLICT (bucket, camera_id, class_id, class_name)
+                         DO UPDATE SET event_count = event_count + excluded.event_count''', (after_id,))
+    return conn.execute('SELECT COALESCE(MAX(id), ?) FROM track_events', (after_id,)).fetchone()[0]
+
+
+def rebuild_rollups(conn):
+    # Regenerates the rollups from track_events in one transaction. Buckets
+    # older than the oldest event are kept: their events have been archived
+    # (see retention.py) and the rollups are all that is left of them.
+    with conn:
+        oldest = conn.execute('SELECT MIN(first_seen) FROM track_events').fetchone()[0]
+        if oldest is None:
+            return 0
+        for table, width in ROLLUPS.values():
+            conn.execute(f'DELETE FROM {table} WHERE bucket >= ?', (oldest[:width],))
+        return add_to_rollups(conn, 0)
@@ -1,7 +1,9 @@
 from django.urls import path
-from .consumers import VideoStreamConsumer
+from .consumers import DetectionEventsConsumer, VideoStreamConsumer
 
 websocket_urlpatterns = [
    
     path('ws/video_stream/',VideoStreamConsumer.as_asgi()),
+    path('ws/video_stream/<str:camera_id>/', VideoStreamConsumer.as_asgi()),
+    path('ws/detections/', DetectionEventsConsumer.as_asgi()),
 ]
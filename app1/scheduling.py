@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+from django.conf import settings
+
+
+class MotionGate:
+    # Frame differencing on a small grayscale thumbnail. Frames are compared
+    # with the last frame that went through inference, so slow changes add
+    # up until they trigger a detection.
+
+    def __init__(self, threshold=4.0, size=(64, 48)):
+        self.threshold = threshold  # Mean absolute difference, 0-255
+        self.size = size
+        self.reference = None
+
+    def thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def changed(self, frame):
+        if self.threshold <= 0 or self.reference is None:
+            return True
+        return np.abs(self.thumbnail(frame) - self.reference).mean() > self.threshold
+
+    def reset(self, frame):
+        if self.threshold > 0:
+            self.reference = self.thumbnail(frame)
+
+
+class FrameScheduler:
+    # Decides for every captured frame whether it goes through inference or
+    # is tracked from the last detections, and how fast the camera is read.
+    #
+    # Moving scenes are read at target_fps and detected on every
+    # detect_every-th frame. Scenes without motion for idle_after seconds
+    # drop to idle_fps and skip inference, but a detection still runs every
+    # max_interval seconds, which bounds how late a change can be noticed.
+
+    def __init__(self, target_fps=30, idle_fps=2, detect_every=1, max_interval=1.0,
+                 motion_threshold=4.0, idle_after=2.0):
+        self.target_fps = target_fps
+        self.idle_fps = idle_fps
+        self.detect_every = max(1, detect_every)
+        self.max_interval = max_interval
+        self.idle_after = idle_after
+        self.gate = MotionGate(motion_threshold)
+        self.last_detect = float('-inf')
+        self.last_motion = float('-inf')
+        self.moving = True  # Whether the last frame passed the motion gate
+        self.since_detect = 0
+        self.detected = 0
+        self.skipped = 0
+
+    def should_detect(self, frame, now):
+        moving = self.moving = self.gate.changed(frame)
+        if moving:
+            self.last_motion = now
+
+        self.since_detect += 1
+        due = now - self.last_detect >= self.max_interval
+        if due or (moving and self.since_detect >= self.detect_every):
+            self.gate.reset(frame)
+            self.last_detect = now
+            self.since_detect = 0
+            self.detected += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def idle(self, now):
+        return now - self.last_motion >= self.idle_after
+
+    def interval(self, now):
+        # Seconds until the next frame should be read
+        fps = self.idle_fps if self.idle(now) else self.target_fps
+        return 1.0 / fps if fps else 0.0
+
+    def stats(self, now):
+        return {
+            'detected': self.detected,
+            'skipped': self.skipped,
+            'idle': self.idle(now),
+        }
+
+
+def make_scheduler(config):
+    # Camera config keys override the PPE_* defaults
+    def option(key, setting, default):
+        return config.get(key, getattr(settings, setting, default))
+
+    target_fps = option('target_fps', 'PPE_TARGET_FPS', None)
+    return FrameScheduler(
+        target_fps=config.get('fps', 30) if target_fps is None else target_fps,
+        idle_fps=option('idle_fps', 'PPE_IDLE_FPS', 2),
+        detect_every=option('detect_every', 'PPE_DETECT_EVERY', 1),
+        max_interval=option('max_detect_interval', 'PPE_MAX_DETECT_INTERVAL', 1.0),
+        motion_threshold=option('motion_threshold', 'PPE_MOTION_THRESHOLD', 4.0),
+        idle_after=option('idle_after', 'PPE_IDLE_AFTER', 2.0),
+    )
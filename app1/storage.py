@@ -0,0 +1,299 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+from urllib.parse import quote
+
+from django.conf import settings
+
+from .analytics import EVENT_SELECT, event_to_dict
+from .pipeline import StageStats
+from .retention import (compact, create_partition, create_raw_rollup_table, migrate_bbox_columns,
+                        migrate_detections_table, partition_table)
+from .rollups import add_to_rollups, create_rollup_tables, rebuild_rollups
+
+
+logger = logging.getLogger(__name__)
+
+DETECTIONS_DB = getattr(settings, 'PPE_DETECTIONS_DB', 'detections.db')
+
+
+def connect(path=DETECTIONS_DB):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # WAL lets the log views read while the writer thread commits, and with
+    # WAL a NORMAL sync level is still safe against corruption
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+_set_up = set()  # Databases setup_database already ran on in this process
+_setup_lock = threading.Lock()
+
+
+def connect_readonly(path=DETECTIONS_DB):
+    # Connection for the HTTP views. The schema is created and migrated once
+    # per process; after that requests only read, so they never compete with
+    # the writer thread for the write lock.
+    with _setup_lock:
+        if path not in _set_up:
+            setup_database(path).close()
+            _set_up.add(path)
+    return sqlite3.connect(f'file:{quote(os.path.abspath(path))}?mode=ro', uri=True, check_same_thread=False)
+
+
+# Database setup
+def setup_database(path=DETECTIONS_DB):
+    conn = connect(path)
+    cursor = conn.cursor()
+
+    # Raw detection rows go to daily partitions (see retention.py); databases
+    # from before that have their single detections table split up once
+    migrated = migrate_detections_table(cursor)
+    if migrated:
+        logger.info("Moved %d raw detections into daily partitions", migrated)
+    create_raw_rollup_table(cursor)
+
+    # One row per track: opened when the track appears, updated while it is
+    # in view and closed when it expires
+    cursor.execute('''CREATE TABLE IF NOT EXISTS track_events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        event_key TEXT UNIQUE,
+                        camera_id TEXT,
+                        track_id INTEGER,
+                        class_id INTEGER,
+                        class_name TEXT,
+                        confidence REAL,
+                        x1 INTEGER,
+                        y1 INTEGER,
+                        x2 INTEGER,
+                        y2 INTEGER,
+                        first_seen TIMESTAMP,
+                        last_seen TIMESTAMP,
+                        frame_count INTEGER,
+                        trajectory TEXT,
+                        status TEXT,
+                        clip_path TEXT
+                    )''')
+    # Boxes used to be stored as str(tuple) in a bbox column
+    if migrate_bbox_columns(cursor):
+        logger.info("Converted track event boxes to numeric columns")
+    # Path of the violation clip of the event (clips.py)
+    if 'clip_path' not in [row[1] for row in cursor.execute('PRAGMA table_info(track_events)')]:
+        cursor.execute('ALTER TABLE track_events ADD COLUMN clip_path TEXT')
+
+    # Indexes for the log views and filtered queries
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_track_events_first_seen ON track_events (first_seen)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_track_events_class ON track_events (class_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_track_events_track ON track_events (camera_id, track_id)')
+
+    # Hourly counts for the statistics; databases that predate them are
+    # backfilled once
+    backfill = create_rollup_tables(cursor)
+
+    conn.commit()
+    if backfill:
+        rebuild_rollups(conn)
+    return conn
+
+
+class DetectionWriter(threading.Thread):
+    # Background writer for track events and raw detection rows. Rows are
+    # queued from the inference thread and written with executemany in one
+    # transaction per batch_size rows or per flush_interval seconds,
+    # whichever comes first. Every compact_interval seconds it also starts the
+    # retention job (retention.compact) in a thread with its own connection,
+    # so rows keep being written while old ones are archived.
+
+    INSERT_DETECTION = '''INSERT INTO {table} (class_id, class_name, confidence, track_id, x1, y1, x2, y2,
+                                               timestamp, camera_id)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+    UPSERT_EVENT = '''INSERT INTO track_events (event_key, camera_id, track_id, class_id, class_name, confidence,
+                                                x1, y1, x2, y2, first_seen, last_seen, frame_count, trajectory,
+                                                status)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT(event_key) DO UPDATE SET
+                          confidence = excluded.confidence,
+                          x1 = excluded.x1,
+                          y1 = excluded.y1,
+                          x2 = excluded.x2,
+                          y2 = excluded.y2,
+                          last_seen = excluded.last_seen,
+                          frame_count = excluded.frame_count,
+                          trajectory = excluded.trajectory,
+                          status = excluded.status'''
+
+    LINK_CLIP = 'UPDATE track_events SET clip_path = ? WHERE event_key = ?'
+
+    def __init__(self, path=DETECTIONS_DB, batch_size=500, flush_interval=0.5, max_queue=100000, on_events=None,
+                 compact_interval=0):
+        super().__init__(name='ppe-db-writer', daemon=True)
+        self.path = path
+        self.compact_interval = compact_interval  # 0 leaves retention to the compact_detections command
+        self.last_compaction = None
+        self._compaction = None  # Thread of the running retention job
+        self.partitions = {}  # Insert statement -> daily partition it writes to
+        # Called from this thread with the rows of every event written in a
+        # flush, each flagged 'new' if the flush created it
+        self.on_events = on_events
+        self.last_event_id = 0
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.lag = 0.0  # Age of the oldest row in the last flush, in seconds
+        self.flush_stats = StageStats('db_write')
+        self._queue = queue.Queue(max_queue)
+        self._stop_event = threading.Event()
+
+    def write(self, row):
+        # Raw rows go to the partition of their timestamp (row[8])
+        table = partition_table(row[8])
+        statement = self.INSERT_DETECTION.format(table=table)
+        self.partitions[statement] = table
+        self._enqueue(statement, row)
+
+    def write_event(self, row):
+        self._enqueue(self.UPSERT_EVENT, row)
+
+    def link_clip(self, event_keys, path):
+        # Called by the clip recorder once the clip of these events is saved
+        for event_key in event_keys:
+            self._enqueue(self.LINK_CLIP, (path, event_key))
+
+    def _enqueue(self, statement, row):
+        # Never blocks the caller; rows are dropped if the disk cannot keep up
+        try:
+            self._queue.put_nowait((time.monotonic(), statement, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        conn = setup_database(self.path)
+        self.last_event_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM track_events').fetchone()[0]
+        # The first compaction waits an interval too, not to slow down startup
+        next_compaction = time.monotonic() + self.compact_interval
+        try:
+            while not self._stop_event.is_set():
+                batch = self._collect()
+                if batch:
+                    self._flush(conn, batch)
+                if self.compact_interval and time.monotonic() >= next_compaction:
+                    next_compaction = time.monotonic() + self.compact_interval
+                    self._start_compaction()
+
+            # Shutdown: write whatever is still queued
+            batch = self._drain()
+            if batch:
+                self._flush(conn, batch)
+        finally:
+            conn.close()
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = batch[0][0] + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _flush(self, conn, batch):
+        started = time.perf_counter()
+        try:
+            with conn:
+                for statement in {statement for _, statement, _ in batch if statement in self.partitions}:
+                    create_partition(conn, self.partitions[statement])
+                # Consecutive rows of the same kind go in one executemany;
+                # order is kept so an event is opened before it is updated
+                for statement, items in groupby(batch, key=itemgetter(1)):
+                    conn.executemany(statement, [row for _, _, row in items])
+                # Events created by this flush are the ones above last_event_id
+                last_event_id = add_to_rollups(conn, self.last_event_id)
+        except sqlite3.Error:
+            logger.exception("Error writing %d detections", len(batch))
+            return
+        previous_event_id, self.last_event_id = self.last_event_id, last_event_id
+        self.flush_stats.record(time.perf_counter() - started)
+        self.rows_written += len(batch)
+        self.flushes += 1
+        self.lag = time.monotonic() - batch[0][0]
+
+        if self.on_events is not None:
+            event_keys = [row[0] for _, statement, row in batch if statement == self.UPSERT_EVENT]
+            if event_keys:
+                self._notify(conn, list(dict.fromkeys(event_keys)), previous_event_id)
+
+    def _start_compaction(self):
+        # A job that is still running is not started twice
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(target=self._compact, name='ppe-db-compact', daemon=True)
+        self._compaction.start()
+
+    def _compact(self):
+        # No VACUUM: it needs the database to itself and would hold up the
+        # writer. Pages of dropped partitions are reused by new ones; the
+        # compact_detections command can VACUUM while the server is stopped.
+        conn = connect(self.path)
+        try:
+            self.last_compaction = compact(conn, vacuum=False)
+        except (sqlite3.Error, OSError):
+            logger.exception("Error compacting the detections store")
+        finally:
+            conn.close()
+
+    def _notify(self, conn, event_keys, previous_event_id):
+        rows = []
+        for start in range(0, len(event_keys), 500):
+            chunk = event_keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows += conn.execute(f'{EVENT_SELECT} WHERE event_key IN ({placeholders})', chunk).fetchall()
+
+        events = [event_to_dict(row) for row in rows]
+        for event in events:
+            event['new'] = event['id'] > previous_event_id
+
+        try:
+            self.on_events(events)
+        except Exception:
+            logger.exception("Error publishing detection events")
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self.join(timeout)
+        if self._compaction is not None:
+            self._compaction.join(timeout)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'lag_ms': round(self.lag * 1000, 2),
+            'rows_written': self.rows_written,
+            'flushes': self.flushes,
+            'dropped': self.dropped,
+            'flush': self.flush_stats.snapshot(),
+            'last_compaction': self.last_compaction,
+        }
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from ..alerts import AlertEngine, AlertRule, WebSocketSink, make_sink
+
+
+def detection(track_id=1, class_id=2, zone=None):
+    return {'track_id': track_id, 'class_id': class_id, 'class_name': 'No Helmet', 'confidence': 0.9, 'zone': zone}
+
+
+class AlertEngineTests(SimpleTestCase):
+
+    def setUp(self):
+        self.alerts = []
+        self.engine = AlertEngine('test', [AlertRule('missing-ppe', class_ids=[2], dwell=3.0, cooldown=10.0)],
+                                  self.alerts.append, forget_after=1.0)
+
+    def run_frames(self, times, detections=None):
+        return [self.engine.update(detections or [detection()], now, 'ts') for now in times]
+
+    def test_alert_fires_after_the_dwell_time(self):
+        fired = self.run_frames([0.0, 1.0, 2.0, 3.0])
+        self.assertEqual([len(alerts) for alerts in fired], [0, 0, 0, 1])
+        self.assertEqual(self.alerts[0]['duration'], 3.0)
+        self.assertEqual((self.alerts[0]['rule'], self.alerts[0]['track_id']), ('missing-ppe', 1))
+
+    def test_cooldown_limits_repeated_alerts(self):
+        fired = self.run_frames([0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 6.0, 6.5, 13.0])
+        self.assertEqual([len(alerts) for alerts in fired], [0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1])
+
+    def test_gap_longer_than_forget_after_restarts_the_dwell(self):
+        self.run_frames([0.0, 2.0])
+        self.engine.update([], 3.5, 'ts')
+        fired = self.run_frames([4.0, 5.0, 7.0])
+        self.assertEqual([len(alerts) for alerts in fired], [0, 0, 1])
+
+    def test_other_classes_and_zones_do_not_match(self):
+        rule = AlertRule('gate', class_ids=[2], zones=['gate'])
+        self.assertTrue(rule.matches(detection(zone='gate')))
+        self.assertFalse(rule.matches(detection(zone='dock')))
+        self.assertFalse(rule.matches(detection(class_id=0, zone='gate')))
+
+
+class SinkTests(SimpleTestCase):
+
+    def test_webhook_sink_needs_a_url(self):
+        with self.assertRaises(ImproperlyConfigured):
+            make_sink('webhook', SimpleNamespace())
+        self.assertEqual(make_sink('webhook', SimpleNamespace(PPE_ALERT_WEBHOOK_URL='http://example.com/')).url,
+                         'http://example.com/')
+
+    async def test_failed_websocket_send_is_logged(self):
+        layer = mock.Mock()
+        layer.group_send = mock.AsyncMock(side_effect=RuntimeError('layer down'))
+        sink = WebSocketSink()
+        sink.bind(asyncio.get_running_loop())
+        with mock.patch('app1.alerts.get_channel_layer', return_value=layer), \
+                self.assertLogs('app1.alerts', 'ERROR') as logs:
+            await asyncio.get_running_loop().run_in_executor(None, sink, {'rule': 'missing-ppe'})
+            for _ in range(5):
+                await asyncio.sleep(0)
+        self.assertIn('layer down', logs.output[0])
@@ -0,0 +1,145 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..analytics import event_to_dict, fetch_events, iter_chunks, iter_detections, iter_events
+from ..retention import create_partition
+from ..storage import DetectionWriter, connect
+from .utils import add_event, temp_database
+
+
+class FetchEventsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.conn, self.path = temp_database(self)
+        for i in range(1, 6):
+            add_event(self.conn, f'event-{i}', f'2026-10-18 10:00:0{i}')
+
+    def ids(self, **options):
+        return [row[0] for row in fetch_events(self.conn, **options)]
+
+    def test_newest_first(self):
+        self.assertEqual(self.ids(), [5, 4, 3, 2, 1])
+        self.assertEqual(self.ids(limit=2), [5, 4])
+
+    def test_since_id_catches_up_from_the_oldest_new_event(self):
+        self.assertEqual(self.ids(since_id=1, limit=2), [3, 2])
+        self.assertEqual(self.ids(since_id=3, limit=2), [5, 4])
+        self.assertEqual(self.ids(since_id=5), [])
+
+    def test_before_id_pages_back(self):
+        self.assertEqual(self.ids(before_id=4, limit=2), [3, 2])
+        self.assertEqual(self.ids(before_id=2), [1])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(self.ids(limit=0), [5])
+
+    def test_bbox_is_formatted_from_the_columns(self):
+        event = event_to_dict(fetch_events(self.conn, limit=1)[0])
+        self.assertEqual(event['bbox'], '(1, 2, 3, 4)')
+        self.assertEqual((event['timestamp'], event['camera_id']), ('2026-10-18 10:00:05', 'default'))
+
+
+class FetchDetectionsViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.conn, self.path = temp_database(self)
+        for i in range(1, 4):
+            add_event(self.conn, f'event-{i}', f'2026-10-18 10:00:0{i}')
+        patcher = mock.patch('app1.views.connect_readonly', lambda: connect(self.path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_incremental_poll(self):
+        data = json.loads(self.client.get('/fetch-detections/', {'since_id': 1}).content)
+        self.assertEqual([event['id'] for event in data['detections']], [3, 2])
+        self.assertEqual((data['last_id'], data['next_before_id']), (3, 2))
+
+    def test_nothing_new_keeps_the_cursor(self):
+        data = json.loads(self.client.get('/fetch-detections/', {'since_id': 3}).content)
+        self.assertEqual((data['detections'], data['last_id']), ([], 3))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/fetch-detections/', {'since_id': 'x'}).status_code, 400)
+
+
+def add_detection(conn, timestamp, class_id=2, camera_id='default'):
+    table = 'detections_' + timestamp[:10].replace('-', '')
+    create_partition(conn, table)
+    with conn:
+        conn.execute(DetectionWriter.INSERT_DETECTION.format(table=table),
+                     (class_id, 'No Helmet', 0.8, 1, 1, 2, 3, 4, timestamp, camera_id))
+
+
+class ExportQueryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.conn, self.path = temp_database(self)
+        for i, day in enumerate(['2026-10-16', '2026-10-17', '2026-10-17', '2026-10-18', '2026-10-18']):
+            add_event(self.conn, f'event-{i}', f'{day} 10:00:00', class_id=i % 2,
+                      camera_id='gate' if i == 2 else 'default')
+
+    def ids(self, chunks):
+        return [[row[0] for row in rows] for rows in chunks]
+
+    def test_iter_chunks_pages_by_id(self):
+        chunks = iter_chunks(self.conn, 'track_events', ('id',), [], [], 2)
+        self.assertEqual(self.ids(chunks), [[1, 2], [3, 4], [5]])
+        chunks = iter_chunks(self.conn, 'track_events', ('id',), ['class_id = ?'], [1], 1)
+        self.assertEqual(self.ids(chunks), [[2], [4]])
+
+    def test_iter_events_filters(self):
+        self.assertEqual(self.ids(iter_events(self.conn, 2, start='2026-10-17 00:00:00')), [[2, 3], [4, 5]])
+        self.assertEqual(self.ids(iter_events(self.conn, 10, end='2026-10-17 23:59:59', class_ids=[0])), [[1, 3]])
+        self.assertEqual(self.ids(iter_events(self.conn, 10, camera_id='gate', track_id=1)), [[3]])
+        self.assertEqual(list(iter_events(self.conn, 10, start='2026-10-19 00:00:00')), [])
+
+    def test_iter_detections_reads_only_the_partitions_in_range(self):
+        for day in ('2026-10-16', '2026-10-17', '2026-10-18'):
+            add_detection(self.conn, f'{day} 10:00:00')
+            add_detection(self.conn, f'{day} 12:00:00', class_id=0)
+        rows = [row for rows in iter_detections(self.conn, 10, start='2026-10-17 00:00:00',
+                                                end='2026-10-18 11:00:00', class_ids=[2])
+                for row in rows]
+        self.assertEqual([row[9] for row in rows], ['2026-10-17 10:00:00', '2026-10-18 10:00:00'])
+
+
+class ExportViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.conn, self.path = temp_database(self)
+        for i in range(3):
+            add_event(self.conn, f'event-{i}', f'2026-10-1{6 + i} 10:00:00', class_id=i)
+        add_detection(self.conn, '2026-10-17 10:00:00')
+        patcher = mock.patch('app1.views.connect_readonly', lambda: connect(self.path))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def export(self, **params):
+        response = await self.async_client.get('/detections/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_ndjson_events(self):
+        response, content = await self.export(start='2026-10-17', class_id='1,2')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['id'], row['class_id']) for row in rows], [(2, 1), (3, 2)])
+        self.assertEqual(rows[0]['x2'], 3)
+
+    async def test_csv_end_date_includes_the_whole_day(self):
+        response, content = await self.export(format='csv', end='2026-10-17')
+        self.assertIn('attachment; filename="events.csv"', response['Content-Disposition'])
+        lines = content.splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'camera_id', 'track_id'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['1', '2'])
+
+    async def test_raw_detections(self):
+        _, content = await self.export(source='raw')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['timestamp'], row['class_id']) for row in rows], [('2026-10-17 10:00:00', 2)])
+
+    def test_invalid_parameters(self):
+        for params in ({'format': 'xml'}, {'source': 'all'}, {'start': 'yesterday'}, {'track_id': 'x'}):
+            self.assertEqual(self.client.get('/detections/export/', params).status_code, 400)
@@ -0,0 +1,112 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from ..broadcast import Broadcaster
+
+
+class FakeConnection:
+
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.closed = False
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send(self, text_data=None, bytes_data=None):
+        await self.unblocked.wait()
+        self.sent.append(text_data if bytes_data is None else bytes_data)
+
+    async def close(self):
+        self.closed = True
+
+
+async def settle():
+    # Lets the subscriber tasks run
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class BroadcasterTests(SimpleTestCase):
+
+    async def test_each_subscriber_gets_its_render_key(self):
+        broadcaster = Broadcaster()
+        json_client, binary_client = FakeConnection(), FakeConnection()
+        broadcaster.subscribe(json_client, 'json')
+        broadcaster.subscribe(binary_client, 'binary')
+        self.assertEqual(broadcaster.render_keys(), {'json', 'binary'})
+
+        broadcaster.publish({'json': 'frame', 'binary': b'frame'})
+        await settle()
+        self.assertEqual(json_client.sent, ['frame'])
+        self.assertEqual(binary_client.sent, [b'frame'])
+        for connection in (json_client, binary_client):
+            broadcaster.unsubscribe(connection)
+
+    async def test_slow_client_gets_the_latest_frame(self):
+        broadcaster = Broadcaster()
+        slow, fast = FakeConnection(blocked=True), FakeConnection()
+        broadcaster.subscribe(slow, 'json')
+        broadcaster.subscribe(fast, 'json')
+        for frame in ('1', '2', '3'):
+            broadcaster.publish({'json': frame})
+            await settle()
+        self.assertEqual(fast.sent, ['1', '2', '3'])
+
+        slow.unblocked.set()
+        await settle()
+        self.assertEqual(slow.sent, ['1', '3'])
+        self.assertEqual(broadcaster.subscribers[slow].dropped, 1)
+        for connection in (slow, fast):
+            broadcaster.unsubscribe(connection)
+
+    async def test_acking_client_gets_at_most_max_in_flight_frames(self):
+        broadcaster = Broadcaster(max_in_flight=2)
+        client = FakeConnection()
+        broadcaster.subscribe(client, 'json')
+        broadcaster.ack(client, 0)  # The client acks frames
+        for frame in ('1', '2', '3', '4'):
+            broadcaster.publish({'json': frame})
+            await settle()
+        self.assertEqual(client.sent, ['1', '2'])
+        self.assertEqual(broadcaster.subscribers[client].stats()['in_flight'], 2)
+
+        # The ack releases the newest frame, the ones in between were dropped
+        broadcaster.ack(client, 2)
+        await settle()
+        self.assertEqual(client.sent, ['1', '2', '4'])
+        self.assertEqual(broadcaster.subscribers[client].dropped, 1)
+        broadcaster.unsubscribe(client)
+
+    async def test_client_without_acks_is_not_gated(self):
+        broadcaster = Broadcaster(max_in_flight=1)
+        client = FakeConnection()
+        broadcaster.subscribe(client, 'json')
+        for frame in ('1', '2', '3'):
+            broadcaster.publish({'json': frame})
+            await settle()
+        self.assertEqual(client.sent, ['1', '2', '3'])
+        broadcaster.unsubscribe(client)
+
+    async def test_stalled_client_is_disconnected(self):
+        broadcaster = Broadcaster(stall_timeout=0.05)
+        stalled, acking = FakeConnection(), FakeConnection()
+        broadcaster.subscribe(stalled, 'json')
+        broadcaster.subscribe(acking, 'json')
+        broadcaster.ack(stalled, 0)
+        broadcaster.ack(acking, 0)
+        broadcaster.publish({'json': '1'})
+        await settle()
+        broadcaster.ack(acking, 1)
+
+        await asyncio.sleep(0.1)
+        broadcaster.ack(acking, 1)
+        with self.assertLogs('app1.broadcast', 'WARNING'):
+            broadcaster.publish({'json': '2'})
+        await settle()
+        self.assertTrue(stalled.closed)
+        self.assertNotIn(stalled, broadcaster.subscribers)
+        self.assertEqual(broadcaster.disconnected, 1)
+        self.assertEqual(acking.sent, ['1', '2'])
+        broadcaster.unsubscribe(acking)
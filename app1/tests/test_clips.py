@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..clips import ClipRecorder, FrameBuffer, Recording
+
+
+class FrameBufferTests(SimpleTestCase):
+
+    def test_keeps_the_last_seconds(self):
+        buffer = FrameBuffer(seconds=2, max_bytes=1000)
+        for timestamp in range(6):
+            buffer.append(float(timestamp), b'x')
+        self.assertEqual([timestamp for timestamp, _ in buffer.frames], [3.0, 4.0, 5.0])
+        self.assertEqual(buffer.size, 3)
+
+    def test_keeps_at_most_max_bytes(self):
+        buffer = FrameBuffer(seconds=60, max_bytes=10)
+        for timestamp in range(4):
+            buffer.append(float(timestamp), b'x' * 4)
+        self.assertEqual([timestamp for timestamp, _ in buffer.frames], [2.0, 3.0])
+        self.assertEqual(buffer.size, 8)
+
+    def test_since(self):
+        buffer = FrameBuffer(seconds=60, max_bytes=1000)
+        for timestamp in range(4):
+            buffer.append(float(timestamp), bytes([timestamp]))
+        self.assertEqual(buffer.since(2.0), [(2.0, b'\x02'), (3.0, b'\x03')])
+
+
+class ClipRecorderTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def finish(self, recorder, camera_id, size):
+        recorder.recordings[camera_id] = Recording(f'{camera_id}.mp4', 0.0, [(0.0, b'x' * size)], [])
+        recorder.finish(camera_id)
+
+    def test_finished_clips_wait_up_to_max_pending_bytes(self):
+        # The writer thread is not started, so every queued clip stays pending
+        recorder = ClipRecorder(self.directory, max_pending_bytes=10)
+        self.finish(recorder, 'a', 6)
+        with self.assertLogs('app1.clips', 'WARNING'):
+            self.finish(recorder, 'b', 6)
+        self.finish(recorder, 'c', 4)
+        self.assertEqual((recorder.pending, recorder.pending_bytes, recorder.skipped), (2, 10, 1))
+
+    def test_one_clip_is_always_taken(self):
+        recorder = ClipRecorder(self.directory, max_pending_bytes=10)
+        self.finish(recorder, 'a', 100)
+        self.assertEqual((recorder.pending, recorder.skipped), (1, 0))
+
+    def test_clip_of_an_alert_is_written_and_linked(self):
+        saved = []
+        recorder = ClipRecorder(self.directory, pre_seconds=0.5, post_seconds=0.5, fps=10, codec='MJPG',
+                                extension='.avi', max_queue=100,
+                                on_saved=lambda keys, path: saved.append((keys, path)))
+        recorder.start()
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        for i in range(10):
+            recorder.add('gate', frame, [], 100.0 + i * 0.1)
+            if i == 5:
+                recorder.trigger('gate', {'rule': 'missing-ppe', 'track_id': 3}, 'event-key', 100.5)
+        recorder.stop()
+
+        self.assertEqual(recorder.stats()['clips'], 1)
+        [(keys, path)] = saved
+        self.assertEqual(keys, ['event-key'])
+        self.assertEqual(os.path.dirname(path), os.path.join(self.directory, 'gate'))
+        self.assertTrue(path.endswith('-missing-ppe-3.avi'))
+        self.assertTrue(os.path.getsize(path) > 0)
@@ -0,0 +1,45 @@
+import json
+
+from django.test import SimpleTestCase
+
+from ..consumers import VideoStreamConsumer
+
+
+class FilterMessageTests(SimpleTestCase):
+    # The per-connection filters, on a consumer that is not subscribed to a
+    # camera stream
+
+    def setUp(self):
+        self.consumer = VideoStreamConsumer()
+        self.consumer.camera_id = 'test'
+        self.consumer.class_ids = [1]
+        self.consumer.confidence_threshold = 0.5
+        self.sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            self.sent.append(json.loads(text_data))
+
+        self.consumer.send = send
+
+    async def receive(self, **message):
+        await self.consumer.receive(json.dumps(message))
+
+    async def test_set_class_ids(self):
+        await self.receive(action='set_class_ids', class_ids=[3, '4'])
+        self.assertEqual(self.consumer.class_ids, [3, 4])
+        self.assertEqual(self.sent, [])
+
+    async def test_invalid_class_ids_are_answered_with_an_error(self):
+        for class_ids in (['helmet'], [None], 'abc', 3):
+            await self.receive(action='set_class_ids', class_ids=class_ids)
+        self.assertEqual(self.consumer.class_ids, [1])
+        self.assertEqual(len(self.sent), 4)
+        self.assertTrue(all('error' in message for message in self.sent))
+
+    async def test_invalid_confidence_threshold_is_answered_with_an_error(self):
+        await self.receive(action='set_confidence_threshold', confidence_threshold=0.7)
+        await self.receive(action='set_confidence_threshold', confidence_threshold=1.5)
+        await self.receive(action='set_confidence_threshold', confidence_threshold='high')
+        self.assertEqual(self.consumer.confidence_threshold, 0.7)
+        self.assertEqual(len(self.sent), 2)
+        self.assertTrue(all('error' in message for message in self.sent))
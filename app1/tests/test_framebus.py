@@ -0,0 +1,83 @@
+import uuid
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..framebus import FrameBusReader, FrameBusWriter
+
+
+def frame(value, shape=(4, 6, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+
+class FrameBusTests(SimpleTestCase):
+
+    def setUp(self):
+        self.name = f'ppe_test_{uuid.uuid4().hex[:8]}'
+        # Writer and reader share this process, so the reader must leave the
+        # writer's resource tracker registration alone
+        patcher = mock.patch('app1.framebus.resource_tracker')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def writer(self, **kwargs):
+        writer = FrameBusWriter(self.name, (4, 6, 3), **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def reader(self, **kwargs):
+        reader = FrameBusReader(self.name, **kwargs)
+        self.addCleanup(reader.detach)
+        return reader
+
+    def test_reader_gets_the_newest_frame(self):
+        writer, reader = self.writer(slots=4), self.reader()
+        writer.publish(frame(1), [{'track_id': 1}])
+        image, detections = reader.get(timeout=1)
+        np.testing.assert_array_equal(image, frame(1))
+        self.assertEqual(detections, [{'track_id': 1}])
+
+        for value in (2, 3, 4):
+            writer.publish(frame(value), [{'track_id': value}])
+        image, detections = reader.get(timeout=1)
+        self.assertEqual(detections, [{'track_id': 4}])
+        self.assertEqual(reader.dropped, 2)
+        self.assertIsNone(reader.get(timeout=0.02))  # Nothing new
+
+    def test_slot_being_written_is_not_read(self):
+        writer, reader = self.writer(), self.reader()
+        writer.publish(frame(1), [])
+        slot = writer.sequence % writer.ring.slots
+        writer.ring.index['stamp'][slot] -= 1  # Odd: a write in progress
+        self.assertIsNone(reader.get(timeout=0.02))
+        writer.ring.index['stamp'][slot] += 1
+        self.assertIsNotNone(reader.get(timeout=1))
+
+    def test_frames_are_resized_and_oversized_detections_dropped(self):
+        writer, reader = self.writer(meta_size=16), self.reader()
+        writer.publish(frame(7, (8, 12, 3)), [{'class_name': 'No Helmet'}])
+        image, detections = reader.get(timeout=1)
+        self.assertEqual(image.shape, (4, 6, 3))
+        self.assertEqual(detections, [])
+        self.assertEqual(writer.oversized, 1)
+
+    def test_missing_segment(self):
+        reader = self.reader(poll_interval=0.001)
+        with self.assertLogs('app1.framebus', 'WARNING'):
+            self.assertIsNone(reader.get(timeout=0.02))
+        self.assertEqual(reader.state, 'missing')
+
+    def test_restarted_writer_is_picked_up(self):
+        writer = FrameBusWriter(self.name, (4, 6, 3))
+        reader = self.reader(reattach_after=0.05, max_retry_delay=0.01)
+        for value in (1, 2, 3):
+            writer.publish(frame(value), [value])
+        self.assertEqual(reader.get(timeout=1)[1], [3])
+
+        writer.close()
+        restarted = FrameBusWriter(self.name, (4, 6, 3))
+        self.addCleanup(restarted.close)
+        restarted.publish(frame(9), [9])  # Sequence 1 again
+        with self.assertLogs('app1.framebus', 'WARNING'):
+            self.assertEqual(reader.get(timeout=2)[1], [9])
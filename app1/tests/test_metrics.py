@@ -0,0 +1,44 @@
+from django.test import SimpleTestCase
+
+from ..metrics import Counter, Gauge, Histogram, Registry
+
+
+def gauge(name, value, **labels):
+    metric = Gauge(name, 'Test gauge')
+    metric.set(value, **labels)
+    return metric
+
+
+class RegistryTests(SimpleTestCase):
+
+    def test_render(self):
+        registry = Registry()
+        counter = registry.register(Counter('ppe_test_total', 'Test counter'))
+        counter.inc(camera='a')
+        counter.inc(2, camera='a')
+        histogram = registry.register(Histogram('ppe_test_seconds', 'Test histogram', buckets=(0.1, 1.0)))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        registry.add_collector(lambda: [gauge('ppe_test_depth', 7, camera='b"c')])
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE ppe_test_total counter', lines)
+        self.assertIn('ppe_test_total{camera="a"} 3', lines)
+        self.assertIn('ppe_test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('ppe_test_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('ppe_test_seconds_sum 0.55', lines)
+        self.assertIn('ppe_test_seconds_count 2', lines)
+        self.assertIn('ppe_test_depth{camera="b\\"c"} 7', lines)
+
+    def test_failing_collector_is_logged_once_per_interval(self):
+        def broken():
+            raise RuntimeError('collector down')
+
+        registry = Registry(log_interval=60.0)
+        registry.add_collector(broken)
+        registry.add_collector(lambda: [gauge('ppe_test_depth', 1)])
+        with self.assertLogs('app1.metrics', 'ERROR') as logs:
+            for _ in range(3):
+                self.assertIn('ppe_test_depth 1', registry.render().splitlines())
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('collector down', logs.output[0])
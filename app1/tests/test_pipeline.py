@@ -0,0 +1,24 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from ..pipeline import DropOldestQueue
+
+
+class DropOldestQueueTests(SimpleTestCase):
+
+    def test_full_queue_drops_the_oldest_item(self):
+        queue = DropOldestQueue(maxsize=2)
+        for item in (1, 2, 3):
+            queue.put(item)
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual([queue.get(), queue.get()], [2, 3])
+
+    def test_get_times_out_on_an_empty_queue(self):
+        self.assertIsNone(DropOldestQueue().get(timeout=0.01))
+
+    def test_get_wakes_up_on_put(self):
+        queue = DropOldestQueue()
+        threading.Timer(0.05, queue.put, ('frame',)).start()
+        self.assertEqual(queue.get(timeout=2), 'frame')
@@ -0,0 +1,48 @@
+from django.test import SimpleTestCase
+
+from ..profiles import DEFAULT_PROFILES, ProfileAdapter, StreamProfile, make_profile
+
+
+def feed(adapter, latency, times):
+    # Times at which the profile changed
+    return [now for now in times if adapter.observe(latency, now)]
+
+
+class MakeProfileTests(SimpleTestCase):
+
+    def test_values_are_clamped(self):
+        self.assertEqual(make_profile(2.0, 150, -5), StreamProfile(1.0, 100, 0.0))
+        self.assertEqual(make_profile(0.01, 1, 10), StreamProfile(0.1, 10, 10.0))
+
+
+class ProfileAdapterTests(SimpleTestCase):
+
+    def test_slow_client_steps_down_once_per_interval(self):
+        adapter = ProfileAdapter(DEFAULT_PROFILES, interval=2.0)
+        self.assertEqual(feed(adapter, 0.5, range(7)), [2, 4, 6])
+        self.assertEqual(adapter.name, 'minimal')
+        self.assertEqual(feed(adapter, 0.5, range(7, 12)), [])  # Already at the bottom
+
+    def test_fast_client_steps_up_after_upgrade_after(self):
+        adapter = ProfileAdapter(DEFAULT_PROFILES, start='low', interval=2.0, upgrade_after=10.0)
+        self.assertEqual(feed(adapter, 0.01, range(21)), [10, 20])
+        self.assertEqual(adapter.name, 'high')
+
+    def test_latency_between_the_thresholds_keeps_the_profile(self):
+        adapter = ProfileAdapter(DEFAULT_PROFILES, start='medium')
+        self.assertEqual(feed(adapter, 0.15, range(30)), [])
+        self.assertEqual(adapter.profile, make_profile(*DEFAULT_PROFILES['medium']))
+
+    def test_custom_and_fixed_profiles_are_not_adapted(self):
+        adapter = ProfileAdapter(DEFAULT_PROFILES)
+        adapter.set_custom(make_profile(0.5, 70, 12))
+        self.assertEqual(feed(adapter, 1.0, range(10)), [])
+        self.assertEqual(adapter.stats(), {'profile': 'custom', 'adaptive': False})
+
+        self.assertTrue(adapter.select('low'))
+        self.assertFalse(adapter.select('unknown'))
+        self.assertEqual(adapter.name, 'low')
+
+        fixed = ProfileAdapter(DEFAULT_PROFILES, adaptive=False)
+        self.assertEqual(feed(fixed, 1.0, range(10)), [])
+        self.assertEqual(fixed.name, 'high')
@@ -0,0 +1,34 @@
+import base64
+import json
+
+from django.test import SimpleTestCase
+
+from ..protocol import BINARY, BINARY_SUBPROTOCOL, JSON, encode_message, negotiate, unpack_binary
+
+
+class NegotiateTests(SimpleTestCase):
+
+    def test_binary_when_offered(self):
+        self.assertEqual(negotiate(['other', BINARY_SUBPROTOCOL]), (BINARY, BINARY_SUBPROTOCOL))
+
+    def test_json_otherwise(self):
+        self.assertEqual(negotiate(['other']), (JSON, None))
+        self.assertEqual(negotiate(None), (JSON, None))
+
+
+class EncodeMessageTests(SimpleTestCase):
+    metadata = {'detected_objects': [{'class_name': 'Hardhat', 'bbox': [1, 2, 3, 4]}], 'width': 640}
+
+    def test_binary_round_trip(self):
+        message = encode_message(BINARY, b'\xff\xd8JPEG', self.metadata)
+        self.assertIsInstance(message, bytes)
+        self.assertEqual(unpack_binary(message), (b'\xff\xd8JPEG', self.metadata))
+
+    def test_binary_header_is_the_metadata_length(self):
+        message = encode_message(BINARY, b'', {'é': 1})
+        self.assertEqual(int.from_bytes(message[:4], 'big'), len(message) - 4)
+
+    def test_json_embeds_the_frame_as_base64(self):
+        message = json.loads(encode_message(JSON, b'\xff\xd8JPEG', self.metadata))
+        self.assertEqual(base64.b64decode(message.pop('frame')), b'\xff\xd8JPEG')
+        self.assertEqual(message, self.metadata)
@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..retention import (DETECTION_COLUMNS, archive_events, archive_raw_partition, create_partition, load_archive,
+                         partition_table, raw_partitions, save_archive)
+from ..storage import DetectionWriter
+from .utils import add_event, temp_database
+
+
+def detection(timestamp, track_id=1):
+    return (2, 'No Helmet', 0.8, track_id, 1, 2, 3, 4, timestamp, 'default')
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+class PartitionTests(SimpleTestCase):
+
+    def test_partition_table(self):
+        self.assertEqual(partition_table('2026-10-18 09:30:00'), 'detections_20261018')
+
+    def test_raw_partitions_oldest_first(self):
+        conn = sqlite3.connect(':memory:')
+        for table in ('detections_20261018', 'detections_20261002', 'detections_rollups', 'detections'):
+            conn.execute(f'CREATE TABLE {table} (id INTEGER)')
+        self.assertEqual(raw_partitions(conn),
+                         [('20261002', 'detections_20261002'), ('20261018', 'detections_20261018')])
+
+
+class ArchiveRawPartitionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.conn, path = temp_database(self)
+        self.archive_dir = os.path.join(os.path.dirname(path), 'archive')
+        self.path = os.path.join(self.archive_dir, 'detections_20260801.npz')
+
+    def add_detections(self, track_ids):
+        create_partition(self.conn, 'detections_20260801')
+        with self.conn:
+            self.conn.executemany(DetectionWriter.INSERT_DETECTION.format(table='detections_20260801'),
+                                  [detection(f'2026-08-01 10:00:{i:02d}', i) for i in track_ids])
+
+    def archive(self):
+        return archive_raw_partition(self.conn, '20260801', 'detections_20260801', self.archive_dir, chunk_size=3)
+
+    def test_partition_is_archived_in_chunks_and_dropped(self):
+        self.add_detections(range(7))
+        self.assertEqual(self.archive(), 7)
+        self.assertEqual(raw_partitions(self.conn), [])
+        archive = load_archive(self.path)
+        self.assertEqual(archive['id'].tolist(), list(range(1, 8)))
+        self.assertEqual(archive['track_id'].tolist(), list(range(7)))
+        self.assertEqual(self.conn.execute('SELECT SUM(detection_count) FROM detection_rollups_hour').fetchone(), (7,))
+
+    def test_partition_created_again_is_added_to_the_archive(self):
+        self.add_detections(range(4))
+        self.archive()
+        self.add_detections(range(4, 6))  # Late rows, ids start at 1 again
+        self.assertEqual(self.archive(), 2)
+        archive = load_archive(self.path)
+        self.assertEqual(archive['id'].tolist(), [1, 2, 3, 4, 1, 2])
+        self.assertEqual(archive['track_id'].tolist(), list(range(6)))
+
+    def test_rows_already_in_the_archive_are_not_added_twice(self):
+        # A run that wrote the archive but did not get to drop the partition
+        self.add_detections(range(4))
+        rows = self.conn.execute(f'SELECT {", ".join(DETECTION_COLUMNS)} FROM detections_20260801').fetchall()
+        save_archive(self.path, DETECTION_COLUMNS, rows[:3])
+        self.assertEqual(self.archive(), 4)
+        self.assertEqual(load_archive(self.path)['id'].tolist(), [1, 2, 3, 4])
+
+
+class ArchiveEventsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.conn, path = temp_database(self)
+        self.archive_dir = os.path.join(os.path.dirname(path), 'archive')
+
+    def keys(self):
+        return [key for key, in self.conn.execute('SELECT event_key FROM track_events ORDER BY id')]
+
+    def test_archives_events_that_ended_before_the_cutoff(self):
+        add_event(self.conn, 'old', '2026-08-01 10:00:00', '2026-08-01 10:00:05')
+        add_event(self.conn, 'spanning', '2026-08-31 23:59:00', '2026-09-01 00:01:00')
+        add_event(self.conn, 'recent', '2026-09-02 10:00:00', '2026-09-02 10:00:05')
+
+        self.assertEqual(archive_events(self.conn, '2026-09-01', self.archive_dir), 1)
+        self.assertEqual(self.keys(), ['spanning', 'recent'])
+        archive = load_archive(os.path.join(self.archive_dir, 'track_events_20260801.npz'))
+        self.assertEqual(archive['event_key'].tolist(), ['old'])
+        self.assertEqual(archive['x2'].tolist(), [3])
+
+    def test_later_runs_add_to_the_day_and_count_only_their_events(self):
+        add_event(self.conn, 'first', '2026-08-01 10:00:00', '2026-08-01 10:00:05')
+        self.assertEqual(archive_events(self.conn, '2026-09-01', self.archive_dir), 1)
+        add_event(self.conn, 'second', '2026-08-01 11:00:00', '2026-08-01 11:00:05')
+
+        self.assertEqual(archive_events(self.conn, '2026-09-01', self.archive_dir), 1)
+        archive = load_archive(os.path.join(self.archive_dir, 'track_events_20260801.npz'))
+        self.assertEqual(archive['event_key'].tolist(), ['first', 'second'])
+        self.assertEqual(self.keys(), [])
+
+    def test_missing_numbers_are_archived_as_nan(self):
+        add_event(self.conn, 'boxed', '2026-08-01 10:00:00', '2026-08-01 10:00:05')
+        add_event(self.conn, 'unboxed', '2026-08-01 11:00:00', '2026-08-01 11:00:05', track_id=None, box=(None,) * 4)
+
+        archive_events(self.conn, '2026-09-01', self.archive_dir)
+        archive = load_archive(os.path.join(self.archive_dir, 'track_events_20260801.npz'))
+        self.assertEqual(archive['track_id'][0], 1)
+        self.assertTrue(np.isnan(archive['track_id'][1]))
+        self.assertTrue(np.isnan(archive['x1'][1]))
+        self.assertEqual(archive['frame_count'].dtype, np.int64)
+
+
+class WriterCompactionTests(SimpleTestCase):
+
+    def test_rows_are_written_while_the_writer_compacts(self):
+        _, path = temp_database(self)
+        running, finish = threading.Event(), threading.Event()
+
+        def slow_compact(conn, vacuum=True):
+            running.set()
+            finish.wait(5)
+            return {'vacuum': vacuum, 'thread': threading.current_thread().name}
+
+        writer = DetectionWriter(path, flush_interval=0.01, compact_interval=0.05)
+        with mock.patch('app1.storage.compact', slow_compact):
+            writer.start()
+            self.addCleanup(writer.stop)
+            self.assertTrue(running.wait(5))
+            writer.write(detection('2026-10-18 10:00:00'))
+            wait_until(lambda: writer.rows_written == 1)
+            finish.set()
+            wait_until(lambda: writer.last_compaction is not None)
+        self.assertEqual(writer.last_compaction, {'vacuum': False, 'thread': 'ppe-db-compact'})
+        self.assertEqual(writer.dropped, 0)
@@ -0,0 +1,71 @@
+import sqlite3
+
+from django.test import SimpleTestCase
+
+from ..analytics import summarize_events
+from ..rollups import add_to_rollups, rebuild_rollups
+from ..storage import setup_database
+from .utils import add_event, temp_database
+
+
+class RollupTests(SimpleTestCase):
+
+    def setUp(self):
+        self.conn, self.path = temp_database(self)
+
+    def counts(self):
+        return self.conn.execute('''SELECT bucket, camera_id, class_name, event_count FROM event_rollups_hour
+                                    ORDER BY bucket, camera_id, class_name''').fetchall()
+
+    def test_add_to_rollups_counts_only_new_events(self):
+        add_event(self.conn, 'a', '2026-10-18 10:05:00', class_name='No Helmet')
+        add_event(self.conn, 'b', '2026-10-18 10:55:00', class_name='No Helmet')
+        last_id = add_to_rollups(self.conn, 0)
+        self.assertEqual(last_id, 2)
+
+        add_event(self.conn, 'c', '2026-10-18 10:59:00', class_name='No Helmet')
+        add_event(self.conn, 'd', '2026-10-18 11:00:00', camera_id='gate', class_name='Hardhat')
+        self.assertEqual(add_to_rollups(self.conn, last_id), 4)
+        self.assertEqual(add_to_rollups(self.conn, 4), 4)
+        self.assertEqual(self.counts(), [
+            ('2026-10-18 10', 'default', 'No Helmet', 3),
+            ('2026-10-18 11', 'gate', 'Hardhat', 1),
+        ])
+
+    def test_rebuild_keeps_the_buckets_of_archived_events(self):
+        add_event(self.conn, 'archived', '2026-10-17 09:00:00')
+        add_event(self.conn, 'kept', '2026-10-18 10:00:00')
+        add_to_rollups(self.conn, 0)
+        with self.conn:
+            self.conn.execute("DELETE FROM track_events WHERE event_key = 'archived'")
+            self.conn.execute('UPDATE event_rollups_hour SET event_count = 99')
+
+        self.assertEqual(rebuild_rollups(self.conn), 2)
+        self.assertEqual(self.counts(), [
+            ('2026-10-17 09', 'default', 'No Helmet', 99),
+            ('2026-10-18 10', 'default', 'No Helmet', 1),
+        ])
+
+    def test_summary_reads_the_rollups(self):
+        add_event(self.conn, 'a', '2026-10-18 07:00:00', class_id=2, class_name='No Helmet')
+        add_event(self.conn, 'b', '2026-10-18 13:00:00', class_id=2, class_name='No Helmet')
+        add_event(self.conn, 'c', '2026-10-18 13:30:00', class_id=0, class_name='Hardhat')
+        add_to_rollups(self.conn, 0)
+        summary = summarize_events(self.conn)
+        self.assertEqual(summary['total_detections'], 3)
+        self.assertEqual(summary['most_frequent_classes'], [('No Helmet', 2), ('Hardhat', 1)])
+        self.assertEqual(summary['time_based_counts']['6 AM - 12 PM'], 1)
+        self.assertEqual(summary['time_based_counts']['12 PM - 6 PM'], 2)
+
+    def test_existing_databases_are_backfilled_and_lose_the_minute_rollup(self):
+        add_event(self.conn, 'a', '2026-10-18 10:00:00')
+        with self.conn:
+            self.conn.execute('DROP TABLE event_rollups_hour')
+            self.conn.execute('CREATE TABLE event_rollups_minute (bucket TEXT)')
+        setup_database(self.path).close()
+
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertNotIn('event_rollups_minute', tables)
+        self.assertEqual(conn.execute('SELECT SUM(event_count) FROM event_rollups_hour').fetchone()[0], 1)
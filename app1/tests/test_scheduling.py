@@ -0,0 +1,94 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..alerts import AlertEngine
+from ..processing import CameraProcessor
+from ..scheduling import FrameScheduler, MotionGate
+
+
+def frame(value):
+    return np.full((48, 64, 3), value, dtype=np.uint8)
+
+
+class MotionGateTests(SimpleTestCase):
+
+    def test_changes_are_measured_against_the_reference(self):
+        gate = MotionGate(threshold=4.0)
+        self.assertTrue(gate.changed(frame(0)))  # No reference yet
+        gate.reset(frame(0))
+        self.assertFalse(gate.changed(frame(3)))
+        self.assertTrue(gate.changed(frame(10)))
+
+    def test_zero_threshold_disables_the_gate(self):
+        gate = MotionGate(threshold=0)
+        gate.reset(frame(0))
+        self.assertTrue(gate.changed(frame(0)))
+
+
+class FrameSchedulerTests(SimpleTestCase):
+
+    def test_static_scene_is_detected_every_max_interval(self):
+        scheduler = FrameScheduler(max_interval=1.0)
+        decisions = [scheduler.should_detect(frame(0), now) for now in (0.0, 0.1, 0.5, 1.0, 1.5)]
+        self.assertEqual(decisions, [True, False, False, True, False])
+        self.assertFalse(scheduler.moving)
+        self.assertEqual(scheduler.stats(1.5)['skipped'], 3)
+
+    def test_moving_scene_is_detected_every_detect_every_frames(self):
+        scheduler = FrameScheduler(detect_every=3, max_interval=10.0, motion_threshold=4.0)
+        decisions = []
+        for i in range(7):
+            decisions.append(scheduler.should_detect(frame(20 * i), i * 0.03))
+            self.assertTrue(scheduler.moving)
+        self.assertEqual(decisions, [True, False, False, True, False, False, True])
+
+    def test_idle_scene_is_read_at_idle_fps(self):
+        scheduler = FrameScheduler(target_fps=30, idle_fps=2, idle_after=2.0)
+        scheduler.should_detect(frame(0), 0.0)
+        self.assertEqual(scheduler.interval(1.0), 1 / 30)
+        self.assertTrue(scheduler.idle(2.0))
+        self.assertEqual(scheduler.interval(2.0), 0.5)
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.events = []
+
+    def write(self, row):
+        pass
+
+    def write_event(self, row):
+        self.events.append(row)
+
+
+class PredictionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.writer = FakeWriter()
+        self.processor = CameraProcessor('test', ['Helmet', 'Vest', 'No Helmet'], self.writer,
+                                         AlertEngine('test', [], dispatch=lambda alert: None))
+
+    def detect(self, frame_id, box):
+        self.processor.remember_detection(frame_id, np.array([box], dtype=np.float32), np.array([0.9]),
+                                          np.array([2]), np.array([1]))
+
+    def test_detect_every_skips_follow_the_track_velocity(self):
+        self.detect(0, [0, 0, 10, 10])
+        self.detect(2, [4, 0, 14, 10])
+        xyxy, _, _ = self.processor.predict_boxes(3)
+        np.testing.assert_allclose(xyxy, [[6, 0, 16, 10]])
+
+    def test_motion_gated_skips_keep_the_last_boxes(self):
+        self.detect(0, [0, 0, 10, 10])
+        self.detect(2, [4, 0, 14, 10])
+        xyxy, _, _ = self.processor.predict_boxes(30, moving=False)
+        np.testing.assert_allclose(xyxy, [[4, 0, 14, 10]])
+
+    def test_predicted_frames_are_not_counted_in_events(self):
+        self.processor.event_recorder.update([{'track_id': 1, 'class_id': 2, 'class_name': 'No Helmet',
+                                               'confidence': 0.9, 'bbox': (0, 0, 10, 10)}], 0.0, 'now')
+        self.processor.event_recorder.update([{'track_id': 1, 'class_id': 2, 'class_name': 'No Helmet',
+                                               'confidence': 0.9, 'bbox': (0, 0, 10, 10)}], 0.1, 'now',
+                                             detected=False)
+        self.assertEqual(self.processor.event_recorder.open_events[1]['frame_count'], 1)
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..tracking import IoUTracker, greedy_match, hungarian_match, iou_matrix, linear_sum_assignment
+
+
+class MatchingTests(SimpleTestCase):
+
+    def test_iou_matrix(self):
+        iou = iou_matrix([[0, 0, 10, 10], [20, 20, 30, 30]], [[0, 0, 10, 10], [5, 0, 15, 10], [0, 0, 0, 0]])
+        np.testing.assert_allclose(iou, [[1.0, 1 / 3, 0.0], [0.0, 0.0, 0.0]], rtol=1e-6)
+        self.assertEqual(iou_matrix(np.zeros((0, 4)), [[0, 0, 1, 1]]).shape, (0, 1))
+
+    def test_greedy_match_takes_the_best_pair_first(self):
+        iou = np.array([[0.9, 0.8], [0.85, 0.0]])
+        self.assertEqual(greedy_match(iou, 0.3), [(0, 0)])
+
+    @unittest.skipIf(linear_sum_assignment is None, "scipy is not installed")
+    def test_hungarian_match_maximises_the_total(self):
+        iou = np.array([[0.9, 0.8], [0.85, 0.0]])
+        self.assertEqual(sorted(hungarian_match(iou, 0.3)), [(0, 1), (1, 0)])
+
+    def test_pairs_below_the_threshold_are_not_matched(self):
+        iou = np.array([[0.2, 0.0], [0.0, 0.5]])
+        self.assertEqual(hungarian_match(iou, 0.3), [(1, 1)])
+        self.assertEqual(greedy_match(iou, 0.3), [(1, 1)])
+
+
+class IoUTrackerTests(SimpleTestCase):
+
+    def test_moving_boxes_keep_their_track(self):
+        tracker = IoUTracker()
+        first = tracker.update([[0, 0, 10, 10], [50, 50, 60, 60]], [0.9, 0.8], [0, 2], frame_id=1, now=0.0)
+        second = tracker.update([[52, 51, 62, 61], [1, 1, 11, 11]], [0.9, 0.8], [2, 0], frame_id=2, now=0.1)
+        self.assertEqual(first.tolist(), [1, 2])
+        self.assertEqual(second.tolist(), [2, 1])
+        self.assertEqual(list(tracker.trajectories[2]), [(1, (50, 50, 60, 60)), (2, (52, 51, 62, 61))])
+
+    def test_unmatched_boxes_start_new_tracks(self):
+        tracker = IoUTracker()
+        tracker.update([[0, 0, 10, 10]], [0.9], [0], frame_id=1, now=0.0)
+        track_ids = tracker.update([[0, 0, 10, 10], [100, 100, 110, 110]], [0.9, 0.9], [0, 0], frame_id=2, now=0.1)
+        self.assertEqual(track_ids.tolist(), [1, 2])
+        self.assertEqual(tracker.active_ids(), {1, 2})
+
+    def test_tracks_expire_after_max_age(self):
+        tracker = IoUTracker(max_age=1.0)
+        tracker.update([[0, 0, 10, 10]], [0.9], [0], frame_id=1, now=0.0)
+        tracker.update([], [], [], frame_id=2, now=0.5)
+        self.assertEqual(tracker.active_ids(), {1})
+        track_ids = tracker.update([[0, 0, 10, 10]], [0.9], [0], frame_id=3, now=2.0)
+        self.assertEqual(track_ids.tolist(), [2])
+        self.assertEqual(tracker.active_ids(), {2})
+        self.assertNotIn(1, tracker.trajectories)
+
+    def test_history_is_bounded(self):
+        tracker = IoUTracker(history=3)
+        for frame_id in range(10):
+            tracker.update([[0, 0, 10, 10]], [0.9], [0], frame_id=frame_id, now=frame_id * 0.1)
+        self.assertEqual([frame_id for frame_id, _ in tracker.trajectories[1]], [7, 8, 9])
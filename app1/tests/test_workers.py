@@ -0,0 +1,189 @@
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, override_settings
+
+from ..pipeline import FrameSlots, RemoteInferenceStage
+from ..workers import (WORKERS_GROUP, InferencePool, RemoteResult, WorkerDirectory, assign, camera_group,
+                       job_channel, run_worker)
+
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class WorkerDirectoryTests(SimpleTestCase):
+
+    def test_assignment_does_not_depend_on_the_order_of_workers(self):
+        workers = ['worker-a', 'worker-b', 'worker-c']
+        for camera_id in range(20):
+            self.assertEqual(assign(camera_id, workers), assign(camera_id, list(reversed(workers))))
+        self.assertIsNone(assign('default', []))
+
+    def test_only_the_cameras_of_a_leaving_worker_move(self):
+        workers = ['worker-a', 'worker-b', 'worker-c']
+        before = {camera_id: assign(camera_id, workers) for camera_id in range(50)}
+        after = {camera_id: assign(camera_id, ['worker-a', 'worker-c']) for camera_id in range(50)}
+        for camera_id, worker in before.items():
+            if worker != 'worker-b':
+                self.assertEqual(after[camera_id], worker)
+        self.assertEqual(set(before.values()), set(workers))
+
+    def test_failover_when_heartbeats_stop(self):
+        directory = WorkerDirectory(timeout=3.0)
+        directory.seen('worker-a', now=100.0)
+        directory.seen('worker-b', now=100.0)
+        camera_id = next(camera_id for camera_id in range(50)
+                         if assign(camera_id, ['worker-a', 'worker-b']) == 'worker-a')
+        self.assertEqual(directory.worker_for(camera_id, now=101.0), 'worker-a')
+
+        directory.seen('worker-b', now=102.0)
+        with self.assertLogs('app1.workers', 'WARNING'):
+            self.assertEqual(directory.worker_for(camera_id, now=104.0), 'worker-b')
+        self.assertEqual(directory.live(now=104.0), ['worker-b'])
+
+        directory.seen('worker-a', now=105.0)
+        self.assertEqual(directory.worker_for(camera_id, now=105.0), 'worker-a')
+
+
+class FakeModel:
+    names = {0: 'Hardhat', 2: 'No Helmet'}
+
+    def __call__(self, images):
+        return [RemoteResult([[[1, 2, 3, 4]], [0.9], [2]]) for _ in images]
+
+
+class FakeStream:
+    # The part of CameraStream that RemoteInferenceStage uses
+
+    def __init__(self):
+        self.handled = []
+        self.done = threading.Event()
+
+    def crop(self, frame):
+        return [frame]
+
+    def handle_result(self, frame_id, frame, results):
+        self.handled.append((frame_id, results))
+        self.done.set()
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        await asyncio.sleep(0.01)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class InferencePoolTests(SimpleTestCase):
+
+    @contextlib.asynccontextmanager
+    async def running_pool(self):
+        self.layer = get_channel_layer()
+        await self.layer.flush()  # Jobs and groups left by other tests
+        self.pool = InferencePool(worker_timeout=3.0)
+        await self.pool.start()
+        await self.pool.follow('default')
+        try:
+            yield self.pool
+        finally:
+            # The pool's listener and the workers run until cancelled
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def heartbeat(self, worker_id):
+        await self.layer.group_send(WORKERS_GROUP, {'type': 'worker.heartbeat', 'worker': worker_id,
+                                                    'names': [[2, 'No Helmet']], 'jobs': 0})
+        await wait_for(lambda: worker_id in self.pool.directory.live())
+
+    async def test_submit_without_workers(self):
+        async with self.running_pool():
+            self.assertIsNone(self.pool.submit('default', 1, [np.zeros((8, 8, 3), dtype=np.uint8)]))
+
+    async def test_jobs_go_to_the_assigned_worker(self):
+        async with self.running_pool():
+            await self.heartbeat('worker-a')
+            self.assertEqual(self.pool.names, {2: 'No Helmet'})
+
+            self.assertEqual(self.pool.submit('default', 7, [np.zeros((8, 8, 3), dtype=np.uint8)]), 'worker-a')
+            job = await asyncio.wait_for(self.layer.receive(job_channel('worker-a')), 2)
+            self.assertEqual((job['camera'], job['frame_id'], job['producer']), ('default', 7, self.pool.channel))
+            self.assertEqual(len(job['crops']), 1)
+
+            await self.layer.group_send(WORKERS_GROUP, {'type': 'worker.leaving', 'worker': 'worker-a'})
+            await wait_for(lambda: not self.pool.directory.live())
+            self.assertIsNone(self.pool.submit('default', 8, [np.zeros((8, 8, 3), dtype=np.uint8)]))
+
+    async def test_results_of_other_producers_are_ignored(self):
+        async with self.running_pool():
+            await self.layer.group_send(camera_group('default'), {
+                'type': 'inference.result', 'camera': 'default', 'frame_id': 1, 'producer': 'someone.else',
+                'worker': 'worker-a', 'boxes': [],
+            })
+            await self.layer.group_send(camera_group('default'), {
+                'type': 'inference.result', 'camera': 'default', 'frame_id': 2, 'producer': self.pool.channel,
+                'worker': 'worker-a', 'boxes': [[[[1, 2, 3, 4]], [0.9], [2]]],
+            })
+            await wait_for(lambda: self.pool.received)
+            (camera_id, frame_id, results), = self.pool.take_results()
+            self.assertEqual((camera_id, frame_id), ('default', 2))
+            self.assertEqual(results[0].boxes.xyxy.tolist(), [[1, 2, 3, 4]])
+
+    async def test_remote_inference_round_trip(self):
+        async with self.running_pool():
+            asyncio.create_task(run_worker('worker-a', FakeModel(), heartbeat_interval=0.05))
+            await wait_for(lambda: self.pool.directory.live())
+            stream = FakeStream()
+            slots = FrameSlots()
+            stage = RemoteInferenceStage(self.pool, slots, {'default': stream}, job_timeout=2.0)
+            stage.start()
+            try:
+                slots.put('default', (1, np.zeros((8, 8, 3), dtype=np.uint8)))
+                await wait_for(stream.done.is_set)
+            finally:
+                stage.stop()
+            (frame_id, results), = stream.handled
+            self.assertEqual(frame_id, 1)
+            self.assertEqual(results[0].boxes.cls.tolist(), [2])
+            self.assertEqual(stage.lost, 0)
+
+    async def test_frames_without_a_result_are_given_up_after_the_timeout(self):
+        async with self.running_pool():
+            # A worker that sends heartbeats but never answers
+            await self.heartbeat('worker-a')
+            stream = FakeStream()
+            slots = FrameSlots()
+            stage = RemoteInferenceStage(self.pool, slots, {'default': stream}, max_in_flight=1, job_timeout=0.2)
+            stage.start()
+            try:
+                slots.put('default', (1, np.zeros((8, 8, 3), dtype=np.uint8)))
+                await wait_for(lambda: stage.pending.get('default'))
+                # The camera has max_in_flight frames out, so the next one waits
+                slots.put('default', (2, np.zeros((8, 8, 3), dtype=np.uint8)))
+                await asyncio.sleep(0.1)
+                self.assertEqual(slots.qsize('default'), 1)
+                await wait_for(lambda: stage.lost == 1)
+                await wait_for(lambda: not slots.qsize('default'))
+            finally:
+                stage.stop()
+            self.assertEqual(stream.handled, [])
+
+    async def test_earlier_frames_are_dropped_when_a_later_result_arrives(self):
+        async with self.running_pool():
+            await self.heartbeat('worker-a')
+            stream = FakeStream()
+            stage = RemoteInferenceStage(self.pool, FrameSlots(), {'default': stream}, job_timeout=10.0)
+            now = time.monotonic()
+            stage.pending['default'] = deque([(1, None, now), (2, None, now)])
+            self.pool.results.append(('default', 2, []))
+            stage.handle_results()
+            self.assertEqual(stream.handled, [(2, [])])
+            self.assertEqual(stage.lost, 1)
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..zones import Zones, merge_rects
+
+
+def result(xyxy, conf, cls):
+    # Stand-in for an ultralytics Results object
+    boxes = SimpleNamespace(xyxy=np.array(xyxy, dtype=np.float32), conf=np.array(conf, dtype=np.float32),
+                            cls=np.array(cls, dtype=np.float32))
+    return SimpleNamespace(boxes=SimpleNamespace(cpu=lambda: SimpleNamespace(numpy=lambda: boxes)))
+
+
+class ZonesTests(SimpleTestCase):
+
+    def test_contains(self):
+        zones = Zones({'gate': [[0, 0], [100, 0], [100, 100], [0, 100]], 'dock': [[200, 0], [300, 0], [300, 50]]})
+        points = [(50, 50), (150, 50), (290, 10), (210, 40), (100, 100)]
+        self.assertEqual(zones.contains(points).tolist(), [True, False, True, False, True])
+        self.assertEqual(zones.zone_names(points), ['gate', None, 'dock', None, 'gate'])
+
+    def test_without_zones_the_whole_frame_is_used(self):
+        zones = Zones()
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.assertFalse(zones)
+        self.assertEqual(len(zones.crops(frame)), 1)
+        self.assertIs(zones.crops(frame)[0], frame)
+
+    def test_windows_are_padded_and_clipped_to_the_frame(self):
+        zones = Zones([[[10, 10], [30, 10], [30, 30]]], padding=16)
+        self.assertEqual(zones.windows(np.zeros((40, 40, 3), dtype=np.uint8)), [(0, 0, 40, 40)])
+
+    def test_overlapping_crops_are_merged(self):
+        self.assertEqual(merge_rects([(0, 0, 10, 10), (5, 5, 20, 20), (30, 30, 40, 40)]),
+                         [(0, 0, 20, 20), (30, 30, 40, 40)])
+
+    def test_crop_boxes_are_mapped_back_and_filtered(self):
+        zones = Zones({'gate': [[100, 100], [200, 100], [200, 200], [100, 200]]}, padding=10)
+        frame = np.zeros((300, 300, 3), dtype=np.uint8)
+        # The crop starts at (90, 90); the second box is centered outside the zone
+        xyxy, confidences, class_ids = zones.boxes(frame, [result([[20, 20, 40, 40], [0, 0, 10, 10]], [0.9, 0.8], [2, 1])])
+        np.testing.assert_allclose(xyxy, [[110, 110, 130, 130]])
+        np.testing.assert_allclose(confidences, [0.9])
+        self.assertEqual(class_ids.tolist(), [2])
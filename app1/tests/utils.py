@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+from ..storage import setup_database
+
+
+def temp_database(test):
+    # (connection, path) of a fresh detections database, removed after the test
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    path = os.path.join(directory.name, 'detections.db')
+    conn = setup_database(path)
+    test.addCleanup(conn.close)
+    return conn, path
+
+
+def add_event(conn, key, first_seen, last_seen=None, camera_id='default', track_id=1, class_id=2,
+              class_name='No Helmet', box=(1, 2, 3, 4), frame_count=5):
+    with conn:
+        return conn.execute(
+            '''INSERT INTO track_events (event_key, camera_id, track_id, class_id, class_name, confidence,
+                                         x1, y1, x2, y2, first_seen, last_seen, frame_count, trajectory, status)
+               VALUES (?, ?, ?, ?, ?, 0.8, ?, ?, ?, ?, ?, ?, ?, '[]', 'closed')''',
+            (key, camera_id, track_id, class_id, class_name, *box, first_seen, last_seen or first_seen,
+             frame_count)).lastrowid
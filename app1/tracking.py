@@ -0,0 +1,157 @@
+import time
+from collections import deque
+
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy comes with ultralytics; fall back to greedy matching without it
+    linear_sum_assignment = None
+
+
+def iou_matrix(boxes_a, boxes_b):
+    # Pairwise IoU of (N, 4) and (M, 4) xyxy boxes -> (N, M)
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def greedy_match(iou, threshold):
+    # Pairs (row, col) by descending IoU, each row and column used once
+    rows, cols = np.nonzero(iou > threshold)
+    order = np.argsort(-iou[rows, cols], kind='stable')
+    used_rows, used_cols, matches = set(), set(), []
+    for row, col in zip(rows[order], cols[order]):
+        if row not in used_rows and col not in used_cols:
+            used_rows.add(row)
+            used_cols.add(col)
+            matches.append((row, col))
+    return matches
+
+
+def hungarian_match(iou, threshold):
+    # Globally optimal assignment maximising the total IoU
+    if linear_sum_assignment is None:
+        return greedy_match(iou, threshold)
+    rows, cols = linear_sum_assignment(-iou)
+    return [(row, col) for row, col in zip(rows, cols) if iou[row, col] > threshold]
+
+
+class IoUTracker:
+    # Matches the boxes of each frame to the last box of every live track by
+    # IoU. Tracks not matched for max_age seconds are dropped and each track
+    # keeps only its last `history` boxes.
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0, history=30, matcher='hungarian'):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.match = hungarian_match if matcher == 'hungarian' else greedy_match
+        self.history = history
+        self.next_id = 1
+        self.track_ids = []
+        self.track_boxes = np.zeros((0, 4), dtype=np.float32)
+        self.last_seen = []
+        self.trajectories = {}  # track_id -> deque of (frame_id, bbox)
+
+    def update(self, boxes, confidences, class_ids, frame_id, now=None, frame=None):
+        # Returns one track id per input box
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        track_ids = np.full(len(boxes), -1, dtype=np.int64)
+
+        if len(boxes) and len(self.track_ids):
+            for row, col in self.match(iou_matrix(boxes, self.track_boxes), self.iou_threshold):
+                track_ids[row] = self.track_ids[col]
+                self.track_boxes[col] = boxes[row]
+                self.last_seen[col] = now
+
+        new_rows = np.nonzero(track_ids < 0)[0]
+        for row in new_rows:
+            track_ids[row] = self.next_id
+            self.trajectories[self.next_id] = deque(maxlen=self.history)
+            self.next_id += 1
+        if len(new_rows):
+            self.track_ids.extend(track_ids[new_rows].tolist())
+            self.track_boxes = np.concatenate([self.track_boxes, boxes[new_rows]])
+            self.last_seen.extend([now] * len(new_rows))
+
+        for track_id, box in zip(track_ids.tolist(), boxes.astype(int).tolist()):
+            self.trajectories[track_id].append((frame_id, tuple(box)))
+        return track_ids
+
+    def _expire(self, now):
+        keep = [i for i, seen in enumerate(self.last_seen) if now - seen <= self.max_age]
+        if len(keep) == len(self.track_ids):
+            return
+        for i in set(range(len(self.track_ids))) - set(keep):
+            self.trajectories.pop(self.track_ids[i], None)
+        self.track_ids = [self.track_ids[i] for i in keep]
+        self.track_boxes = self.track_boxes[keep]
+        self.last_seen = [self.last_seen[i] for i in keep]
+
+    def active_ids(self):
+        return set(self.track_ids)
+
+
+class _TrackerInput:
+    # The slice of ultralytics' Boxes interface that its trackers read
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+        self.xywh = np.concatenate([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __getitem__(self, index):
+        return _TrackerInput(self.xyxy[index], self.conf[index], self.cls[index])
+
+
+class UltralyticsTracker:
+    # ByteTrack or BoT-SORT from ultralytics, behind the IoUTracker interface.
+    # Boxes the tracker has not confirmed yet get track id -1.
+
+    def __init__(self, tracker_type='bytetrack', frame_rate=30):
+        from ultralytics.trackers import BOTSORT, BYTETracker
+        from ultralytics.utils import IterableSimpleNamespace, yaml_load
+        from ultralytics.utils.checks import check_yaml
+
+        config = IterableSimpleNamespace(**yaml_load(check_yaml(f'{tracker_type}.yaml')))
+        tracker_class = BOTSORT if tracker_type == 'botsort' else BYTETracker
+        self.tracker = tracker_class(args=config, frame_rate=frame_rate)
+
+    def update(self, boxes, confidences, class_ids, frame_id, now=None, frame=None):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        track_ids = np.full(len(boxes), -1, dtype=np.int64)
+        detections = _TrackerInput(
+            boxes,
+            np.asarray(confidences, dtype=np.float32),
+            np.asarray(class_ids, dtype=np.float32),
+        )
+        tracks = self.tracker.update(detections, frame)
+        if len(tracks):
+            # Rows are [x1, y1, x2, y2, track_id, score, cls, input index]
+            track_ids[tracks[:, -1].astype(int)] = tracks[:, 4].astype(int)
+        return track_ids
+
+    def active_ids(self):
+        return {track.track_id for track in self.tracker.tracked_stracks + self.tracker.lost_stracks}
+
+
+def make_tracker(backend='iou', frame_rate=30, **options):
+    # backend is 'iou' (built in), 'bytetrack' or 'botsort'
+    if backend in ('bytetrack', 'botsort'):
+        return UltralyticsTracker(backend, frame_rate)
+    return IoUTracker(**options)
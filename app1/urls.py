@@ -6,6 +6,10 @@ urlpatterns = [
     path('', views.ppe_detection, name='ppe_detection-page'),  # URL to the PPE-Page
     path('detections/', views.detection_list, name='detection_list'),
     path('fetch-detections/', views.fetch_detections, name='fetch_detections'),
+    path('detections/export/', views.export_detections, name='export_detections'),
+    path('detections/<int:event_id>/clip/', views.event_clip, name='event_clip'),
+    path('alerts/webhook/', views.alert_webhook, name='alert_webhook'),
+    path('metrics', views.metrics, name='metrics'),
     
     
 ]
@@ -1,138 +1,190 @@
+import csv
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
-import sqlite3
-from collections import Counter
-from datetime import datetime
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .analytics import (EXPORT_EVENT_COLUMNS, event_to_dict, fetch_events, iter_detections, iter_events,
+                        summarize_events)
+from .metrics import CONTENT_TYPE, registry
+from .retention import DETECTION_COLUMNS
+from .storage import connect_readonly
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
 
 
 def ppe_detection(request): 
     return render(request, 'ppe_detection.html')
 
 
+def int_param(request, name, default=None):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    return int(value)
+
+
+def time_param(request, name, end_of_day=False):
+    # 'YYYY-MM-DD' or an ISO date and time, as the stored timestamp format.
+    # A bare date as the end of a range includes that whole day.
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return None
+    if len(value) == 10:
+        parsed = datetime.strptime(value, '%Y-%m-%d')
+        if end_of_day:
+            parsed += timedelta(days=1, seconds=-1)
+    else:
+        parsed = datetime.fromisoformat(value)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
 def detection_list(request):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('detections.db')
-    cursor = conn.cursor()
-
-    # Retrieve all detection data from the database
-    cursor.execute("SELECT * FROM detections ORDER BY timestamp DESC")
-    detections = cursor.fetchall()
-
-    # Calculate total number of detections, total class IDs, and total class names
-    total_detections = len(detections)
-    class_ids = set([detection[1] for detection in detections])  # Assuming class_id is in index 1
-    class_names = set([detection[2] for detection in detections])  # Assuming class_name is in index 2
-    
-    total_class_ids = len(class_ids)
-    total_class_names = len(class_names)
-
-    # Calculate most frequent class names (with counts)
-    class_names_list = [detection[2] for detection in detections]  # Assuming class_name is in index 2
-    class_name_counts = Counter(class_names_list)
-    most_frequent_classes = class_name_counts.most_common(5)  # Get class names with counts
-
-    # Calculate detection counts by time of day
-    time_based_counts = {
-        '6 AM - 12 PM': 0,
-        '12 PM - 6 PM': 0,
-        '6 PM - 12 AM': 0,
-        '12 AM - 6 AM': 0
-    }
-
-    # Iterate through the detections to calculate time-based counts
-    for detection in detections:
-        timestamp = datetime.strptime(detection[6], "%Y-%m-%d %H:%M:%S")  # Assuming timestamp is in index 6
-        hour = timestamp.hour
-        
-        if 6 <= hour < 12:
-            time_based_counts['6 AM - 12 PM'] += 1
-        elif 12 <= hour < 18:
-            time_based_counts['12 PM - 6 PM'] += 1
-        elif 18 <= hour < 24:
-            time_based_counts['6 PM - 12 AM'] += 1
-        else:
-            time_based_counts['12 AM - 6 AM'] += 1
-
-    # Close the database connection
-    conn.close()
+    # Latest detection events plus the statistics, aggregated in SQL
+    conn = connect_readonly()
+    try:
+        detections = fetch_events(conn)
+        summary = summarize_events(conn)
+    finally:
+        conn.close()
 
     # Pass the detections and totals to the template
     return render(request, 'detection_logs.html', {
         'detections': detections,
-        'total_detections': total_detections,
-        'total_class_ids': total_class_ids,
-        'total_class_names': total_class_names,
-        'most_frequent_classes': most_frequent_classes,
-        'time_based_counts': time_based_counts  # Pass the time-based counts to the template
+        **summary,
     })
 
 
 def fetch_detections(request):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('detections.db')
-    cursor = conn.cursor()
-
-    # Retrieve the latest detection data from the database
-    cursor.execute("SELECT * FROM detections ORDER BY timestamp DESC")
-    detections = cursor.fetchall()
-
-    # Close the database connection
-    conn.close()
-
-    # Convert detections into a JSON-friendly format
-    detections_data = []
-    for detection in detections:
-        detections_data.append({
-            'id': detection[0],
-            'class_id': detection[1],
-            'class_name': detection[2],
-            'confidence': detection[3],
-            'track_id': detection[4],
-            'bbox': detection[5],
-            'timestamp': detection[6]
-        })
-
-    # Calculate total number of detections, total class IDs, and total class names
-    total_detections = len(detections)
-    class_ids = set([detection[1] for detection in detections])
-    class_names = set([detection[2] for detection in detections])
-
-    total_class_ids = len(class_ids)
-    total_class_names = len(class_names)
-
-    # Calculate most frequent class names (with counts)
-    class_names_list = [detection[2] for detection in detections]
-    class_name_counts = Counter(class_names_list)
-    most_frequent_classes = class_name_counts.most_common(5)  # Get class names with counts
-
-    # Calculate detection counts by time of day
-    time_based_counts = {
-        '6 AM - 12 PM': 0,
-        '12 PM - 6 PM': 0,
-        '6 PM - 12 AM': 0,
-        '12 AM - 6 AM': 0
-    }
-
-    # Iterate through the detections to calculate time-based counts
-    for detection in detections:
-        timestamp = datetime.strptime(detection[6], "%Y-%m-%d %H:%M:%S")  # Assuming timestamp is in index 6
-        hour = timestamp.hour
-        
-        if 6 <= hour < 12:
-            time_based_counts['6 AM - 12 PM'] += 1
-        elif 12 <= hour < 18:
-            time_based_counts['12 PM - 6 PM'] += 1
-        elif 18 <= hour < 24:
-            time_based_counts['6 PM - 12 AM'] += 1
-        else:
-            time_based_counts['12 AM - 6 AM'] += 1
+    # Incremental: ?since_id=<last id seen> returns only newer events.
+    # Paging: ?before_id=<oldest id seen> returns the next older page.
+    try:
+        since_id = int_param(request, 'since_id')
+        before_id = int_param(request, 'before_id')
+        limit = int_param(request, 'limit', 100)
+    except ValueError:
+        return JsonResponse({'error': 'since_id, before_id and limit must be integers'}, status=400)
+
+    conn = connect_readonly()
+    try:
+        detections = fetch_events(conn, since_id=since_id, before_id=before_id, limit=limit)
+        summary = summarize_events(conn)
+    finally:
+        conn.close()
+
+    detections_data = [event_to_dict(detection) for detection in detections]
 
     # Return a JSON response with the detections, totals, most frequent class names, and time-based counts
     return JsonResponse({
         'detections': detections_data,
-        'total_detections': total_detections,
-        'total_class_ids': total_class_ids,
-        'total_class_names': total_class_names,
-        'most_frequent_classes': most_frequent_classes,  # Include only class names with counts
-        'time_based_counts': time_based_counts  # Include the time-based counts
+        'last_id': detections_data[0]['id'] if detections_data else since_id,
+        'next_before_id': detections_data[-1]['id'] if detections_data else None,
+        **summary,
     })
+
+
+class Echo:
+    # File-like object for csv.writer that hands each row back instead of
+    # buffering it
+
+    def write(self, value):
+        return value
+
+
+async def export_rows(make_chunks, columns, export_format):
+    # Async generator behind the export response, so the ASGI server sends
+    # each chunk as soon as it is read instead of collecting the whole
+    # export first. The queries run in worker threads on a connection of
+    # its own, closed when the export ends or the client goes away.
+    read = sync_to_async(next, thread_sensitive=False)
+    conn = await sync_to_async(connect_readonly, thread_sensitive=False)()
+    writer = csv.writer(Echo())
+    try:
+        chunks = make_chunks(conn)
+        if export_format == 'csv':
+            yield writer.writerow(columns)
+        while True:
+            rows = await read(chunks, None)
+            if rows is None:
+                break
+            if export_format == 'csv':
+                yield ''.join(writer.writerow(row) for row in rows)
+            else:
+                yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+    finally:
+        conn.close()
+
+
+def export_detections(request):
+    # Streams the detection history as NDJSON (default) or CSV.
+    # ?source=events exports track events (default), ?source=raw the raw
+    # detections still in the database. Filters: start and end (inclusive
+    # date or date and time), class_id (repeatable or comma separated),
+    # camera_id and track_id.
+    export_format = request.GET.get('format', 'ndjson')
+    source = request.GET.get('source', 'events')
+    if export_format not in EXPORT_FORMATS or source not in ('events', 'raw'):
+        return JsonResponse({'error': 'format must be ndjson or csv and source events or raw'}, status=400)
+    try:
+        filters = {
+            'start': time_param(request, 'start'),
+            'end': time_param(request, 'end', end_of_day=True),
+            'class_ids': [int(class_id) for value in request.GET.getlist('class_id')
+                          for class_id in value.split(',') if class_id],
+            'camera_id': request.GET.get('camera_id') or None,
+            'track_id': int_param(request, 'track_id'),
+        }
+    except ValueError:
+        return JsonResponse({'error': 'start and end must be dates or date times, '
+                                      'class_id and track_id integers'}, status=400)
+
+    chunk_size = getattr(settings, 'PPE_EXPORT_CHUNK_SIZE', 1000)
+    if source == 'raw':
+        iterate, columns = iter_detections, DETECTION_COLUMNS
+    else:
+        iterate, columns = iter_events, EXPORT_EVENT_COLUMNS
+
+    rows = export_rows(lambda conn: iterate(conn, chunk_size, **filters), columns, export_format)
+    response = StreamingHttpResponse(rows, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{source}.{export_format}"'
+    return response
+
+
+def event_clip(request, event_id):
+    # The violation clip recorded for a track event
+    conn = connect_readonly()
+    try:
+        row = conn.execute('SELECT clip_path FROM track_events WHERE id = ?', (event_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None or not row[0] or not os.path.isfile(row[0]):
+        raise Http404('No clip for this event')
+    return FileResponse(open(row[0], 'rb'), filename=os.path.basename(row[0]))
+
+
+@csrf_exempt
+@require_POST
+def alert_webhook(request):
+    # Local stand-in for an alerting service, target of the 'webhook' sink
+    try:
+        alert = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'expected a JSON body'}, status=400)
+    logger.info("Webhook alert: %s", alert)
+    return HttpResponse(status=204)
+
+
+def metrics(request):
+    # Prometheus text format; values are those of the serving process
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
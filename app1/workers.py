@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+from channels.layers import get_channel_layer
+
+
+logger = logging.getLogger(__name__)
+
+# Workers announce themselves here; producers listen to pick a worker per camera
+WORKERS_GROUP = 'ppe_inference_workers'
+
+
+def job_channel(worker_id):
+    # Channel a worker receives the frame jobs of its cameras on
+    return f"ppe_inference.{re.sub(r'[^A-Za-z0-9_.-]', '_', worker_id)}"
+
+
+def camera_group(camera_id):
+    # Group the detections of a camera are published to
+    return f"ppe_detections.{re.sub(r'[^A-Za-z0-9_.-]', '_', str(camera_id))}"
+
+
+def assign(camera_id, workers):
+    # Rendezvous hashing: every process picks the same worker for a camera
+    # from the same live set, and when a worker leaves only its own cameras
+    # move to another one
+    if not workers:
+        return None
+    return max(workers, key=lambda worker: hashlib.md5(f'{camera_id}:{worker}'.encode()).digest())
+
+
+def pack_boxes(result):
+    boxes = result.boxes.cpu().numpy()
+    return [boxes.xyxy.reshape(-1, 4).tolist(), boxes.conf.tolist(), boxes.cls.tolist()]
+
+
+class RemoteBoxes:
+    # The part of ultralytics' Boxes interface that Zones.boxes reads
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32)
+        self.cls = np.asarray(cls, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+
+class RemoteResult:
+
+    def __init__(self, boxes):
+        self.boxes = RemoteBoxes(*boxes)
+
+
+class WorkerDirectory:
+    # Live workers by heartbeat; a worker silent for `timeout` seconds is
+    # considered dead and its cameras are reassigned
+
+    def __init__(self, timeout=3.0):
+        self.timeout = timeout
+        self.last_seen = {}
+        self._lock = threading.Lock()
+
+    def seen(self, worker_id, now=None):
+        with self._lock:
+            self.last_seen[worker_id] = time.monotonic() if now is None else now
+
+    def leave(self, worker_id):
+        with self._lock:
+            self.last_seen.pop(worker_id, None)
+
+    def live(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for worker_id, seen in list(self.last_seen.items()):
+                if now - seen > self.timeout:
+                    del self.last_seen[worker_id]
+                    logger.warning("Inference worker %s stopped sending heartbeats", worker_id)
+            return sorted(self.last_seen)
+
+    def worker_for(self, camera_id, now=None):
+        return assign(camera_id, self.live(now))
+
+
+class InferencePool:
+    # Producer side of the worker pool. submit() is called from the pipeline
+    # thread and sends a frame job to the camera's worker; the results the
+    # workers publish to the camera groups are collected by a listener task
+    # on the event loop and picked up with take_results().
+
+    def __init__(self, worker_timeout=3.0, quality=90):
+        self.directory = WorkerDirectory(worker_timeout)
+        self.quality = quality
+        self.loop = None
+        self.channel = None
+        self.names = {}  # Class names of the workers' model, from their heartbeats
+        self.results = deque()
+        self.on_result = None  # Wakes the pipeline thread
+        self.sent = 0
+        self.received = 0
+        self._assigned = {}
+
+    async def start(self):
+        if self.channel is not None:
+            return
+        layer = get_channel_layer()
+        self.loop = asyncio.get_running_loop()
+        self.channel = await layer.new_channel()
+        await layer.group_add(WORKERS_GROUP, self.channel)
+        asyncio.create_task(self.listen(layer))
+
+    async def follow(self, camera_id):
+        await get_channel_layer().group_add(camera_group(camera_id), self.channel)
+
+    async def unfollow(self, camera_id):
+        await get_channel_layer().group_discard(camera_group(camera_id), self.channel)
+
+    async def listen(self, layer):
+        while True:
+            message = await layer.receive(self.channel)
+            if message['type'] == 'worker.heartbeat':
+                self.directory.seen(message['worker'])
+                self.names.update(message['names'])
+            elif message['type'] == 'worker.leaving':
+                self.directory.leave(message['worker'])
+            elif message['type'] == 'inference.result' and message['producer'] == self.channel:
+                # Other processes streaming the same camera get their own results
+                self.received += 1
+                results = [RemoteResult(boxes) for boxes in message['boxes']]
+                self.results.append((message['camera'], message['frame_id'], results))
+                if self.on_result is not None:
+                    self.on_result()
+
+    def submit(self, camera_id, frame_id, crops):
+        # Returns the worker the job went to, None when no worker is alive
+        worker = self.directory.worker_for(camera_id)
+        if worker != self._assigned.get(camera_id):
+            logger.info("Camera %s assigned to inference worker %s", camera_id, worker)
+            self._assigned[camera_id] = worker
+        if worker is None or self.loop is None:
+            return None
+
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        job = {
+            'type': 'inference.job',
+            'camera': camera_id,
+            'frame_id': frame_id,
+            'producer': self.channel,
+            'sent_at': time.time(),
+            'crops': [cv2.imencode('.jpg', crop, params)[1].tobytes() for crop in crops],
+        }
+        asyncio.run_coroutine_threadsafe(get_channel_layer().send(job_channel(worker), job), self.loop)
+        self.sent += 1
+        return worker
+
+    def take_results(self):
+        results = []
+        while self.results:
+            results.append(self.results.popleft())
+        return results
+
+    def stats(self):
+        return {
+            'workers': self.directory.live(),
+            'assignments': dict(self._assigned),
+            'jobs_sent': self.sent,
+            'results_received': self.received,
+        }
+
+
+async def run_worker(worker_id, model, heartbeat_interval=1.0, job_timeout=2.0):
+    # Worker side: runs the model on the jobs sent to this worker and
+    # publishes the boxes to the camera's group. Jobs older than job_timeout
+    # are skipped, their producer has given up on them already.
+    layer = get_channel_layer()
+    loop = asyncio.get_running_loop()
+    channel = job_channel(worker_id)
+    stats = {'jobs': 0, 'stale': 0}
+    # As pairs: the channel layer serialises dicts with string keys only
+    names = [[class_id, name] for class_id, name in dict(model.names).items()]
+
+    async def heartbeat():
+        while True:
+            await layer.group_send(WORKERS_GROUP, {
+                'type': 'worker.heartbeat',
+                'worker': worker_id,
+                'names': names,
+                'jobs': stats['jobs'],
+            })
+            await asyncio.sleep(heartbeat_interval)
+
+    heartbeats = asyncio.create_task(heartbeat())
+    logger.info("Inference worker %s receiving on %s", worker_id, channel)
+    try:
+        while True:
+            job = await layer.receive(channel)
+            if time.time() - job['sent_at'] > job_timeout:
+                stats['stale'] += 1
+                continue
+
+            images = [cv2.imdecode(np.frombuffer(crop, np.uint8), cv2.IMREAD_COLOR) for crop in job['crops']]
+            results = await loop.run_in_executor(None, model, images) if images else []
+            stats['jobs'] += 1
+            await layer.group_send(camera_group(job['camera']), {
+                'type': 'inference.result',
+                'camera': job['camera'],
+                'frame_id': job['frame_id'],
+                'producer': job['producer'],
+                'worker': worker_id,
+                'boxes': [pack_boxes(result) for result in results],
+            })
+    finally:
+        heartbeats.cancel()
+        # Lets producers move the cameras right away instead of after the timeout
+        await layer.group_send(WORKERS_GROUP, {'type': 'worker.leaving', 'worker': worker_id})
+        logger.info("Inference worker %s stopped after %s jobs (%s stale)", worker_id, stats['jobs'], stats['stale'])
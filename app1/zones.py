@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+
+class Zones:
+    # Polygon detection zones of one camera. Inference runs only on crops
+    # of the frame covering the zones (overlapping crops are merged), boxes
+    # are mapped back to frame coordinates and those whose center lies
+    # outside every zone are dropped. Without zones the whole frame is used.
+
+    def __init__(self, polygons=(), padding=16):
+        if isinstance(polygons, dict):
+            self.names, polygons = list(polygons), list(polygons.values())  # {'gate': [[x, y], ...], ...}
+        else:
+            self.names = [str(i) for i in range(len(polygons))]
+        self.polygons = [np.asarray(polygon, dtype=np.int32).reshape(-1, 2) for polygon in polygons]
+        self.rects = merge_rects([
+            (*(polygon.min(axis=0) - padding), *(polygon.max(axis=0) + padding))
+            for polygon in self.polygons
+        ])
+
+    def __bool__(self):
+        return bool(self.polygons)
+
+    def windows(self, frame):
+        # (x1, y1, x2, y2) of every crop, clipped to the frame
+        height, width = frame.shape[:2]
+        windows = []
+        for x1, y1, x2, y2 in self.rects:
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+            if x2 > x1 and y2 > y1:
+                windows.append((x1, y1, x2, y2))
+        return windows
+
+    def crops(self, frame):
+        if not self:
+            return [frame]
+        return [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in self.windows(frame)]
+
+    def boxes(self, frame, results):
+        # Boxes of the crop results in frame coordinates, zone-filtered:
+        # (xyxy, confidences, class_ids)
+        offsets = self.windows(frame) if self else [(0, 0)]
+        xyxy, confidences, class_ids = [], [], []
+        for (x1, y1, *_), result in zip(offsets, results):
+            boxes = result.boxes.cpu().numpy()
+            xyxy.append(boxes.xyxy.reshape(-1, 4) + np.array([x1, y1, x1, y1], dtype=np.float32))
+            confidences.append(boxes.conf)
+            class_ids.append(boxes.cls.astype(int))
+
+        if not xyxy:
+            return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+        xyxy, confidences, class_ids = np.concatenate(xyxy), np.concatenate(confidences), np.concatenate(class_ids)
+        if self:
+            keep = self.contains((xyxy[:, :2] + xyxy[:, 2:]) / 2)
+            xyxy, confidences, class_ids = xyxy[keep], confidences[keep], class_ids[keep]
+        return xyxy, confidences, class_ids
+
+    def contains(self, points):
+        # Boolean mask of the points that lie in at least one zone
+        return np.array([name is not None for name in self.zone_names(points)], dtype=bool)
+
+    def zone_names(self, points):
+        # Name of the first zone containing each point, None outside all
+        return [
+            next((name for name, polygon in zip(self.names, self.polygons)
+                  if cv2.pointPolygonTest(polygon, (float(x), float(y)), False) >= 0), None)
+            for x, y in points
+        ]
+
+    def draw(self, frame, color=(255, 200, 0), scale=1.0):
+        if self:
+            polygons = self.polygons if scale == 1.0 else [
+                np.round(polygon * scale).astype(np.int32) for polygon in self.polygons]
+            cv2.polylines(frame, polygons, True, color, 2)
+
+
+def merge_rects(rects):
+    # Replaces overlapping rectangles by their union until none overlap
+    rects = [tuple(int(value) for value in rect) for rect in rects]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
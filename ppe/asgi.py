@@ -1,13 +1,27 @@
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ppe.settings')
+
+# Set up Django before importing consumers, which read settings at import time
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+from django.conf import settings
 from app1.routing import websocket_urlpatterns
+from app1 import resources
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ppe.settings')
+# Streaming workers load and warm up the model in the background at startup;
+# HTTP-only workers set PPE_PRELOAD_MODEL=0 and never load it, and neither
+# do workers reading from the inference service (PPE_FRAME_BUS) or sending
+# frames to the inference workers (PPE_INFERENCE_WORKERS)
+if (getattr(settings, 'PPE_PRELOAD_MODEL', True) and not getattr(settings, 'PPE_FRAME_BUS', False)
+        and not getattr(settings, 'PPE_INFERENCE_WORKERS', False)):
+    resources.warm_up_in_background()
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(websocket_urlpatterns)
     ),
@@ -137,6 +137,18 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Set PPE_REDIS_URL (e.g. redis://localhost:6379) to share the channel layer
+# between processes, so dashboards served by any worker get detection events
+if os.environ.get('PPE_REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.environ['PPE_REDIS_URL']],
+            },
+        },
+    }
+
 # CHANNEL_LAYERS = {
 #     'default': {
 #         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -145,3 +157,194 @@ CHANNEL_LAYERS = {
 #         },
 #     },
 # }
+
+
+# Logging: app1 logs at PPE_LOG_LEVEL (environment, default INFO); per-frame
+# details are DEBUG
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'app1': {'handlers': ['console'], 'level': os.environ.get('PPE_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
+# PPE detection
+
+# Cameras served on ws/video_stream/<camera_id>/ (ws/video_stream/ is the
+# 'default' camera). A source is a device index, a video file or an RTSP URL.
+# Video files replay in a loop at their own frame rate; set 'realtime': False
+# to read them as fast as the pipeline takes frames, 'loop': False to stop at
+# the end.
+PPE_CAMERAS = {
+    'default': {'source': 0, 'width': 640, 'height': 480, 'fps': 30},
+}
+# A camera config can add 'zones', a list of polygons (or a dict of named
+# polygons) in frame pixels, e.g. 'zones': {'gate': [[0, 200], [320, 200],
+# [320, 480], [0, 480]]}. Inference then only runs on crops around the
+# zones and detections centered outside them are dropped.
+# 'mjpeg': True asks a device for MJPEG and keeps each JPEG it sends, so
+# viewers in client overlay mode get the camera's frames without a re-encode.
+
+# Frames from up to PPE_BATCH_SIZE cameras are stacked into one model call,
+# waiting at most PPE_BATCH_MAX_WAIT seconds for the batch to fill
+PPE_BATCH_SIZE = 8
+PPE_BATCH_MAX_WAIT = 0.01
+
+# Run capture and inference once in `manage.py inference_service` and set
+# PPE_FRAME_BUS in the web workers, which then only read frames and
+# detections from shared memory (segments named <prefix>_<camera_id>,
+# PPE_FRAME_BUS_SLOTS frames each). Alerts and dashboard events then come
+# from the service process, so use the Redis channel layer.
+PPE_FRAME_BUS = os.environ.get('PPE_FRAME_BUS', '') == '1'
+PPE_FRAME_BUS_PREFIX = 'ppe'
+PPE_FRAME_BUS_SLOTS = 8
+
+# With PPE_INFERENCE_WORKERS, frames go over the channel layer (Redis) to
+# `manage.py inference_worker` processes on any node. Workers send a heartbeat
+# every PPE_WORKER_HEARTBEAT seconds; each camera is assigned to one live
+# worker and moves to another once its worker is silent for PPE_WORKER_TIMEOUT
+# seconds. At most PPE_WORKER_MAX_IN_FLIGHT frames per camera are out at a
+# time, and frames without a result after PPE_WORKER_JOB_TIMEOUT are dropped.
+PPE_INFERENCE_WORKERS = os.environ.get('PPE_INFERENCE_WORKERS', '') == '1'
+PPE_WORKER_HEARTBEAT = 1.0
+PPE_WORKER_TIMEOUT = 3.0
+PPE_WORKER_MAX_IN_FLIGHT = 2
+PPE_WORKER_JOB_TIMEOUT = 2.0
+PPE_WORKER_JPEG_QUALITY = 90
+
+# Clients that have not acknowledged a frame, or whose send has been blocked,
+# for this many seconds are disconnected
+PPE_STALL_TIMEOUT = 10.0
+
+# Frames sent to a client that acknowledges them (the page does) but not
+# acknowledged yet; newer frames replace the waiting one until an ack arrives
+PPE_MAX_FRAMES_IN_FLIGHT = 2
+
+# Stream profiles as (resolution scale, JPEG quality, max FPS or 0 for every
+# frame), best first. Clients start at PPE_STREAM_PROFILE and can pick another
+# with the set_stream_profile action. With PPE_ADAPTIVE_STREAMING, a client
+# whose median latency (ack round trip, or send time for clients that do not
+# acknowledge frames) stays above PPE_STREAM_SLOW_LATENCY seconds moves
+# a step down, and back up once it stays below PPE_STREAM_FAST_LATENCY (at
+# most every PPE_STREAM_UPGRADE_AFTER seconds).
+PPE_STREAM_PROFILES = {
+    'high': (1.0, 95, 0),
+    'medium': (0.75, 80, 15),
+    'low': (0.5, 65, 10),
+    'minimal': (0.35, 50, 5),
+}
+PPE_STREAM_PROFILE = 'high'
+PPE_ADAPTIVE_STREAMING = True
+PPE_STREAM_SLOW_LATENCY = 0.25
+PPE_STREAM_FAST_LATENCY = 0.08
+PPE_STREAM_UPGRADE_AFTER = 10.0
+
+# Detections are written by a background thread in one transaction per
+# PPE_DB_BATCH_SIZE rows or per PPE_DB_FLUSH_INTERVAL seconds
+PPE_DETECTIONS_DB = 'detections.db'
+PPE_DB_BATCH_SIZE = 500
+PPE_DB_FLUSH_INTERVAL = 0.5
+
+# Retention: raw detection rows are stored in daily partitions and kept for
+# PPE_RAW_RETENTION_DAYS and track events for PPE_EVENT_RETENTION_DAYS (the
+# hourly rollups are kept). Expired rows are archived as compressed .npz
+# files (one array per column) in PPE_ARCHIVE_DIR. The writer runs this in a
+# background thread every PPE_COMPACT_INTERVAL seconds, without VACUUM; set 0
+# to run `manage.py compact_detections` from cron instead, which also VACUUMs.
+PPE_RAW_RETENTION_DAYS = 7
+PPE_EVENT_RETENTION_DAYS = 90
+PPE_ARCHIVE_DIR = 'archive'
+PPE_COMPACT_INTERVAL = 24 * 3600
+
+# Rows read per query by the streaming export (detections/export/)
+PPE_EXPORT_CHUNK_SIZE = 1000
+
+# Detections are stored as one track_events row per track, closed once the
+# track has not been seen for PPE_TRACK_EVENT_TIMEOUT seconds. Set
+# PPE_RAW_DETECTION_SAMPLING to N to also log raw boxes of every Nth frame.
+PPE_TRACK_EVENT_TIMEOUT = 2.0
+PPE_RAW_DETECTION_SAMPLING = 0
+
+# Boxes below PPE_MIN_CONFIDENCE are ignored. Each client filters by its own
+# threshold (PPE_CONFIDENCE_THRESHOLD until it sets one); storage and alerts
+# always use PPE_CONFIDENCE_THRESHOLD.
+PPE_MIN_CONFIDENCE = 0.1
+PPE_CONFIDENCE_THRESHOLD = 0.3
+
+# Tracker: 'iou' (built in), or 'bytetrack' / 'botsort' from ultralytics.
+# The IoU tracker drops tracks unseen for PPE_TRACK_MAX_AGE seconds and
+# keeps the last PPE_TRACK_HISTORY boxes of each track.
+PPE_TRACKER = 'iou'
+PPE_TRACK_IOU_THRESHOLD = 0.3
+PPE_TRACK_MAX_AGE = 1.0
+PPE_TRACK_HISTORY = 30
+
+# Frame scheduling. Cameras are read at PPE_TARGET_FPS (None: the camera's
+# fps) and every PPE_DETECT_EVERY-th moving frame goes through inference; the
+# frames in between follow the last detections. Scenes whose thumbnail does
+# not change by PPE_MOTION_THRESHOLD (mean gray level, 0 disables the gate)
+# for PPE_IDLE_AFTER seconds drop to PPE_IDLE_FPS and skip inference, except
+# for one detection every PPE_MAX_DETECT_INTERVAL seconds. A target FPS of 0
+# reads frames unpaced. Live cameras are still drained at their own rate, the
+# frames that are not due are dropped undecoded. Camera configs can override
+# each of these with the lower-case key (target_fps, idle_fps, ...).
+PPE_TARGET_FPS = None
+PPE_IDLE_FPS = 2
+PPE_DETECT_EVERY = 1
+PPE_MAX_DETECT_INTERVAL = 1.0
+PPE_MOTION_THRESHOLD = 4.0
+PPE_IDLE_AFTER = 2.0
+
+# Alert rules: a track of one of class_ids (inside one of zones, if given)
+# that stays in view for dwell seconds alerts, then again at most once per
+# cooldown seconds. Alerts go to every sink in PPE_ALERT_SINKS: 'sound',
+# 'webhook' (POST to PPE_ALERT_WEBHOOK_URL), 'websocket' (the video stream
+# pages), 'log' or 'null'. Servers without audio drop 'sound'.
+PPE_ALERT_RULES = [
+    {'name': 'missing-ppe', 'class_ids': [1, 2], 'dwell': 3.0, 'cooldown': 30.0},
+]
+PPE_ALERT_SINKS = ['sound', 'websocket', 'log']
+PPE_ALERT_WEBHOOK_URL = 'http://127.0.0.1:8000/alerts/webhook/'
+PPE_ALERT_WEBHOOK_TIMEOUT = 2.0
+
+# Alert clips: the last PPE_CLIP_PRE_SECONDS of every camera are kept in
+# memory as JPEGs (PPE_CLIP_FPS frames per second, at most PPE_CLIP_BUFFER_MB
+# per camera). When an alert fires, those frames and the next
+# PPE_CLIP_POST_SECONDS are written to PPE_CLIP_DIR by a background thread
+# (OpenCV fourcc PPE_CLIP_CODEC) and the clip is linked to the track event.
+# Clips wait for that thread in memory, up to PPE_CLIP_PENDING_MB; clips
+# past it are skipped (ppe_clips_total{outcome="skipped"}).
+PPE_CLIPS = True
+PPE_CLIP_DIR = 'clips'
+PPE_CLIP_PRE_SECONDS = 5.0
+PPE_CLIP_POST_SECONDS = 5.0
+PPE_CLIP_FPS = 10
+PPE_CLIP_QUALITY = 80
+PPE_CLIP_BUFFER_MB = 32
+PPE_CLIP_CODEC = 'mp4v'
+PPE_CLIP_EXTENSION = '.mp4'
+PPE_CLIP_PENDING_MB = 64
+
+# The model is loaded on first use. ASGI workers warm it up at startup with a
+# PPE_WARMUP_SIZE x PPE_WARMUP_SIZE dummy frame unless PPE_PRELOAD_MODEL=0 is
+# set in the environment (e.g. for workers that only serve HTTP).
+PPE_MODEL_PATH = 'app1/best.pt'
+PPE_ALERT_SOUND = 'app1/alert.mp3'
+PPE_PRELOAD_MODEL = os.environ.get('PPE_PRELOAD_MODEL', '1') != '0'
+PPE_WARMUP_SIZE = 640
+
+# Inference backend: 'pytorch' (eager), or 'onnx', 'openvino' or
+# 'torchscript' to run a version exported next to PPE_MODEL_PATH (exported
+# on first use if missing). PPE_INFERENCE_IMGSZ is the model input size, e.g.
+# 320 to halve the resolution on CPU-only boxes. PPE_INFERENCE_THREADS caps
+# the CPU threads of every backend (None leaves the runtime default).
+PPE_INFERENCE_BACKEND = 'pytorch'
+PPE_INFERENCE_IMGSZ = 640
+PPE_INFERENCE_THREADS = None
@@ -8,8 +8,18 @@
         const setClassButton = document.getElementById('set-class-button');
         const confidenceSlider = document.getElementById('confidence-slider');
         const confidenceValue = document.getElementById('confidence-value');
-        const websocketUrl = 'ws://localhost:8000/ws/video_stream/';
+        const overlayCanvas = document.getElementById('overlay-canvas');
+        const params = new URLSearchParams(window.location.search);
+        const cameraId = params.get('camera') || 'default';
+        // Boxes are drawn here on clean frames; ?overlay=server has the
+        // server draw them into the JPEG instead
+        const overlayMode = params.get('overlay') === 'server' ? 'server' : 'client';
+        // ?profile=low etc. pins a stream profile; without it the server
+        // adapts resolution and quality to how fast frames get through
+        const streamProfile = params.get('profile');
+        const websocketUrl = `ws://localhost:8000/ws/video_stream/${cameraId}/`;
         let socket = null;
+        let framesReceived = 0;  // Frames of this connection, acknowledged to the server
         let currentClassIds = [];
         let confidenceThreshold = 0.1; // Default confidence threshold
 
@@ -41,21 +51,110 @@
             }
         }
 
+        // Binary frames: 4-byte big-endian metadata length, JSON metadata, JPEG bytes
+        function parseBinaryFrame(buffer) {
+            const headerLength = new DataView(buffer).getUint32(0);
+            const header = new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength));
+            const jpeg = new Blob([new Uint8Array(buffer, 4 + headerLength)], { type: 'image/jpeg' });
+            return { metadata: JSON.parse(header), jpeg: jpeg };
+        }
+
+        function clearOverlay() {
+            overlayCanvas.getContext('2d').clearRect(0, 0, overlayCanvas.width, overlayCanvas.height);
+        }
+
+        // Same colors as the server side drawing: red for class 1 and 2
+        function drawOverlay(metadata) {
+            if (!metadata.width) {
+                clearOverlay();  // Frame with the boxes already drawn in
+                return;
+            }
+            overlayCanvas.width = videoFrame.clientWidth;
+            overlayCanvas.height = videoFrame.clientHeight;
+            const ctx = overlayCanvas.getContext('2d');
+            ctx.setTransform(overlayCanvas.width / metadata.width, 0, 0, overlayCanvas.height / metadata.height, 0, 0);
+
+            ctx.strokeStyle = 'rgb(255, 255, 0)';
+            ctx.lineWidth = 2;
+            for (const zone of metadata.zones || []) {
+                ctx.beginPath();
+                zone.forEach(([x, y], i) => (i ? ctx.lineTo(x, y) : ctx.moveTo(x, y)));
+                ctx.closePath();
+                ctx.stroke();
+            }
+
+            ctx.lineWidth = 4;
+            ctx.font = '14px sans-serif';
+            for (const obj of metadata.detected_objects || []) {
+                const [x1, y1, x2, y2] = obj.bbox;
+                const color = [1, 2].includes(obj.class_id) ? 'rgb(255, 0, 0)' : 'rgb(0, 255, 0)';
+                ctx.strokeStyle = color;
+                ctx.fillStyle = color;
+                ctx.strokeRect(x1, y1, x2 - x1, y2 - y1);
+                ctx.fillText(`${obj.class_name} (${obj.confidence.toFixed(2)})`, x1, y1 - 10);
+            }
+        }
+
+        function showFrame(src, metadata) {
+            requestAnimationFrame(() => {
+                const previousSrc = videoFrame.src;
+                videoFrame.src = src;
+                if (previousSrc.startsWith('blob:')) {
+                    URL.revokeObjectURL(previousSrc);
+                }
+                drawOverlay(metadata);
+                const classNames = [...new Set((metadata.detected_objects || []).map(obj => obj.class_name))];
+                detectedClassesDiv.textContent = 'Detected Classes: ' + classNames.join(', ');
+            });
+        }
+
+        // The server keeps only a couple of unacknowledged frames in flight,
+        // so a slow connection gets fewer, smaller frames instead of a backlog
+        function ackFrame() {
+            framesReceived += 1;
+            socket.send(JSON.stringify({ action: 'frame_ack', seq: framesReceived }));
+        }
+
         function connectWebSocket() {
-            socket = new WebSocket(websocketUrl);
+            framesReceived = 0;
+            // Servers that support it answer with the binary subprotocol;
+            // otherwise frames arrive as base64 JSON
+            socket = new WebSocket(websocketUrl, ['ppe.binary']);
+            socket.binaryType = 'arraybuffer';
 
             socket.onopen = function () {
                 console.log('WebSocket connected');
                 updateStatus(true);
+                socket.send(JSON.stringify({ action: 'set_overlay', overlay: overlayMode }));
+                if (streamProfile) {
+                    socket.send(JSON.stringify({ action: 'set_stream_profile', profile: streamProfile, adaptive: false }));
+                }
             };
 
             socket.onmessage = function (event) {
+                if (event.data instanceof ArrayBuffer) {
+                    ackFrame();
+                    const frame = parseBinaryFrame(event.data);
+                    showFrame(URL.createObjectURL(frame.jpeg), frame.metadata);
+                    return;
+                }
+
                 const data = JSON.parse(event.data);
-                if (data) {
-                    requestAnimationFrame(() => {
-                        videoFrame.src = 'data:image/jpeg;base64,' + data.frame;
-                        detectedClassesDiv.textContent = 'Detected Classes: ' + data.detected_classes.join(', ');
-                    });
+                if (data && data.alert) {
+                    const alert = data.alert;
+                    statusDiv.title = `${alert.class_name} on camera ${alert.camera_id} for ${alert.duration}s`;
+                    console.warn(`Alert ${alert.rule}: track ${alert.track_id} (${alert.class_name}) on camera ${alert.camera_id}`);
+                    return;
+                }
+                if (data && data.error) {
+                    // The stream could not start; the server closes the socket
+                    statusDiv.title = data.error;
+                    console.error(data.error);
+                    return;
+                }
+                if (data && data.frame) {
+                    ackFrame();
+                    showFrame('data:image/jpeg;base64,' + data.frame, data);
                 }
             };
 
@@ -76,6 +175,7 @@
                 socket = null;
                 updateStatus(false);
                 videoFrame.src = "";
+                clearOverlay();
                 detectedClassesDiv.textContent = '';
             }
         }